@@ -10,14 +10,30 @@ from aiogram import Bot, Dispatcher, types, F, Router
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from openai import OpenAI
 from sqlalchemy import select, update
 
-from app.database.models import async_session, Product, ProductPhoto, User, Order, OrderItem, Color, Size, Category, Subcategory, \
-    OrderGroup
+from app.database.models import async_session, User, Order, OrderItem, Color, Size, OrderGroup
+from app.database.catalog import get_catalog, CatalogProduct
+from app.database.recommender import get_related
+from app.database.order_groups import refresh_group_summaries
+from app.ai_module.search_index import get_search_index, SEARCH_TOP_K
+from app.ai_module.llm_client import chat_completion, stream_chat_completion
+from app.ai_module.model_router import LLMTask
+from app.ai_module.resilience import llm_guard, LLMUnavailableError
+from app.ai_module.query_cache import ranking_cache, normalize_query
+from app.ai_module.llm_scheduler import LLMPriority, LLMOverloadedError
+from app.ai_module.streaming import TelegramStreamWriter, STREAMING_ENABLED
+from app.ai_module.history import maintain_history
+from app.ai_module.phrases import compose, detect_language, DEFAULT_LANGUAGE
+from app.ai_module.memo import memoized_tool, turn_scoped
+from app.ai_module.session_store import SessionStore
+from app.ai_module.mailbox import UserMailbox
+from app.ai_module.slots import Slots, parse_slots, refine_candidates
+from app.ai_module.intent_router import classify, intent_stats
+from app.ai_module.prompt_codec import CatalogPromptCodec, strip_for_prompt
+from app.ai_module.prompts import consultant_system_message, search_system_message
 from app.users.user.userHandlers import router
 from bot_instance import bot
-from app.database import requests as rq
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -29,23 +45,30 @@ ai_router = Router()
 # Загрузка переменных окружения
 load_dotenv()
 
-openai_client = None
+# Состояния диалогов и корзины: горячие в памяти, простаивающие выгружаются на диск
+user_states = SessionStore("states")
+user_carts = SessionStore("carts")
+
+
+def _can_coalesce(user_id: int) -> bool:
+    """Объединять сообщения можно только в свободном диалоге, а не при вводе имени, телефона, адреса или количества"""
+    state = user_states.get(user_id)
+    return state is not None and "waiting_for" not in state and "waiting_for_quantity" not in state
+
+
+def _merge_texts(payloads: List[tuple]) -> tuple:
+    """Несколько быстро отправленных сообщений становятся одной репликой; отвечаем на последнее"""
+    return payloads[-1][0], "\n".join(text for _, text in payloads)
+
+
+async def _preload_sessions(user_id: int) -> None:
+    """Выгруженные диалог и корзина подгружаются до обработчика, чтобы он не ждал диск в цикле событий"""
+    await user_states.preload(user_id)
+    await user_carts.preload(user_id)
 
-async def initialize_openai_client():
-    """
-    Инициализирует OpenAI клиент, получая API-ключ из базы данных.
-    """
-    global openai_client
-    api_key = await rq.get_setting_value("OPENAI_API")  # Берём ключ из БД
-    if api_key:
-        openai_client = OpenAI(api_key=api_key)
-        print("✅ OpenAI клиент инициализирован.")
-    else:
-        print("❌ Ошибка: API-ключ не найден в БД.")
 
-# Словарь для хранения состояний пользователей и их корзин
-user_states = {}
-user_carts = {}
+# События каждого клиента обрабатываются по очереди, разные клиенты - параллельно
+consultant_mailbox = UserMailbox(can_coalesce=_can_coalesce, prepare=_preload_sessions)
 
 # Определение инструментов (tools) для OpenAI
 tools = [
@@ -243,126 +266,116 @@ tools = [
 ]
 
 
+# Инструменты с побочными эффектами: внутри одного хода пользователя выполняются строго по очереди
+SIDE_EFFECT_TOOLS = {"add_to_cart", "complete_order", "update_user_info", "verify_user_data"}
+# Ответ после этих инструментов относится к оформлению заказа и обслуживается вне очереди просмотра
+CHECKOUT_TOOLS = {"complete_order", "get_user_info", "update_user_info", "verify_user_data"}
+
+
+async def execute_tool_calls(available_functions: Dict, calls: List[tuple]) -> List[Any]:
+    """
+    Выполняет вызовы инструментов одного ответа модели. Независимые вызовы идут параллельно,
+    вызовы из SIDE_EFFECT_TOOLS - последовательно в исходном порядке.
+    Результаты возвращаются в порядке calls; первая ошибка пробрасывается дальше.
+    """
+    results: List[Any] = [None] * len(calls)
+
+    async def run_one(index: int):
+        function_name, function_args = calls[index]
+        results[index] = await available_functions[function_name](function_args)
+
+    async def run_serial(indexes: List[int]):
+        for index in indexes:
+            await run_one(index)
+
+    serial = [i for i, (name, _) in enumerate(calls) if name in SIDE_EFFECT_TOOLS]
+    jobs = [run_one(i) for i, (name, _) in enumerate(calls) if name not in SIDE_EFFECT_TOOLS]
+    if serial:
+        jobs.append(run_serial(serial))
+
+    outcomes = await asyncio.gather(*jobs, return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    return results
+
+
 # Функции для обработки вызовов от OpenAI
+@memoized_tool()
 async def get_products() -> Dict:
-    """Получить структурированный список товаров из базы данных"""
-    async with async_session() as session:
-        # Получаем все категории
-        categories_result = await session.execute(select(Category))
-        categories = categories_result.scalars().all()
-
-        structured_products = []
-        flat_product_names = []  # Плоский список только названий для отображения клиенту
-
-        for category in categories:
-            category_data = {
-                "id": category.id,
-                "name": category.name,
-                "subcategories": []
-            }
+    """Получить структурированный список товаров из снимка каталога"""
+    catalog = await get_catalog()
 
-            # Получаем подкатегории для текущей категории
-            subcategories_result = await session.execute(
-                select(Subcategory).where(Subcategory.category_id == category.id)
-            )
-            subcategories = subcategories_result.scalars().all()
+    structured_products = []
+    flat_product_names = []  # Плоский список только названий для отображения клиенту
 
-            for subcategory in subcategories:
-                subcategory_data = {
-                    "id": subcategory.id,
-                    "name": subcategory.name,
-                    "products": []
-                }
+    for category_id, category_name, subcategories in catalog.categories:
+        category_data = {
+            "id": category_id,
+            "name": category_name,
+            "subcategories": []
+        }
 
-                # Получаем товары для текущей подкатегории
-                products_result = await session.execute(
-                    select(Product).where(Product.subcategory_id == subcategory.id)
-                )
-                products = products_result.scalars().all()
+        for subcategory_id, subcategory_name in subcategories:
+            subcategory_data = {
+                "id": subcategory_id,
+                "name": subcategory_name,
+                "products": []
+            }
 
-                for product in products:
-                    product_data = {
-                        "id": product.id,
-                        "name": product.name,
-                        "price": float(product.price)
-                    }
-                    subcategory_data["products"].append(product_data)
-                    flat_product_names.append(product.name)
+            for product in catalog.products_in_subcategory(subcategory_id):
+                subcategory_data["products"].append({
+                    "id": product.id,
+                    "name": product.name,
+                    "price": product.price
+                })
+                flat_product_names.append(product.name)
 
-                category_data["subcategories"].append(subcategory_data)
+            category_data["subcategories"].append(subcategory_data)
 
-            structured_products.append(category_data)
+        structured_products.append(category_data)
 
-        return {
-            "structured_products": structured_products,
-            "product_names": flat_product_names  # Этот список будет использоваться для отображения клиенту
-        }
+    return {
+        "structured_products": structured_products,
+        "product_names": flat_product_names  # Этот список будет использоваться для отображения клиенту
+    }
 
 
+@memoized_tool()
 async def get_product_details(product_name: str) -> Dict:
     """Получить детальную информацию о конкретном товаре"""
-    async with async_session() as session:
-        # Получаем информацию о товаре
-        result = await session.execute(
-            select(Product).where(Product.name == product_name)
-        )
-        product = result.scalar_one_or_none()
-
-        if not product:
-            return {"error": "Товар не найден"}
-
-        # Получаем фотографии товара
-        photos_result = await session.execute(
-            select(ProductPhoto).where(ProductPhoto.product_id == product.id)
-        )
-        photos = photos_result.scalars().all()
-        photo_ids = [photo.file_id for photo in photos]
-
-        # Получаем доступные цвета
-        available_colors = []
-        if product.color_ids:  # Проверяем, что color_ids не пустой
-            # Используем list() для преобразования JSON списка в Python список, если необходимо
-            color_ids = product.color_ids if isinstance(product.color_ids, list) else list(product.color_ids)
-            colors_result = await session.execute(
-                select(Color).where(Color.id.in_(color_ids))
-            )
-            colors = colors_result.scalars().all()
-            available_colors = [{"id": color.id, "name": color.name} for color in colors]
-
-        # Получаем доступные размеры
-        available_sizes = []
-        if product.size_ids:  # Проверяем, что size_ids не пустой
-            # Используем list() для преобразования JSON списка в Python список, если необходимо
-            size_ids = product.size_ids if isinstance(product.size_ids, list) else list(product.size_ids)
-            sizes_result = await session.execute(
-                select(Size).where(Size.id.in_(size_ids))
-            )
-            sizes = sizes_result.scalars().all()
-            available_sizes = [{"id": size.id, "size": size.size} for size in sizes]
-
-        # Формируем детальную информацию о товаре
-        product_info = {
-            "id": product.id,
-            "name": product.name,
-            "price": float(product.price),
-            "description": product.description,
-            "product_type": product.product_type,
-            "material": product.material,
-            "features": product.features,
-            "usage": product.usage,
-            "temperature_range": product.temperature_range,
-            "photo_ids": photo_ids,
-            "available_colors": available_colors,
-            "available_sizes": available_sizes,
-            "has_color_options": len(available_colors) > 0,
-            "has_size_options": len(available_sizes) > 0,
-            "color_options": [color["name"] for color in available_colors],
-            "size_options": [size["size"] for size in available_sizes],
-            "instructions": "Показать клиенту основную информацию о товаре. " +
-                            "Затем, если доступны цвета или размеры, попросить клиента выбрать конкретные параметры. " +
-                            "После выбора всех параметров, спросить о желаемом количестве."
-        }
-        return product_info
+    catalog = await get_catalog()
+    product = catalog.by_name(product_name)
+
+    if not product:
+        return {"error": "Товар не найден"}
+
+    available_colors = [{"id": color_id, "name": name} for color_id, name in product.colors]
+    available_sizes = [{"id": size_id, "size": size} for size_id, size in product.sizes]
+
+    # Формируем детальную информацию о товаре
+    product_info = {
+        "id": product.id,
+        "name": product.name,
+        "price": product.price,
+        "description": product.description,
+        "product_type": product.product_type,
+        "material": product.material,
+        "features": product.features,
+        "usage": product.usage,
+        "temperature_range": product.temperature_range,
+        "photo_ids": list(product.photo_ids),
+        "available_colors": available_colors,
+        "available_sizes": available_sizes,
+        "has_color_options": len(available_colors) > 0,
+        "has_size_options": len(available_sizes) > 0,
+        "color_options": product.color_names,
+        "size_options": product.size_names,
+        "instructions": "Показать клиенту основную информацию о товаре. " +
+                        "Затем, если доступны цвета или размеры, попросить клиента выбрать конкретные параметры. " +
+                        "После выбора всех параметров, спросить о желаемом количестве."
+    }
+    return product_info
 
 
 async def add_to_cart(user_id: int, product_name: str, quantity: int = None, color: str = None,
@@ -372,98 +385,82 @@ async def add_to_cart(user_id: int, product_name: str, quantity: int = None, col
         user_carts[user_id] = []
 
     # Получаем информацию о товаре
-    async with async_session() as session:
-        result = await session.execute(
-            select(Product).where(Product.name == product_name)
-        )
-        product = result.scalar_one_or_none()
+    catalog = await get_catalog()
+    product = catalog.by_name(product_name)
 
-        if not product:
-            return {"error": "Товар не найден"}
+    if not product:
+        return {"error": "Товар не найден"}
 
-        # Получаем доступные цвета и размеры
-        available_colors = []
-        if product.color_ids:
-            colors_result = await session.execute(
-                select(Color).where(Color.id.in_(product.color_ids))
-            )
-            colors = colors_result.scalars().all()
-            available_colors = [{"id": color.id, "name": color.name} for color in colors]
-            available_color_names = [c["name"] for c in available_colors]
-
-        available_sizes = []
-        if product.size_ids:
-            sizes_result = await session.execute(
-                select(Size).where(Size.id.in_(product.size_ids))
-            )
-            sizes = sizes_result.scalars().all()
-            available_sizes = [{"id": size.id, "size": size.size} for size in sizes]
-            available_size_names = [s["size"] for s in available_sizes]
+    # Доступные цвета и размеры
+    available_colors = [{"id": color_id, "name": name} for color_id, name in product.colors]
+    available_color_names = product.color_names
+    available_sizes = [{"id": size_id, "size": size_name} for size_id, size_name in product.sizes]
+    available_size_names = product.size_names
 
-        # Проверяем наличие всех необходимых деталей
-        missing_params = {}
+    # Проверяем наличие всех необходимых деталей
+    missing_params = {}
 
-        # Проверка количества (обязательный параметр)
-        if quantity is None:
-            missing_params["quantity"] = {
-                "message": f"Пожалуйста, укажите количество для {product_name}"
-            }
+    # Проверка количества (обязательный параметр)
+    if quantity is None:
+        missing_params["quantity"] = {
+            "message": f"Пожалуйста, укажите количество для {product_name}"
+        }
 
-        # Проверка цвета, если есть варианты
-        if available_colors:
-            if not color:
-                missing_params["color"] = {
-                    "message": f"Пожалуйста, выберите цвет для {product_name}",
-                    "available_options": available_color_names
-                }
-            else:
-                # Проверяем корректность цвета
-                color_match = next((c for c in available_colors if c["name"].lower() == color.lower()), None)
-                if not color_match:
-                    return {
-                        "error": f"Цвет '{color}' недоступен для этого товара. Доступные цвета: " +
-                                 ", ".join(available_color_names)
-                    }
-                color_id = color_match["id"]
+    # Проверка цвета, если есть варианты
+    if available_colors:
+        if not color:
+            missing_params["color"] = {
+                "message": f"Пожалуйста, выберите цвет для {product_name}",
+                "available_options": available_color_names
+            }
         else:
-            color_id = None
-            if color:
+            # Проверяем корректность цвета
+            color_match = next((c for c in available_colors if c["name"].lower() == color.lower()), None)
+            if not color_match:
                 return {
-                    "error": f"Для товара {product_name} выбор цвета недоступен"
+                    "error": f"Цвет '{color}' недоступен для этого товара. Доступные цвета: " +
+                             ", ".join(available_color_names)
                 }
+            color_id = color_match["id"]
+    else:
+        color_id = None
+        if color:
+            return {
+                "error": f"Для товара {product_name} выбор цвета недоступен"
+            }
 
-        # Проверка размера, если есть варианты
-        if available_sizes:
-            if not size:
-                missing_params["size"] = {
-                    "message": f"Пожалуйста, выберите размер для {product_name}",
-                    "available_options": available_size_names
-                }
-            else:
-                # Проверяем корректность размера
-                size_match = next((s for s in available_sizes if s["size"].lower() == size.lower()), None)
-                if not size_match:
-                    return {
-                        "error": f"Размер '{size}' недоступен для этого товара. Доступные размеры: " +
-                                 ", ".join(available_size_names)
-                    }
-                size_id = size_match["id"]
+    # Проверка размера, если есть варианты
+    if available_sizes:
+        if not size:
+            missing_params["size"] = {
+                "message": f"Пожалуйста, выберите размер для {product_name}",
+                "available_options": available_size_names
+            }
         else:
-            size_id = None
-            if size:
+            # Проверяем корректность размера
+            size_match = next((s for s in available_sizes if s["size"].lower() == size.lower()), None)
+            if not size_match:
                 return {
-                    "error": f"Для товара {product_name} выбор размера недоступен"
+                    "error": f"Размер '{size}' недоступен для этого товара. Доступные размеры: " +
+                             ", ".join(available_size_names)
                 }
-
-        # Если не все детали предоставлены, возвращаем запрос недостающих
-        if missing_params:
+            size_id = size_match["id"]
+    else:
+        size_id = None
+        if size:
             return {
-                "needs_details": True,
-                "product_name": product_name,
-                "missing_params": missing_params,
-                "message": "Пожалуйста, укажите недостающие параметры для добавления товара в корзину"
+                "error": f"Для товара {product_name} выбор размера недоступен"
             }
 
+    # Если не все детали предоставлены, возвращаем запрос недостающих
+    if missing_params:
+        return {
+            "needs_details": True,
+            "product_name": product_name,
+            "missing_params": missing_params,
+            "message": "Пожалуйста, укажите недостающие параметры для добавления товара в корзину"
+        }
+
     # Добавляем товар в корзину
     cart_item = {
         "product_id": product.id,  # Добавляем product_id из базы данных
@@ -613,6 +610,8 @@ async def save_order_to_db(order_info: Dict) -> List[int]:
             order_ids=order_ids
         )
         session.add(order_group)
+        await session.flush()
+        await refresh_group_summaries(session, [order_group.id])
 
         await session.commit()
         return order_ids
@@ -773,284 +772,183 @@ async def complete_order(user_id: int, full_name: str = "", phone: str = "", add
         }
 
 
+@memoized_tool()
 async def get_related_products(product_name: str) -> Dict:
     """Получить связанные товары, подходящие к выбранному товару"""
-    # Получаем информацию о выбранном товаре
-    async with async_session() as session:
-        result = await session.execute(
-            select(Product).where(Product.name == product_name)
-        )
-        product = result.scalar_one_or_none()
-
-        if not product:
-            return {"error": "Товар не найден"}
-
-        # Получаем категорию и подкатегорию выбранного товара
-        product_subcategory = None
-        product_category = None
-
-        if product.subcategory_id:
-            subcategory_result = await session.execute(
-                select(Subcategory).where(Subcategory.id == product.subcategory_id)
-            )
-            product_subcategory = subcategory_result.scalar_one_or_none()
-
-            if product_subcategory:
-                category_result = await session.execute(
-                    select(Category).where(Category.id == product_subcategory.category_id)
-                )
-                product_category = category_result.scalar_one_or_none()
-
-        # Получаем все товары с их категориями и подкатегориями, исключая выбранный
-        products_result = await session.execute(
-            select(Product, Subcategory, Category)
-            .join(Subcategory, Product.subcategory_id == Subcategory.id, isouter=True)
-            .join(Category, Subcategory.category_id == Category.id, isouter=True)
-            .where(Product.name != product_name)
-        )
-        products_info = []
+    catalog = await get_catalog()
+    product = catalog.by_name(product_name)
 
-        for p, s, c in products_result:
-            products_info.append({
-                "id": p.id,
-                "name": p.name,
-                "type": p.product_type,
-                "price": float(p.price),
-                "subcategory": s.name if s else None,
-                "category": c.name if c else None
-            })
+    if not product:
+        return {"error": "Товар не найден"}
 
-    # Отправляем запрос в OpenAI для подбора связанных товаров
+    # Соседи предрасчитаны по совместным покупкам и близости в каталоге; формулирует ответ модель диалога
     try:
-        # Формируем контекст с информацией о категории и подкатегории выбранного товара
-        context = {
-            "product": {
-                "name": product_name,
-                "type": product.product_type,
-                "subcategory": product_subcategory.name if product_subcategory else None,
-                "category": product_category.name if product_category else None
-            }
-        }
-
-        # Отправляем запрос в OpenAI
-        response = await asyncio.to_thread(
-            openai_client.chat.completions.create,
-            model="gpt-4o",
-            messages=[
-                {"role": "system",
-                 "content": "Ты - консультант в магазине спортивной одежды Bigser. Выбери из списка товаров не более 3 товаров, которые хорошо сочетаются с основным товаром или дополняют его. Учитывай категории и подкатегории товаров."},
-                {"role": "user",
-                 "content": f"Основной товар: {json.dumps(context, ensure_ascii=False)}. Доступные товары: {json.dumps(products_info, ensure_ascii=False)}"}
-            ],
-            max_tokens=1000
-        )
-
-        related_text = response.choices[0].message.content.strip()
-
-        # Находим названия товаров в ответе
-        related_products = []
-        for p in products_info:
-            if p["name"] in related_text:
-                related_products.append({
-                    "name": p["name"],
-                    "type": p["type"],
-                    "price": p["price"],
-                    "category": p["category"],
-                    "subcategory": p["subcategory"]
-                })
-                if len(related_products) >= 3:  # Ограничиваем до 3 связанных товаров
-                    break
-
-        return {"related_products": related_products}
-
+        related = await get_related(product.id, limit=3)
     except Exception as e:
         logger.error(f"Ошибка при получении связанных товаров: {e}")
         return {"error": "Произошла ошибка при получении связанных товаров", "related_products": []}
 
+    return {
+        "related_products": [
+            {
+                "name": p.name,
+                "type": p.product_type,
+                "price": p.price,
+                "category": p.category,
+                "subcategory": p.subcategory
+            }
+            for p in related
+        ]
+    }
 
-async def filter_products(user_query: str, user_id: int = None) -> Dict:
-    """Отфильтровать товары по запросу пользователя"""
-    # Определяем контекст предыдущего запроса, если он есть
-    previous_context = {}
-    if user_id and user_id in user_states:
-        previous_context = user_states[user_id].get("search_context", {})
-
-    # Объединяем предыдущий запрос с текущим, если это уточнение
-    combined_query = user_query
-    user_states[user_id]["last_query"] = combined_query
-
-    if previous_context.get("original_query"):
-        if previous_context.get("waiting_for") == "size":
-            combined_query = f"{previous_context.get('original_query')} размер {user_query}"
-            previous_context["size"] = user_query
-            previous_context["waiting_for"] = "color"
-
-        elif previous_context.get("waiting_for") == "color":
-            combined_query = f"{previous_context.get('original_query')} цвет {user_query}"
-            previous_context["color"] = user_query
-            previous_context["waiting_for"] = None
 
-        elif "color" in user_query.lower() or "размер" in user_query.lower() or "цвет" in user_query.lower() or "size" in user_query.lower():
-            combined_query = f"{previous_context.get('original_query')} {user_query}"
+# Сколько товаров показывать после локального уточнения подборки
+REFINE_LIMIT = 5
 
-    # Получаем структурированные данные о товарах
-    products_data = await get_products()
-    structured_products = products_data["structured_products"]
 
-    # Получаем информацию о категориях, подкатегориях и деталях товаров
-    context_info = []
-    async with async_session() as session:
-        for category in structured_products:
-            for subcategory in category["subcategories"]:
-                for product in subcategory["products"]:
-                    # Получаем детальную информацию о товаре
-                    product_result = await session.execute(
-                        select(Product).where(Product.id == product["id"])
-                    )
-                    product_details = product_result.scalar_one_or_none()
-
-                    if product_details:
-                        # Получаем доступные цвета
-                        available_colors = []
-                        if product_details.color_ids:
-                            colors_result = await session.execute(
-                                select(Color).where(Color.id.in_(product_details.color_ids))
-                            )
-                            colors = colors_result.scalars().all()
-                            available_colors = [color.name for color in colors]
-
-                        # Получаем доступные размеры
-                        available_sizes = []
-                        if product_details.size_ids:
-                            sizes_result = await session.execute(
-                                select(Size).where(Size.id.in_(product_details.size_ids))
-                            )
-                            sizes = sizes_result.scalars().all()
-                            available_sizes = [size.size for size in sizes]
-
-                        # Получаем фотографии
-                        photos_result = await session.execute(
-                            select(ProductPhoto).where(ProductPhoto.product_id == product_details.id)
-                        )
-                        photos = photos_result.scalars().all()
-                        photo_ids = [photo.file_id for photo in photos]
-
-                        context_info.append({
-                            "name": product["name"],
-                            "category": category["name"],
-                            "subcategory": subcategory["name"],
-                            "id": product["id"],
-                            "colors": available_colors,
-                            "sizes": available_sizes,
-                            "price": float(product["price"]),
-                            "description": product_details.description,
-                            "photo_ids": photo_ids,
-                            "product_type": product_details.product_type,
-                            "material": product_details.material,
-                            "features": product_details.features,
-                            "usage": product_details.usage
-                        })
-
-    # Проверяем, ожидаем ли мы уточнения от пользователя
-    if previous_context.get("waiting_for"):
-        waiting_for = previous_context.get("waiting_for")
-
-        # Сохраняем обновленный контекст
-        if user_id:
-            user_states[user_id]["search_context"] = previous_context
+def _remember_candidates(user_id: int, query: str, slots: Slots, shown: List[Dict],
+                         context_info: List[Dict]) -> None:
+    """Сохраняет кандидатов поиска (показанные - первыми), чтобы уточнять размер и цвет без модели"""
+    state = user_states.get(user_id)
+    if state is None:
+        return
+    candidate_ids = [p["id"] for p in shown]
+    candidate_ids += [p["id"] for p in context_info if p["id"] not in candidate_ids]
+    state["search_context"] = {
+        "query": query,
+        "candidate_ids": candidate_ids,
+        "colors": sorted(slots.colors),
+        "sizes": sorted(slots.sizes),
+        "waiting_for": None
+    }
 
-        # Если ожидаем уточнения о размере
-        if waiting_for == "size":
-            # Собираем доступные размеры для указанного типа товара
-            available_sizes = set()
-            for product in context_info:
-                if product.get("sizes"):
-                    for size in product.get("sizes"):
-                        available_sizes.add(str(size))
 
-            size_options = ", ".join(sorted(available_sizes)) if available_sizes else "любой"
+async def refine_search(user_id: int, slots: Slots) -> Dict:
+    """
+    Уточняет последнюю подборку по размеру и цвету локально: новое значение слота
+    заменяет прежнее, незаполненный слот сохраняет прежнее. Если вариантов не осталось,
+    спрашивает заново с вариантами, которые реально есть среди кандидатов.
+    """
+    context = user_states[user_id].get("search_context") or {}
+    catalog = await get_catalog()
+    candidates = [p for p in (catalog.get(pid) for pid in context.get("candidate_ids", [])) if p]
+
+    colors = set(slots.colors) or set(context.get("colors", []))
+    sizes = set(slots.sizes) or set(context.get("sizes", []))
+    matched = refine_candidates(candidates, colors, sizes)
+
+    if not matched:
+        if sizes and not refine_candidates(candidates, set(), sizes):
+            waiting_for = "size"
+            options = sorted({size for p in refine_candidates(candidates, colors, set()) for size in p.size_names})
+            message = f"Размера {', '.join(sorted(sizes))} среди подходящих товаров нет. " \
+                      f"Доступные размеры: {', '.join(options) or 'нет'}"
+            sizes = set()
+        else:
+            waiting_for = "color"
+            options = sorted({color for p in refine_candidates(candidates, set(), sizes) for color in p.color_names})
+            message = f"В цвете {', '.join(sorted(colors))} подходящих товаров нет. " \
+                      f"Доступные цвета: {', '.join(options) or 'нет'}"
+            colors = set()
+        context.update(colors=sorted(colors), sizes=sorted(sizes), waiting_for=waiting_for)
+        user_states[user_id]["search_context"] = context
+        return {"needs_clarification": True, "message": message, "context": context}
+
+    context.update(colors=sorted(colors), sizes=sorted(sizes), waiting_for=None)
+    user_states[user_id]["search_context"] = context
+
+    recommended = []
+    for product in matched[:REFINE_LIMIT]:
+        reasons = []
+        if sizes:
+            reasons.append(f"Есть размер {', '.join(s for s in product.size_names if s in sizes)}")
+        if colors:
+            reasons.append(f"цвет {', '.join(c for c in product.color_names if c in colors)}")
+        item = product.to_context()
+        item["recommendation_reason"] = ", ".join(reasons)
+        recommended.append(item)
+    return {"exact_matches": True, "recommended_products": recommended}
+
+
+def local_search_result(user_id: int, query: str, slots: Slots, candidates: List[CatalogProduct]) -> Dict:
+    """
+    Подборка без модели: кандидаты BM25 в порядке ранжирования, отфильтрованные по названным
+    цвету и размеру, если такие есть. Используется, когда модель недоступна или не ответила в срок.
+    """
+    if not candidates:
+        return {
+            "needs_clarification": True,
+            "message": "Извините, не совсем понял ваш запрос. Не могли бы вы сформулировать его по-другому?"
+        }
+    matched = refine_candidates(candidates, set(slots.colors), set(slots.sizes)) or candidates
+    recommended = []
+    for product in matched[:REFINE_LIMIT]:
+        item = product.to_context()
+        item["recommendation_reason"] = "Подходит по вашему запросу"
+        recommended.append(item)
+    if user_id:
+        _remember_candidates(user_id, query, slots, recommended, [p.to_context() for p in candidates])
+    return {"exact_matches": True, "recommended_products": recommended, "degraded": True}
 
-            return {
-                "needs_clarification": True,
-                "message": f"Какой размер вам подходит? Доступные размеры: {size_options}",
-                "context": previous_context
-            }
 
-        # Если ожидаем уточнения о цвете
-        elif waiting_for == "color":
-            # Собираем доступные цвета для указанного типа товара
-            available_colors = set()
-            for product in context_info:
-                if product.get("colors"):
-                    for color in product.get("colors"):
-                        available_colors.add(color)
+async def filter_products(user_query: str, user_id: int = None) -> Dict:
+    """Отфильтровать товары по запросу пользователя"""
+    # Кнопка или сообщение после перезапуска может прийти без сохранённого диалога
+    state = user_states.get(user_id) if user_id else None
+    search_context = (state or {}).get("search_context") or {}
 
-            color_options = ", ".join(sorted(available_colors)) if available_colors else "любой"
+    # Ответ вида «XL» или «чёрный» уточняет прошлую подборку локально, без модели
+    slots = await parse_slots(user_query)
+    if search_context.get("candidate_ids") and slots.refines_search:
+        return await refine_search(user_id, slots)
 
-            return {
-                "needs_clarification": True,
-                "message": f"Какой цвет предпочитаете? Доступные цвета: {color_options}",
-                "context": previous_context
-            }
+    combined_query = user_query
+    if state is not None:
+        state["last_query"] = combined_query
+
+    # Тот же запрос в другой формулировке («куртка черная размер L») уже подбирался - отвечаем без модели
+    cache_key = normalize_query(slots)
+    cached = ranking_cache.get(cache_key)
+    if cached:
+        result, candidate_ids = cached
+        if user_id:
+            catalog = await get_catalog()
+            shown = result.get("recommended_products") or result.get("alternatives") or []
+            context = [catalog.get(pid).to_context() for pid in candidate_ids if catalog.get(pid)]
+            _remember_candidates(user_id, combined_query, slots, shown, context)
+        return result
+
+    # Локальное ранжирование BM25 сужает контекст модели до SEARCH_TOP_K кандидатов
+    search_index = await get_search_index()
+    candidates = [hit.product for hit in search_index.search(combined_query, SEARCH_TOP_K)]
+    context_info = [product.to_context() for product in candidates]
+    # В промпт кандидаты идут компактно, под короткими id; ответ модели сопоставляется по этим id
+    codec = CatalogPromptCodec(candidates)
+
+    messages = [
+        await search_system_message(),
+        {"role": "user",
+         "content": f"Доступные товары:\n{codec.encode(with_legend=False)}\n\nЗапрос клиента: '{combined_query}'"}
+    ]
 
     # Если все уточнения получены или их не требуется, ищем товары
     try:
-        # Отправляем запрос в OpenAI для поиска товаров
-        response = await asyncio.to_thread(
-            openai_client.chat.completions.create,
-            model="gpt-4o",
-            messages=[
-                {"role": "system",
-                 "content": """Ты - дружелюбный консультант в магазине спортивной одежды Bigser.
-
-                 Инструкции:
-                 1. Проанализируй запрос клиента и найди товары, максимально соответствующие всем указанным параметрам.
-                 2. Учитывай следующие параметры:
-                    - Цвет
-                    - Размер
-                 3. Если точного соответствия нет, найди ближайшие аналоги.
-                 4. Верни не более 5 самых подходящих товаров.
-                 5. Если нет подходящих товаров, отметь это специальным тегом "НЕТ_ПОДХОДЯЩИХ".
-                 6. Для каждого товара добавь короткую рекомендацию, почему он подходит клиенту.
-                 7. Альтернативные варианты выводи так же в виде карусели.
-                 8. Формат ответа:
-                    ```json
-                    {
-                      "items": [
-                        {"name": "Название товара 1", "reason": "Почему подходит"},
-                        {"name": "Название товара 2", "reason": "Почему подходит"},
-                        ...
-                      ]
-                    }
-                    ```
-                    Или, если нет подходящих товаров:
-                    ```json
-                    {
-                      "НЕТ_ПОДХОДЯЩИХ": true,
-                      "alternative_suggestions": ["Товар 1", "Товар 2", ...]
-                    }
-                    ```
-                 """},
-                {"role": "user",
-                 "content": f"Запрос клиента: '{combined_query}'. Доступные товары с деталями: {json.dumps(context_info, ensure_ascii=False)}"}
-            ],
-            max_tokens=1000,
-            response_format={"type": "json_object"}
+        # Отправляем запрос в OpenAI для поиска товаров; при медленном ответе - страхующий повтор
+        response = await llm_guard.call(
+            LLMTask.RANKING,
+            lambda: chat_completion(task=LLMTask.RANKING, messages=messages, response_format={"type": "json_object"}),
+            hedge=True
         )
 
         recommendations = json.loads(response.choices[0].message.content)
 
-        # Очищаем контекст поиска, так как нашли товары
-        if user_id and user_id in user_states:
-            user_states[user_id].pop("search_context", None)
-
         # Проверяем, есть ли подходящие товары
         if "НЕТ_ПОДХОДЯЩИХ" in recommendations and recommendations["НЕТ_ПОДХОДЯЩИХ"]:
-            alternative_names = recommendations.get("alternative_suggestions", [])
+            alternative_refs = recommendations.get("alternative_suggestions", [])
             alternative_products = []
 
             # Определяем подкатегорию запрашиваемого товара (если известна)
-            user_query = user_states[user_id].get("last_query", "")  # Запрос пользователя
+            user_query = combined_query  # Запрос пользователя
             request_subcategory = None
 
             # Попробуем найти подкатегорию запрашиваемого товара
@@ -1059,46 +957,55 @@ async def filter_products(user_query: str, user_id: int = None) -> Dict:
                     request_subcategory = product["subcategory"]  # Получаем подкатегорию
                     break
 
-            # Ищем информацию об альтернативных товарах
+            # Ищем информацию об альтернативных товарах по id из ответа
             # Фильтруем альтернативные товары, оставляя только из той же подкатегории
-            for alt_name in alternative_names:
-                for product in context_info:
-                    if product["name"] == alt_name:
-                        # Фильтруем по подкатегории
-                        if request_subcategory and product["subcategory"] != request_subcategory:
-                            continue  # Пропускаем товар, если он не из той же подкатегории
-                        alternative_products.append(product)
-                        break
-
-            return {
+            for alt_ref in alternative_refs:
+                product = codec.decode(alt_ref)
+                if not product:
+                    continue
+                # Фильтруем по подкатегории
+                if request_subcategory and product.subcategory != request_subcategory:
+                    continue  # Пропускаем товар, если он не из той же подкатегории
+                alternative_products.append(product.to_context())
+
+            if user_id:
+                _remember_candidates(user_id, combined_query, slots, alternative_products, context_info)
+            result = {
                 "no_exact_match": True,
                 "message": f"Товаров, точно соответствующих вашему запросу, не найдено. Вот альтернативные варианты из той же подкатегории:",
                 "alternatives": alternative_products
             }
+            if alternative_products:
+                ranking_cache.put(cache_key, result, [product.id for product in candidates])
+            return result
 
         # Если есть подходящие товары, находим полную информацию о них
         recommended_items = recommendations.get("items", [])
         detailed_recommendations = []
 
         for item in recommended_items:
-            for product in context_info:
-                if product["name"] == item["name"]:
-                    product_with_reason = product.copy()
-                    product_with_reason["recommendation_reason"] = item["reason"]
-                    detailed_recommendations.append(product_with_reason)
-                    break
+            product = codec.decode(item.get("id", item.get("name")))
+            if product:
+                product_with_reason = product.to_context()
+                product_with_reason["recommendation_reason"] = item.get("reason", "")
+                detailed_recommendations.append(product_with_reason)
 
-        return {
+        if user_id:
+            _remember_candidates(user_id, combined_query, slots, detailed_recommendations, context_info)
+        result = {
             "exact_matches": True,
             "recommended_products": detailed_recommendations
         }
+        if detailed_recommendations:
+            ranking_cache.put(cache_key, result, [product.id for product in candidates])
+        return result
 
+    except (LLMUnavailableError, LLMOverloadedError) as e:
+        logger.warning(f"Подбор товаров без модели: {e}")
+        return local_search_result(user_id, combined_query, slots, candidates)
     except Exception as e:
         logger.error(f"Ошибка при фильтрации товаров: {e}")
-        return {
-            "needs_clarification": True,
-            "message": "Извините, не совсем понял ваш запрос. Не могли бы вы сформулировать его по-другому?"
-        }
+        return local_search_result(user_id, combined_query, slots, candidates)
 
 
 async def verify_user_data(user_id: int, is_correct: bool, delivery: bool, full_name: str = "", phone: str = "",
@@ -1202,68 +1109,22 @@ async def verify_user_data(user_id: int, is_correct: bool, delivery: bool, full_
 
 
 @ai_router.callback_query(F.data == 'user_consultation')
+async def open_consultation(callback_query: CallbackQuery):
+    consultant_mailbox.submit(callback_query.from_user.id, cmd_start, callback_query)
+
+
 async def cmd_start(callback_query: CallbackQuery):
-    await initialize_openai_client()
     user_id = callback_query.from_user.id
     await callback_query.message.delete()
     user_states[user_id] = {
         "chat_history": [
-            {"role": "system", "content": """
-            Ты - дружелюбный и опытный консультант магазина спортивной одежды Bigser. Общайся естественно, как человек, избегай формальностей и технических терминов.
-
-            Как вести диалог с клиентом:
-
-            1. Начни с приветливого приветствия и спроси, чем можешь помочь.
-
-            2. При поиске товаров ОБЯЗАТЕЛЬНО следуй этой последовательности:
-               a) Когда клиент запрашивает товар, используй filter_products для поиска
-               b) Если в запросе недостаточно деталей, задай уточняющие вопросы:
-                  - Какой цвет предпочитает клиент
-                  - Какой размер ему нужен
-               c) После получения всех деталей покажи наиболее подходящие товары
-               d) Если точных соответствий нет, предложи альтернативные варианты
-
-            3. При показе товаров:
-               - Объясни, почему именно эти товары подходят клиенту
-               - Добавляй краткие рекомендации к каждому товару
-               - Интересуйся, какой товар больше понравился
-               - Никогда не добавляй ссылку на картинку товара в сообщение
-
-            4. Когда клиент выбирает конкретный товар:
-               - Используй get_product_details для получения подробной информации
-               - Если нужно, уточни цвет и размер
-               - Спроси о количестве
-               - Добавь товар в корзину только после согласования всех деталей
-
-            5. После добавления в корзину:
-               - Предложи подходящие дополнительные товары
-               - Спроси, хочет ли клиент продолжить выбор или оформить заказ
-
-            6. При оформлении заказа:
-               - Сначала проверь, есть ли данные пользователя в БД
-               - Если данные есть, попроси подтвердить их
-               - Если данных нет или они неверны, запроси ФИО и телефон
-               - Уточни способ получения (доставка или самовывоз)
-               - При выборе доставки запроси адрес
-               - Подтверди все данные заказа перед его оформлением
-
-            Важные моменты:
-            - Общайся дружелюбно и неформально
-            - ВСЕГДА задавай уточняющие вопросы при недостатке деталей в запросе
-            - Рекомендуй только товары, максимально соответствующие запросу клиента
-            - Предлагай альтернативы, если идеального соответствия нет
-            - СТРОГО, никогда не добавляй ссылку на изображение товара в сообщение
-            - Формат цены указывай в сомах
-            - Отвечай на русском языке или на языке клиента.
-        """}
+            await consultant_system_message()
         ]
     }
 
     # Отправляем первое сообщение от бота
-    # Using asyncio.to_thread for the synchronous OpenAI client
-    response = await asyncio.to_thread(
-        openai_client.chat.completions.create,
-        model="gpt-4o",
+    response = await chat_completion(
+        task=LLMTask.DIALOGUE,
         messages=user_states[user_id]["chat_history"],
         tools=tools,
         tool_choice="auto"
@@ -1276,10 +1137,173 @@ async def cmd_start(callback_query: CallbackQuery):
 
 
 # Обработчик для всех текстовых сообщений
+def render_cart(user_id: int) -> tuple[str, InlineKeyboardMarkup]:
+    """Текст корзины с меню «продолжить / оформить» - общий для кнопок и текстовых команд"""
+    cart = user_carts[user_id]
+    total_amount = sum(item["total"] for item in cart)
+
+    cart_message = "🛒 Ваша корзина:\n\n"
+    for item in cart:
+        cart_message += f"• {item['product_name']}\n"
+        cart_message += f"  Цвет: {item.get('color', 'Не указан')}\n"
+        cart_message += f"  Размер: {item.get('size', 'Не указан')}\n"
+        cart_message += f"  Количество: {item['quantity']}\n"
+        cart_message += f"  Цена: {item['price']} сом\n"
+        cart_message += f"  Итого: {item['total']} сом\n\n"
+    cart_message += f"Общая сумма: {total_amount} сом\n\n"
+    cart_message += "Что бы вы хотели сделать?\n"
+    cart_message += "1. Продолжить покупки\n"
+    cart_message += "2. Оформить заказ"
+
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="🛍 Продолжить покупки", callback_data="continue_shopping")
+    keyboard.button(text="✅ Оформить заказ", callback_data="checkout")
+    return cart_message, keyboard.as_markup()
+
+
+async def continue_shopping_text(user_id: int) -> str:
+    """Ответ на «продолжить покупки» с учётом ранее выбранных цвета и размера"""
+    # Очищаем состояние текущих товаров
+    user_states[user_id].pop("current_products", None)
+
+    # Сохраняем предыдущие выборы пользователя
+    previous_selections = user_states[user_id].get("selected_product", {})
+
+    # Формируем контекст для ИИ с учетом предыдущих выборов
+    ai_context = "Клиент хочет продолжить покупки. "
+    preferences = ""
+    if previous_selections:
+        details = []
+        if "color" in previous_selections:
+            details.append(f"цвет: {previous_selections['color']}")
+        if "size" in previous_selections:
+            details.append(f"размер: {previous_selections['size']}")
+        if details:
+            ai_context += f"Ранее клиент выбирал {', '.join(details)}. "
+            preferences = f"Ранее вы выбирали {', '.join(details)}. "
+
+    return await compose(
+        "continue_shopping",
+        user_states[user_id].get("language", DEFAULT_LANGUAGE),
+        ai_context,
+        system_prompt="Ты дружелюбный консультант магазина спортивной одежды. Твоя задача - помочь клиенту продолжить покупки, учитывая его предыдущие предпочтения.",
+        preferences=preferences
+    )
+
+
+async def checkout_reply(user_id: int) -> Optional[tuple]:
+    """Первый шаг оформления: запрос данных или их подтверждение. None, если корзина пуста"""
+    result = await complete_order(user_id)
+    if result.get("needs_details"):
+        return result["message"], None
+    if result.get("user_data_exists"):
+        # Если у пользователя есть данные, показываем их для подтверждения
+        user_info = result["user_info"]
+
+        message = f"Проверьте, пожалуйста, ваши данные:\n\n"
+        message += f"ФИО: {user_info['full_name']}\n"
+        message += f"Телефон: {user_info['phone']}\n"
+        message += f"Адрес: {user_info['address']}\n\n"
+        message += "Всё верно?"
+
+        keyboard = InlineKeyboardBuilder()
+        keyboard.button(text="✅ Да, всё верно", callback_data="verify_data:true")
+        keyboard.button(text="❌ Нет, изменить", callback_data="verify_data:false")
+        user_states[user_id]["awaiting"] = "verify_data"
+        return message, keyboard.as_markup()
+    return None
+
+
+async def verify_data_reply(user_id: int, is_correct: bool) -> tuple:
+    """Подтверждение данных: оформляет заказ или начинает ввод новых данных"""
+    # Получаем информацию о пользователе
+    user_info = await get_user_info(user_id)
+
+    # Проверяем наличие корзины
+    if user_id not in user_carts or not user_carts[user_id]:
+        return "Ваша корзина пуста", None
+
+    if not is_correct:
+        # Если данные неверны, запрашиваем новые
+        user_states[user_id]["waiting_for"] = "new_name"
+        return "Пожалуйста, введите ваше полное имя:", None
+
+    # Если данные верны, продолжаем оформление заказа
+    result = await verify_user_data(
+        user_id=user_id,
+        is_correct=True,
+        delivery=True if user_info.get("address") else False
+    )
+    if result.get("status") != "success":
+        return result.get("message", "Произошла ошибка при оформлении заказа"), None
+
+    order_info = result["order_info"]
+
+    # Формируем текстовый запрос с деталями заказа для ИИ
+    ai_prompt = (
+        "Заказ оформлен успешно. Вот детали заказа:\n"
+        f"ФИО: {order_info['user_info']['full_name']}\n"
+        f"Телефон: {order_info['user_info']['phone']}\n"
+        f"Способ получения: {order_info['user_info']['address'] if order_info['user_info']['address'] else 'Самовывоз'}\n"
+        f"Сумма заказа: {order_info['total_amount']} {order_info['currency']}\n\n"
+        "Пожалуйста, сформулируй дружелюбное сообщение для клиента, сообщив, что заказ оформлен, "
+        "и что менеджеры скоро свяжутся с ним. В конце добавь благодарность за покупку."
+    )
+
+    # Подтверждение заказа из шаблонов (или от ИИ, если включена настройка AI_LLM_PHRASES)
+    final_message = await compose(
+        "order_delivery" if order_info["user_info"]["delivery"] else "order_pickup",
+        user_states[user_id].get("language", DEFAULT_LANGUAGE),
+        ai_prompt,
+        full_name=order_info['user_info']['full_name'],
+        total=order_info['total_amount'],
+        currency=order_info['currency'],
+        address=order_info['user_info']['address']
+    )
+
+    # Создаем клавиатуру с кнопкой "В личный кабинет"
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="⬅️ В личный кабинет", callback_data="go_to_user_dashboard")
+
+    # Очищаем корзину пользователя
+    user_carts[user_id] = []
+    return final_message, keyboard.as_markup()
+
+
+async def _dispatch_intent(message: Message, user_id: int, user_text: str, intent: str) -> None:
+    """Выполняет очевидную команду без модели и отражает обмен в истории диалога"""
+    if intent == "show_cart":
+        if user_carts.get(user_id):
+            text, keyboard = render_cart(user_id)
+            user_states[user_id]["awaiting"] = "cart_menu"
+        else:
+            text, keyboard = "Ваша корзина пуста. Напишите, что вы ищете, и я подберу варианты 🙂", None
+    elif intent == "checkout":
+        text, keyboard = await checkout_reply(user_id) or ("Ваша корзина пуста", None)
+    elif intent == "continue_shopping":
+        text, keyboard = await continue_shopping_text(user_id), None
+    else:  # yes / no после вопроса о подтверждении данных
+        text, keyboard = await verify_data_reply(user_id, intent == "yes")
+
+    user_states[user_id]["chat_history"].append({"role": "user", "content": user_text})
+    user_states[user_id]["chat_history"].append({"role": "assistant", "content": text})
+    await message.answer(text, reply_markup=keyboard)
+
+
 @ai_router.message()
 async def process_message(message: Message):
+    # Текстовые сообщения, набранные подряд, могут быть объединены в один ход
+    merge = _merge_texts if message.text else None
+    if not consultant_mailbox.submit(message.from_user.id, _handle_message, (message, message.text), merge=merge):
+        await message.answer(
+            "Это сообщение не принято: я ещё отвечаю на предыдущие. Отправьте его снова после моего ответа, пожалуйста."
+        )
+
+
+@turn_scoped
+async def _handle_message(payload: tuple):
+    message, user_text = payload
     user_id = message.from_user.id
-    user_text = message.text
 
     fake_callback = CallbackQuery(
         id="dummy_id",
@@ -1294,13 +1318,18 @@ async def process_message(message: Message):
         await cmd_start(fake_callback)
         return
 
+    # Язык клиента для шаблонных сообщений
+    language = detect_language(user_text, user_states[user_id].get("language", DEFAULT_LANGUAGE))
+    user_states[user_id]["language"] = language
+
     # Если ожидается ввод количества, обрабатываем его здесь
     if user_id in user_states and "waiting_for_quantity" in user_states[user_id]:
-        try:
-            quantity = int(user_text)
-        except ValueError:
+        # «2», «две», «3 шт» распознаются без модели
+        quantity = (await parse_slots(user_text, expect="quantity")).quantity
+        if quantity is None:
             await message.answer("Пожалуйста, введите корректное числовое значение для количества.")
             return
+        intent_stats.record("quantity")
 
         product_id = user_states[user_id].pop("waiting_for_quantity")
         selected = user_states[user_id].get("selected_product", {})
@@ -1324,25 +1353,9 @@ async def process_message(message: Message):
             user_states[user_id]["selected_product"] = {}
 
             # Формируем сообщение о корзине
-            cart = user_carts[user_id]
-            total_amount = sum(item["total"] for item in cart)
-            cart_message = "🛒 Ваша корзина:\n\n"
-            for item in cart:
-                cart_message += f"• {item['product_name']}\n"
-                cart_message += f"  Цвет: {item.get('color', 'Не указан')}\n"
-                cart_message += f"  Размер: {item.get('size', 'Не указан')}\n"
-                cart_message += f"  Количество: {item['quantity']}\n"
-                cart_message += f"  Цена: {item['price']} сом\n"
-                cart_message += f"  Итого: {item['total']} сом\n\n"
-            cart_message += f"Общая сумма: {total_amount} сом\n\n"
-            cart_message += "Что бы вы хотели сделать?\n" \
-                            "1. Продолжить покупки\n" \
-                            "2. Оформить заказ"
-
-            keyboard = InlineKeyboardBuilder()
-            keyboard.button(text="🛍 Продолжить покупки", callback_data="continue_shopping")
-            keyboard.button(text="✅ Оформить заказ", callback_data="checkout")
-            await message.answer(cart_message, reply_markup=keyboard.as_markup())
+            cart_message, keyboard = render_cart(user_id)
+            await message.answer(cart_message, reply_markup=keyboard)
+            user_states[user_id]["awaiting"] = "cart_menu"
         else:
             await message.answer(result.get("error", "Ошибка при добавлении в корзину"))
         return
@@ -1405,19 +1418,17 @@ async def process_message(message: Message):
                     "и что менеджеры скоро свяжутся с ним для уточнения деталей доставки. В конце добавь благодарность за покупку."
                 )
 
-                # Отправляем запрос в ИИ
-                ai_response = await asyncio.to_thread(
-                    openai_client.chat.completions.create,
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "Ты дружелюбный консультант магазина спортивной одежды."},
-                        {"role": "user", "content": ai_prompt}
-                    ],
-                    max_tokens=200
+                # Подтверждение заказа из шаблонов (или от ИИ, если включена настройка AI_LLM_PHRASES)
+                final_message = await compose(
+                    "order_delivery",
+                    language,
+                    ai_prompt,
+                    full_name=order_info['user_info']['full_name'],
+                    total=order_info['total_amount'],
+                    currency=order_info['currency'],
+                    address=order_info['user_info']['address']
                 )
 
-                final_message = ai_response.choices[0].message.content
-
                 # Создаем клавиатуру с кнопкой "В личный кабинет"
                 keyboard = InlineKeyboardBuilder()
                 keyboard.button(text="⬅️ В личный кабинет", callback_data="go_to_user_dashboard")
@@ -1437,33 +1448,61 @@ async def process_message(message: Message):
                 )
             return
 
-    # Проверяем, не выполняется ли уже поиск
-    if user_id in user_states and user_states[user_id].get("search_in_progress"):
-        # Если поиск уже выполняется, отправляем ответ и прерываем обработку
-        await message.answer("Я сейчас ищу товары по вашему предыдущему запросу. Дождитесь результатов, пожалуйста.")
+    # Очевидные команды («корзина», «оформить», «да» после вопроса о данных) выполняем без модели
+    intent = classify(user_text, user_states[user_id].pop("awaiting", None))
+    if intent:
+        intent_stats.record(intent)
+        await _dispatch_intent(message, user_id, user_text, intent)
         return
 
+    # Ответ вида «XL» или «чёрный» на показанную подборку уточняем локально, без модели
+    if (user_states[user_id].get("search_context") or {}).get("candidate_ids"):
+        slots = await parse_slots(user_text)
+        if slots.refines_search:
+            intent_stats.record("refine_search")
+            await _answer_refined_search(message, user_id, user_text, await refine_search(user_id, slots))
+            return
+
+    intent_stats.record(None)
+
     # Добавляем сообщение пользователя в историю диалога
     user_states[user_id]["chat_history"].append({"role": "user", "content": user_text})
+    # Неизменный префикс промпта (сводка каталога могла смениться с начала диалога)
+    user_states[user_id]["chat_history"][0] = await consultant_system_message()
 
+    # Потоковое сообщение текущего ответа; при сбое его нужно убрать до запасного ответа
+    writer = None
     try:
-        user_states[user_id]["search_in_progress"] = True # Помечаем начало поиска
-        # Отправляем запрос в OpenAI
-        response = await asyncio.to_thread(
-            openai_client.chat.completions.create,
-            model="gpt-4o",
-            messages=user_states[user_id]["chat_history"],
-            tools=tools,
-            tool_choice="auto"
-        )
-
-        ai_message = response.choices[0].message
+        # Держим историю в пределах бюджета токенов до отправки в модель
+        await maintain_history(user_states[user_id])
+        # Отправляем запрос в OpenAI; текстовый ответ показываем по мере генерации
+        writer = TelegramStreamWriter(message) if STREAMING_ENABLED else None
+        if writer:
+            ai_message = await llm_guard.call(LLMTask.DIALOGUE, lambda: stream_chat_completion(
+                writer.push,
+                task=LLMTask.DIALOGUE,
+                messages=user_states[user_id]["chat_history"],
+                tools=tools,
+                tool_choice="auto"
+            ))
+        else:
+            response = await llm_guard.call(LLMTask.DIALOGUE, lambda: chat_completion(
+                task=LLMTask.DIALOGUE,
+                messages=user_states[user_id]["chat_history"],
+                tools=tools,
+                tool_choice="auto"
+            ))
+            ai_message = response.choices[0].message
         tool_calls = ai_message.tool_calls
 
+        # Если перед вызовом инструментов модель успела написать текст, дописываем его
+        if tool_calls and writer and writer.started:
+            await writer.finish()
+
         # Если ИИ вызывает функцию
         if tool_calls:
             available_functions = {
-                "get_products": get_products,
+                "get_products": lambda params: get_products(),
                 "get_product_details": lambda params: get_product_details(params["product_name"]),
                 "add_to_cart": lambda params: add_to_cart(user_id, **params),
                 "complete_order": lambda params: complete_order(user_id, **params),
@@ -1474,23 +1513,26 @@ async def process_message(message: Message):
                 "verify_user_data": lambda params: verify_user_data(user_id, **params)
             }
 
-            for tool_call in tool_calls:
-                if tool_call.function.name in ["filter_products", "get_product_details"]:
-                    # Запрашиваем у ИИ сгенерировать сообщение
-                    ai_response = await asyncio.to_thread(
-                        openai_client.chat.completions.create,
-                        model="gpt-4o",
-                        messages=[
-                            {"role": "system", "content": "Ты дружелюбный консультант магазина спортивной одежды."},
-                            {"role": "user",
-                             "content": "Сформулируй очень короткое сообщение для клиента о том, что ты проверяешь наличие товаров."}
-                        ],
-                        max_tokens=50
+            # Короткое статусное сообщение перед поиском (одно на ход, из шаблонов без запроса к модели)
+            lookup_call = next(
+                (tc for tc in tool_calls if tc.function.name in ["filter_products", "get_product_details"]), None
+            )
+            if lookup_call:
+                if lookup_call.function.name == "get_product_details":
+                    product_name = json.loads(lookup_call.function.arguments).get("product_name", "")
+                    status_text = await compose(
+                        "checking_product", language,
+                        f"Сформулируй очень короткое сообщение для клиента о том, что ты проверяешь наличие товара «{product_name}».",
+                        product_name=product_name
+                    )
+                else:
+                    status_text = await compose(
+                        "checking_availability", language,
+                        "Сформулируй очень короткое сообщение для клиента о том, что ты проверяешь наличие товаров."
                     )
 
-                    await message.answer(ai_response.choices[0].message.content)
-                    user_states[user_id]["chat_history"].append(
-                    {"role": "assistant", "content": ai_response.choices[0].message.content})
+                await message.answer(status_text)
+                user_states[user_id]["chat_history"].append({"role": "assistant", "content": status_text})
 
             # Сохраняем вызов инструмента в историю
             user_states[user_id]["chat_history"].append({
@@ -1512,21 +1554,23 @@ async def process_message(message: Message):
             function_responses = []
             needs_clarification = False
             clarification_message = ""
+            clarification_context = {}
             show_products_media_group = False
             products_to_show = []
 
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-                function_to_call = available_functions[function_name]
-                function_response = await function_to_call(function_args)
+            # Независимые вызовы выполняются параллельно, вызовы с побочными эффектами - по очереди
+            parsed_calls = [(tc, tc.function.name, json.loads(tc.function.arguments)) for tc in tool_calls]
+            call_results = await execute_tool_calls(
+                available_functions, [(name, args) for _, name, args in parsed_calls]
+            )
 
+            for (tool_call, function_name, function_args), function_response in zip(parsed_calls, call_results):
                 # Сохраняем ответ функции
                 function_responses.append({
                     "role": "tool",
                     "tool_call_id": tool_call.id,
                     "name": function_name,
-                    "content": json.dumps(function_response, ensure_ascii=False)
+                    "content": json.dumps(strip_for_prompt(function_response), ensure_ascii=False)
                 })
 
                 # Проверяем результаты filter_products для специальной обработки
@@ -1535,6 +1579,7 @@ async def process_message(message: Message):
                     if function_response.get("needs_clarification"):
                         needs_clarification = True
                         clarification_message = function_response["message"]
+                        clarification_context = function_response.get("context", {})
                     # Если найдены точные совпадения - показываем их в виде карусели
                     elif function_response.get("exact_matches"):
                         show_products_media_group = True
@@ -1546,14 +1591,13 @@ async def process_message(message: Message):
 
             # Добавляем все ответы функций в историю
             user_states[user_id]["chat_history"].extend(function_responses)
-            user_states[user_id]["busy"] = False
 
             # Если требуется уточнение, отправляем его напрямую
             if needs_clarification:
                 # Сохраняем контекст поиска в состоянии пользователя
                 if user_id not in user_states:
                     user_states[user_id] = {}
-                user_states[user_id]["search_context"] = function_response.get("context", {})
+                user_states[user_id]["search_context"] = clarification_context
 
                 # Добавляем сообщение с уточнением в историю
                 user_states[user_id]["chat_history"].append({
@@ -1561,38 +1605,39 @@ async def process_message(message: Message):
                     "content": clarification_message
                 })
                 await message.answer(clarification_message)
-                user_states[user_id].pop("search_in_progress", None) # Убираем флаг поиска
                 return
 
             # Если нужно показать товары в виде карусели
             if show_products_media_group and products_to_show:
-                # Сохраняем текущие товары в состоянии пользователя
-                user_states[user_id]["current_products"] = products_to_show
-
-                # Создаем и отправляем карусель с первым товаром
-                media, keyboard = await create_product_carousel(products_to_show)
-                if media and keyboard:
-                    await message.answer_photo(
-                        photo=media.media,
-                        caption=media.caption,
-                        parse_mode="Markdown",
-                        reply_markup=keyboard
-                    )
-                else:
-                    await message.answer("Извините, не удалось показать товары. Попробуйте еще раз.")
-                user_states[user_id].pop("search_in_progress", None) # Убираем флаг поиска
+                await send_products_carousel(message, user_id, products_to_show)
                 return
 
-            # Стандартная обработка для других случаев
-            second_response = await asyncio.to_thread(
-                openai_client.chat.completions.create,
-                model="gpt-4o",
-                messages=user_states[user_id]["chat_history"]
+            # Стандартная обработка для других случаев.
+            # Ответ к get_product_details уходит подписью к фото, поэтому его ждём целиком.
+            streamed = STREAMING_ENABLED and not any(
+                tc.function.name == "get_product_details" for tc in tool_calls
             )
-
-            new_ai_message = second_response.choices[0].message
+            priority = LLMPriority.CHECKOUT if any(
+                tc.function.name in CHECKOUT_TOOLS for tc in tool_calls
+            ) else LLMPriority.BROWSING
+            if streamed:
+                writer = TelegramStreamWriter(message)
+                await writer.start()
+                new_ai_message = await llm_guard.call(LLMTask.DIALOGUE, lambda: stream_chat_completion(
+                    writer.push,
+                    priority=priority,
+                    task=LLMTask.DIALOGUE,
+                    messages=user_states[user_id]["chat_history"]
+                ))
+                await writer.finish(new_ai_message.content)
+            else:
+                second_response = await llm_guard.call(LLMTask.DIALOGUE, lambda: chat_completion(
+                    priority=priority,
+                    task=LLMTask.DIALOGUE,
+                    messages=user_states[user_id]["chat_history"]
+                ))
+                new_ai_message = second_response.choices[0].message
             user_states[user_id]["chat_history"].append({"role": "assistant", "content": new_ai_message.content})
-            user_states[user_id]["busy"] = False
 
             # Если это была функция get_product_details, нужно отправить фото товара
             send_text_message = True
@@ -1611,32 +1656,43 @@ async def process_message(message: Message):
                                 parse_mode="Markdown"
                             )
                             send_text_message = False
-                            user_states[user_id].pop("search_in_progress", None) # Убираем флаг поиска
                             break
                         except Exception as e:
                             logger.error(f"Ошибка при отправке фото: {e}")
                             send_text_message = True
 
             # Отправляем текстовый ответ пользователю только если не отправили фото с подписью
-            if send_text_message:
+            if send_text_message and not streamed:
                 await message.answer(new_ai_message.content)
-            user_states[user_id].pop("search_in_progress", None) # Убираем флаг поиска
 
         # Если ИИ не вызывает функцию, просто отправляем сообщение
         else:
             user_states[user_id]["chat_history"].append({"role": "assistant", "content": ai_message.content})
-            await message.answer(ai_message.content)
-            user_states[user_id].pop("search_in_progress", None) # Убираем флаг поиска
+            if writer:
+                await writer.finish(ai_message.content)
+            else:
+                await message.answer(ai_message.content)
 
+    except LLMUnavailableError as e:
+        logger.warning(f"Ответ без модели: {e}")
+        if writer:
+            await writer.abort()
+        await _answer_without_model(message, user_id, user_text)
+        return
+    except LLMOverloadedError as e:
+        logger.warning(f"Консультант перегружен: {e}")
+        if writer:
+            await writer.abort()
+        await message.answer(
+            "Сейчас у нас очень много обращений 🙏 Пожалуйста, повторите ваш вопрос через минуту.")
+        return
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения: {e}")
+        if writer:
+            await writer.abort()
         await message.answer(
             "Извините, произошла небольшая техническая заминка. Давайте попробуем еще раз? Пожалуйста, повторите ваш вопрос.")
         return
-    finally:
-        # Разблокируем пользователя после завершения работы
-        if user_id in user_states:
-            user_states[user_id].pop("search_in_progress", None)
 
 async def create_product_carousel(products: List[Dict], product_index: int = 0, photo_index: int = 0) -> tuple[
     InputMediaPhoto, InlineKeyboardMarkup]:
@@ -1691,10 +1747,74 @@ async def create_product_carousel(products: List[Dict], product_index: int = 0,
     return media, keyboard.as_markup()
 
 
+async def send_products_carousel(message: Message, user_id: int, products: List[Dict]) -> None:
+    """Сохраняет подборку в состоянии пользователя и показывает карусель с первым товаром"""
+    user_states[user_id]["current_products"] = products
+
+    media, keyboard = await create_product_carousel(products)
+    if media and keyboard:
+        await message.answer_photo(
+            photo=media.media,
+            caption=media.caption,
+            parse_mode="Markdown",
+            reply_markup=keyboard
+        )
+    else:
+        await message.answer("Извините, не удалось показать товары. Попробуйте еще раз.")
+
+
+async def _answer_without_model(message: Message, user_id: int, user_text: str) -> None:
+    """Модель недоступна: показываем локальную подборку по сообщению клиента, если она есть"""
+    search_index = await get_search_index()
+    candidates = [hit.product for hit in search_index.search(user_text, SEARCH_TOP_K)]
+    if not candidates:
+        await message.answer(
+            "Извините, сейчас я отвечаю медленнее обычного. Попробуйте, пожалуйста, повторить вопрос чуть позже.")
+        return
+
+    result = local_search_result(user_id, user_text, await parse_slots(user_text), candidates)
+    products = result["recommended_products"]
+    user_states[user_id]["chat_history"].append({
+        "role": "assistant",
+        "content": "Показал подходящие товары: " + ", ".join(f"{p['name']} ({p['price']} сом)" for p in products)
+    })
+    await message.answer("Вот что нашлось по вашему запросу 👇")
+    await send_products_carousel(message, user_id, products)
+
+
+async def _answer_refined_search(message: Message, user_id: int, user_text: str, result: Dict) -> None:
+    """Показывает результат локального уточнения и отражает его в истории, чтобы модель знала контекст"""
+    history = user_states[user_id]["chat_history"]
+    history.append({"role": "user", "content": user_text})
+    if result.get("needs_clarification"):
+        history.append({"role": "assistant", "content": result["message"]})
+        await message.answer(result["message"])
+        return
+
+    products = result["recommended_products"]
+    history.append({
+        "role": "assistant",
+        "content": "Показал подходящие товары: " + ", ".join(f"{p['name']} ({p['price']} сом)" for p in products)
+    })
+    await send_products_carousel(message, user_id, products)
+
+
 # Обработчик для callback-запросов
 @ai_router.callback_query()
 async def process_callback(callback: CallbackQuery):
+    if not consultant_mailbox.submit(callback.from_user.id, _handle_callback, callback):
+        await callback.answer("Нажатие не принято: ещё обрабатываю предыдущие действия. Повторите через пару секунд.")
+
+
+@turn_scoped
+async def _handle_callback(callback: CallbackQuery):
     user_id = callback.from_user.id
+    if user_id not in user_states:
+        # Кнопка из старого сообщения: диалог после перезапуска или очистки не сохранился
+        await callback.answer("Консультация завершена. Откройте консультацию заново, пожалуйста.", show_alert=True)
+        return
+    # Нажатие кнопки отвечает на последний вопрос бота, текстовые «да» или «1» к нему больше не относятся
+    user_states[user_id].pop("awaiting", None)
     if "selected_product" not in user_states[user_id]:
         user_states[user_id]["selected_product"] = {}
     data = callback.data
@@ -1867,33 +1987,13 @@ async def process_callback(callback: CallbackQuery):
                 # Очищаем выбранные параметры
                 user_states[user_id]["selected_product"] = {}
 
-                # Формируем сообщение о корзине
-                cart = user_carts[user_id]
-                total_amount = sum(item["total"] for item in cart)
-
-                cart_message = "🛒 Ваша корзина:\n\n"
-                for item in cart:
-                    cart_message += f"• {item['product_name']}\n"
-                    cart_message += f"  Цвет: {item.get('color', 'Не указан')}\n"
-                    cart_message += f"  Размер: {item.get('size', 'Не указан')}\n"
-                    cart_message += f"  Количество: {item['quantity']}\n"
-                    cart_message += f"  Цена: {item['price']} сом\n"
-                    cart_message += f"  Итого: {item['total']} сом\n\n"
-                cart_message += f"Общая сумма: {total_amount} сом\n\n"
-                cart_message += "Что бы вы хотели сделать?\n"
-                cart_message += "1. Продолжить покупки\n"
-                cart_message += "2. Оформить заказ"
-
-                # Создаем клавиатуру с кнопками
-                keyboard = InlineKeyboardBuilder()
-                keyboard.button(text="🛍 Продолжить покупки", callback_data="continue_shopping")
-                keyboard.button(text="✅ Оформить заказ", callback_data="checkout")
-
-                # Отправляем сообщение с корзиной
+                # Формируем и отправляем сообщение о корзине
+                cart_message, keyboard = render_cart(user_id)
                 await callback.message.answer(
                     cart_message,
-                    reply_markup=keyboard.as_markup()
+                    reply_markup=keyboard
                 )
+                user_states[user_id]["awaiting"] = "cart_menu"
 
                 # Добавляем сообщение в историю диалога
                 user_states[user_id]["chat_history"].append({
@@ -1906,145 +2006,23 @@ async def process_callback(callback: CallbackQuery):
                 await callback.answer(result.get("error", "Ошибка при добавлении в корзину"))
 
         elif data == "continue_shopping":
-            # Очищаем состояние текущих товаров
-            user_states[user_id].pop("current_products", None)
-
-            # Сохраняем предыдущие выборы пользователя
-            previous_selections = user_states[user_id].get("selected_product", {})
-
-            # Формируем контекст для ИИ с учетом предыдущих выборов
-            ai_context = "Клиент хочет продолжить покупки. "
-            if previous_selections:
-                details = []
-                if "color" in previous_selections:
-                    details.append(f"цвет: {previous_selections['color']}")
-                if "size" in previous_selections:
-                    details.append(f"размер: {previous_selections['size']}")
-                if details:
-                    ai_context += f"Ранее клиент выбирал {', '.join(details)}. "
-
-            # Отправляем запрос в OpenAI
-            response = await asyncio.to_thread(
-                openai_client.chat.completions.create,
-                model="gpt-4o",
-                messages=[
-                    {"role": "system",
-                     "content": "Ты дружелюбный консультант магазина спортивной одежды. Твоя задача - помочь клиенту продолжить покупки, учитывая его предыдущие предпочтения."},
-                    {"role": "user", "content": ai_context}
-                ]
-            )
-
-            # Получаем ответ от ИИ
-            ai_message = response.choices[0].message.content
-
-            # Обновляем сообщение с ответом ИИ
-            await callback.message.edit_text(ai_message)
+            # Обновляем сообщение с ответом
+            await callback.message.edit_text(await continue_shopping_text(user_id))
             await callback.answer()
 
-
         elif data == "checkout":
             # Начинаем процесс оформления заказа
-            result = await complete_order(user_id)
-            if result.get("needs_details"):
-                await callback.message.edit_text(
-                    result["message"],
-                    reply_markup=None
-                )
-            elif result.get("user_data_exists"):
-                # Если у пользователя есть данные, показываем их для подтверждения
-                user_info = result["user_info"]
-                cart_summary = result["cart_summary"]
-
-                message = f"Проверьте, пожалуйста, ваши данные:\n\n"
-                message += f"ФИО: {user_info['full_name']}\n"
-                message += f"Телефон: {user_info['phone']}\n"
-                message += f"Адрес: {user_info['address']}\n\n"
-                message += "Всё верно?"
-
-                keyboard = InlineKeyboardBuilder()
-                keyboard.button(text="✅ Да, всё верно", callback_data="verify_data:true")
-                keyboard.button(text="❌ Нет, изменить", callback_data="verify_data:false")
-
-                await callback.message.edit_text(
-                    message,
-                    reply_markup=keyboard.as_markup()
-                )
+            reply = await checkout_reply(user_id)
+            if reply:
+                text, keyboard = reply
+                await callback.message.edit_text(text, reply_markup=keyboard)
             await callback.answer()
 
         elif data.startswith("verify_data:"):
             # Обработка подтверждения данных пользователя
             _, is_correct = data.split(":")
-            is_correct = is_correct.lower() == "true"
-
-            # Получаем информацию о пользователе
-            user_info = await get_user_info(user_id)
-
-            # Проверяем наличие корзины
-            if user_id not in user_carts or not user_carts[user_id]:
-                await callback.message.edit_text("Ваша корзина пуста")
-                await callback.answer()
-                return
-
-            if is_correct:
-                # Если данные верны, продолжаем оформление заказа
-                result = await verify_user_data(
-                    user_id=user_id,
-                    is_correct=True,
-                    delivery=True if user_info.get("address") else False
-                )
-
-                if result.get("status") == "success":
-                    # Вместо фиксированного сообщения, отправляем заказ в ИИ для генерации финального ответа
-                    order_info = result["order_info"]
-
-                    # Формируем текстовый запрос с деталями заказа для ИИ
-                    ai_prompt = (
-                        "Заказ оформлен успешно. Вот детали заказа:\n"
-                        f"ФИО: {order_info['user_info']['full_name']}\n"
-                        f"Телефон: {order_info['user_info']['phone']}\n"
-                        f"Способ получения: {order_info['user_info']['address'] if order_info['user_info']['address'] else 'Самовывоз'}\n"
-                        f"Сумма заказа: {order_info['total_amount']} {order_info['currency']}\n\n"
-                        "Пожалуйста, сформулируй дружелюбное сообщение для клиента, сообщив, что заказ оформлен, "
-                        "и что менеджеры скоро свяжутся с ним. В конце добавь благодарность за покупку."
-                    )
-
-                    # Отправляем запрос в ИИ (используем asyncio.to_thread для вызова синхронного клиента)
-                    ai_response = await asyncio.to_thread(
-                        openai_client.chat.completions.create,
-                        model="gpt-4o",
-                        messages=[
-                            {"role": "system", "content": "Ты дружелюбный консультант магазина спортивной одежды."},
-                            {"role": "user", "content": ai_prompt}
-                        ],
-                        max_tokens=200
-                    )
-
-                    final_message = ai_response.choices[0].message.content
-
-                    # Создаем клавиатуру с кнопкой "В личный кабинет"
-                    keyboard = InlineKeyboardBuilder()
-                    keyboard.button(text="⬅️ В личный кабинет", callback_data="go_to_user_dashboard")
-
-                    # Обновляем сообщение для клиента с добавлением кнопки
-                    await callback.message.edit_text(
-                        final_message,
-                        reply_markup=keyboard.as_markup()
-                    )
-
-                    # Очищаем корзину пользователя
-                    user_carts[user_id] = []
-                else:
-                    await callback.message.edit_text(
-                        result.get("message", "Произошла ошибка при оформлении заказа")
-                    )
-            else:
-                # Если данные неверны, запрашиваем новые
-                await callback.message.edit_text(
-                    "Пожалуйста, введите ваше полное имя:"
-                )
-                # Устанавливаем состояние для ожидания нового имени
-                user_states[user_id]["waiting_for"] = "new_name"
-
+            text, keyboard = await verify_data_reply(user_id, is_correct.lower() == "true")
+            await callback.message.edit_text(text, reply_markup=keyboard)
             await callback.answer()
 
         elif data.startswith("delivery:"):
@@ -2088,19 +2066,17 @@ async def process_callback(callback: CallbackQuery):
                         "и что менеджеры скоро свяжутся с ним для уточнения деталей самовывоза. В конце добавь благодарность за покупку."
                     )
 
-                    # Отправляем запрос в ИИ
-                    ai_response = await asyncio.to_thread(
-                        openai_client.chat.completions.create,
-                        model="gpt-4o",
-                        messages=[
-                            {"role": "system", "content": "Ты дружелюбный консультант магазина спортивной одежды."},
-                            {"role": "user", "content": ai_prompt}
-                        ],
-                        max_tokens=200
+                    # Подтверждение заказа из шаблонов (или от ИИ, если включена настройка AI_LLM_PHRASES)
+                    final_message = await compose(
+                        "order_pickup",
+                        user_states[user_id].get("language", DEFAULT_LANGUAGE),
+                        ai_prompt,
+                        full_name=order_info['user_info']['full_name'],
+                        total=order_info['total_amount'],
+                        currency=order_info['currency'],
+                        address=order_info['user_info']['address']
                     )
 
-                    final_message = ai_response.choices[0].message.content
-
                     # Создаем клавиатуру с кнопкой "В личный кабинет"
                     keyboard = InlineKeyboardBuilder()
                     keyboard.button(text="⬅️ В личный кабинет", callback_data="go_to_user_dashboard")
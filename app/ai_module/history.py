@@ -0,0 +1,151 @@
+import os
+import json
+import logging
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from app.ai_module.llm_client import chat_completion
+from app.ai_module.model_router import LLMTask
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Бюджет токенов на историю диалога, отправляемую модели
+HISTORY_TOKEN_BUDGET = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", "6000"))
+# Сколько последних реплик клиента (вместе с ответами и вызовами инструментов) хранить дословно
+HISTORY_KEEP_TURNS = int(os.getenv("AI_HISTORY_KEEP_TURNS", "6"))
+# Ответы инструментов длиннее этого порога в старых репликах сокращаются до ссылок
+HISTORY_TOOL_COMPACT_CHARS = int(os.getenv("AI_HISTORY_TOOL_COMPACT_CHARS", "400"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("AI_HISTORY_SUMMARY_MAX_TOKENS", "300"))
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+
+# Грубая оценка: для русского текста около трёх символов на токен
+_CHARS_PER_TOKEN = 3
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """Приблизительное число токенов в списке сообщений"""
+    total = 0
+    for msg in messages:
+        size = len(msg.get("content") or "")
+        for tool_call in msg.get("tool_calls") or []:
+            size += len(tool_call["function"]["name"]) + len(tool_call["function"]["arguments"])
+        total += size // _CHARS_PER_TOKEN + _MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def _compact_tool_content(content: str) -> str:
+    """Заменяет объёмный ответ инструмента минимальной ссылкой на найденные товары или сутью ответа"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return content[:HISTORY_TOOL_COMPACT_CHARS]
+    if not isinstance(data, dict):
+        return content[:HISTORY_TOOL_COMPACT_CHARS]
+
+    compact = {}
+    for key in ("recommended_products", "alternatives", "related_products"):
+        if data.get(key):
+            compact[key] = [
+                {"id": p.get("id"), "name": p.get("name"), "price": p.get("price")} for p in data[key]
+            ]
+    if "name" in data and "price" in data:
+        compact["product"] = {"id": data.get("id"), "name": data["name"], "price": data["price"]}
+    for key in ("status", "message", "error", "needs_clarification", "no_exact_match", "exact_matches"):
+        if key in data:
+            compact[key] = data[key]
+    if not compact:
+        return content[:HISTORY_TOOL_COMPACT_CHARS]
+    return json.dumps(compact, ensure_ascii=False)
+
+
+def _split_turns(messages: List[Dict]) -> List[List[Dict]]:
+    """
+    Делит историю на реплики: каждая начинается с сообщения клиента и включает ответы
+    и вызовы инструментов, так что assistant.tool_calls никогда не отрывается от ответов tool.
+    """
+    turns = []
+    for msg in messages:
+        if msg["role"] == "user" or not turns:
+            turns.append([msg])
+        else:
+            turns[-1].append(msg)
+    return turns
+
+
+def _render_for_summary(turns: List[List[Dict]]) -> str:
+    lines = []
+    for turn in turns:
+        for msg in turn:
+            if msg["role"] == "tool":
+                lines.append(f"[результат {msg.get('name', 'инструмента')}]: {_compact_tool_content(msg['content'])}")
+            elif msg.get("content"):
+                speaker = "Клиент" if msg["role"] == "user" else "Консультант"
+                lines.append(f"{speaker}: {msg['content']}")
+    return "\n".join(lines)
+
+
+async def _summarize(previous_summary: str, turns: List[List[Dict]]) -> str:
+    transcript = _render_for_summary(turns)
+    try:
+        response = await chat_completion(
+            task=LLMTask.SUMMARY,
+            messages=[
+                {"role": "system",
+                 "content": "Ты ведёшь заметки консультанта магазина спортивной одежды. Обнови краткое содержание "
+                            "диалога: что ищет клиент, его размеры, цвета, бюджет, показанные и выбранные товары, "
+                            "состояние корзины и заказа. Пиши кратко, по делу, не более 8 пунктов."},
+                {"role": "user",
+                 "content": f"Текущее содержание:\n{previous_summary or '—'}\n\nНовые реплики:\n{transcript}"}
+            ]
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        # Без модели сохраняем хотя бы реплики клиента
+        logger.error(f"Ошибка при обновлении краткого содержания диалога: {e}")
+        client_lines = [
+            f"- {msg['content']}" for turn in turns for msg in turn if msg["role"] == "user" and msg.get("content")
+        ]
+        summary = "\n".join(filter(None, [previous_summary, *client_lines]))
+        return summary[-HISTORY_SUMMARY_MAX_TOKENS * _CHARS_PER_TOKEN:]
+
+
+async def maintain_history(state: Dict) -> None:
+    """
+    Держит chat_history в пределах бюджета токенов: системный промпт и последние
+    HISTORY_KEEP_TURNS реплик остаются дословно, ответы инструментов в более старых
+    репликах сокращаются, а при превышении бюджета старые реплики сворачиваются в краткое содержание.
+    """
+    history = state.get("chat_history")
+    if not history:
+        return
+
+    system_prompt = history[0]
+    body = history[1:]
+    if body and body[0]["role"] == "system" and body[0]["content"].startswith(SUMMARY_PREFIX):
+        body = body[1:]
+    turns = _split_turns(body)
+
+    # Последняя (текущая) реплика нужна модели целиком
+    for turn in turns[:-1]:
+        for msg in turn:
+            if msg["role"] == "tool" and len(msg["content"]) > HISTORY_TOOL_COMPACT_CHARS:
+                msg["content"] = _compact_tool_content(msg["content"])
+
+    summary = state.get("history_summary", "")
+    if estimate_tokens(history) > HISTORY_TOKEN_BUDGET and len(turns) > HISTORY_KEEP_TURNS:
+        folded, turns = turns[:-HISTORY_KEEP_TURNS], turns[-HISTORY_KEEP_TURNS:]
+        summary = await _summarize(summary, folded)
+        state["history_summary"] = summary
+        logger.info(f"История диалога свёрнута: {sum(len(t) for t in folded)} сообщений в краткое содержание")
+
+    new_history = [system_prompt]
+    if summary:
+        new_history.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+    for turn in turns:
+        new_history.extend(turn)
+    state["chat_history"] = new_history
@@ -0,0 +1,108 @@
+import re
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Очевидные команды клиента по языкам. Шаблон должен совпасть со всем сообщением целиком
+# (после приведения к нижнему регистру и удаления знаков препинания), иначе решает модель.
+LEXICONS: Dict[str, Dict[str, List[str]]] = {
+    "show_cart": {
+        "ru": [r"(моя |мою |показать |покажи |покажите |открой |открыть )?корзин[аую]( покажи| покажите)?",
+               r"что (у меня )?в корзине"],
+        "en": [r"(show |open )?(my )?(shopping )?(cart|basket)", r"what s in (my )?(cart|basket)"],
+        "ky": [r"себет(ти)?( көрсөт| көрсөтчү)?", r"корзинаны? көрсөт(чү)?"],
+    },
+    "checkout": {
+        "ru": [r"(хочу |давайте |давай |можно )?оформ(ить|ляем|ляй|и)( заказ| покупку)?",
+               r"оформление( заказа)?", r"(хочу )?заказать", r"к оформлению"],
+        "en": [r"check ?out", r"(i want to )?(place|make) (an |the |my )?order"],
+        "ky": [r"(заказ|буйрутма) (берүү|беремин|кылуу|кылам)"],
+    },
+    "continue_shopping": {
+        "ru": [r"продолж(ить|аем|им)( покупки)?", r"(хочу )?(посмотреть|выбрать) (что нибудь |что то )?(еще|другое)"],
+        "en": [r"continue( shopping)?", r"keep shopping"],
+        "ky": [r"улантуу", r"улантабыз", r"дагы (көрөм|карайм)"],
+    },
+    "yes": {
+        "ru": [r"да", r"да (все )?верно", r"(все )?верно", r"подтверждаю", r"ага", r"угу", r"конечно"],
+        "en": [r"yes", r"yep", r"yeah", r"correct", r"(that s )?right"],
+        "ky": [r"ооба", r"туура", r"ооба туура"],
+    },
+    "no": {
+        "ru": [r"нет", r"не ?верно", r"(нет )?(надо |нужно )?изменить"],
+        "en": [r"no", r"nope", r"wrong", r"change( it)?"],
+        "ky": [r"жок", r"туура эмес", r"өзгөртүү"],
+    },
+}
+
+_PATTERNS = {
+    intent: [re.compile(f"^(?:{pattern})$") for patterns in by_language.values() for pattern in patterns]
+    for intent, by_language in LEXICONS.items()
+}
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize(text: Optional[str]) -> str:
+    """Нижний регистр, ё -> е, без знаков препинания и эмодзи, одиночные пробелы"""
+    if not text:
+        return ""
+    text = _PUNCTUATION_RE.sub(" ", text.lower().replace("ё", "е"))
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def classify(text: Optional[str], awaiting: Optional[str] = None) -> Optional[str]:
+    """
+    Возвращает намерение или None, если сообщение нужно отдать модели.
+    awaiting - что бот только что спросил: «да/нет» понятны только после вопроса
+    о подтверждении данных, «1/2» - только после меню корзины.
+    """
+    normalized = normalize(text)
+    if not normalized:
+        return None
+    if awaiting == "cart_menu" and normalized in ("1", "2"):
+        return "continue_shopping" if normalized == "1" else "checkout"
+    for intent, patterns in _PATTERNS.items():
+        if intent in ("yes", "no") and awaiting != "verify_data":
+            continue
+        if any(pattern.match(normalized) for pattern in patterns):
+            return intent
+    return None
+
+
+class IntentStats:
+    """Сколько сообщений обработано локально и сколько ушло в модель"""
+
+    def __init__(self, log_every: int = 100):
+        self.log_every = log_every
+        self.local = Counter()
+        self.llm = 0
+
+    def record(self, intent: Optional[str]) -> None:
+        if intent:
+            self.local[intent] += 1
+        else:
+            self.llm += 1
+        if self.total % self.log_every == 0:
+            logger.info(f"Локальный роутер намерений: {self.snapshot()}")
+
+    @property
+    def total(self) -> int:
+        return sum(self.local.values()) + self.llm
+
+    @property
+    def hit_rate(self) -> float:
+        return sum(self.local.values()) / self.total if self.total else 0.0
+
+    def snapshot(self) -> Dict:
+        return {
+            "total": self.total,
+            "local": dict(self.local),
+            "llm": self.llm,
+            "hit_rate": round(self.hit_rate, 3),
+        }
+
+
+intent_stats = IntentStats()
@@ -0,0 +1,189 @@
+import os
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+
+from app.database import requests as rq
+from app.ai_module.llm_scheduler import llm_scheduler, estimate_request_tokens, LLMPriority
+from app.ai_module.model_router import LLMTask, get_route
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Пул HTTP-соединений к OpenAI, общий для всех диалогов
+LLM_MAX_CONNECTIONS = int(os.getenv("AI_LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("AI_LLM_MAX_KEEPALIVE", "20"))
+# Таймаут одного вызова по умолчанию (секунды) и число повторов при сетевых ошибках
+LLM_TIMEOUT = float(os.getenv("AI_LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("AI_LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("AI_LLM_MAX_RETRIES", "2"))
+
+
+class LLMNotConfiguredError(RuntimeError):
+    """API-ключ OpenAI не задан в настройках"""
+
+
+_client: Optional[AsyncOpenAI] = None
+_client_api_key: Optional[str] = None
+# Подписчики на расход токенов каждого вызова: (модель, usage)
+_usage_listeners: List[Callable[[Optional[str], object], None]] = []
+
+
+async def init_llm_client(api_key: Optional[str] = None) -> Optional[AsyncOpenAI]:
+    """
+    Создаёт общий асинхронный клиент OpenAI. Если ключ не передан, берёт OPENAI_API из настроек.
+    Повторный вызов с тем же ключом возвращает существующий клиент, с новым - пересоздаёт его.
+    """
+    global _client, _client_api_key
+    if api_key is None:
+        api_key = await rq.get_setting_value("OPENAI_API")
+    if not api_key:
+        logger.error("API-ключ OpenAI не найден в БД.")
+        return None
+    if _client is not None and api_key == _client_api_key:
+        return _client
+
+    previous = _client
+    _client = AsyncOpenAI(
+        api_key=api_key,
+        max_retries=LLM_MAX_RETRIES,
+        timeout=LLM_TIMEOUT,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        )
+    )
+    _client_api_key = api_key
+    logger.info("OpenAI клиент инициализирован.")
+
+    if previous is not None:
+        await previous.close()
+    return _client
+
+
+async def close_llm_client() -> None:
+    """Закрывает пул соединений при остановке бота"""
+    global _client, _client_api_key
+    if _client is not None:
+        await _client.close()
+    _client = None
+    _client_api_key = None
+
+
+def _total_tokens(usage) -> Optional[int]:
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+async def _apply_route(task: Optional[LLMTask], timeout: Optional[float], kwargs: dict) -> Optional[float]:
+    """Подставляет модель, max_tokens и таймаут класса вызова, если они не заданы явно"""
+    if task is None:
+        return timeout
+    route = await get_route(task)
+    kwargs.setdefault("model", route.model)
+    if route.max_tokens and "max_tokens" not in kwargs:
+        kwargs["max_tokens"] = route.max_tokens
+    return timeout or route.timeout
+
+
+def add_usage_listener(listener: Callable[[Optional[str], object], None]) -> None:
+    """Подписка на usage каждого вызова модели (например, для замеров в benchmarks/replay.py)"""
+    _usage_listeners.append(listener)
+
+
+def _log_usage(model: Optional[str], usage) -> None:
+    """Пишет в лог, какая часть промпта пришла из кэша провайдера"""
+    if usage is None:
+        return
+    for listener in _usage_listeners:
+        listener(model, usage)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    prompt = usage.prompt_tokens or 0
+    logger.info(
+        f"Вызов {model}: промпт {prompt} токенов (из кэша {cached}, без кэша {prompt - cached}), "
+        f"ответ {usage.completion_tokens or 0}"
+    )
+
+
+async def chat_completion(*, task: Optional[LLMTask] = None, priority: LLMPriority = LLMPriority.BROWSING,
+                          timeout: Optional[float] = None, **kwargs):
+    """
+    Вызов chat.completions.create на общем клиенте прямо в цикле событий.
+    task выбирает модель, max_tokens и таймаут по настройкам маршрутизации (model_router).
+    Запрос сначала проходит через общий планировщик (лимиты RPM/TPM и приоритет).
+    Отмена задачи (asyncio.CancelledError) прерывает HTTP-запрос.
+    """
+    client = _client or await init_llm_client()
+    if client is None:
+        raise LLMNotConfiguredError("API-ключ OpenAI не задан")
+    timeout = await _apply_route(task, timeout, kwargs)
+    estimated = estimate_request_tokens(kwargs)
+    await llm_scheduler.acquire(priority, estimated)
+    response = await client.chat.completions.create(timeout=timeout or LLM_TIMEOUT, **kwargs)
+    llm_scheduler.record_usage(estimated, _total_tokens(response.usage))
+    _log_usage(kwargs.get("model"), response.usage)
+    return response
+
+
+async def stream_chat_completion(on_text: Callable[[str], Awaitable[None]], *, task: Optional[LLMTask] = None,
+                                 priority: LLMPriority = LLMPriority.BROWSING, timeout: Optional[float] = None,
+                                 **kwargs) -> ChatCompletionMessage:
+    """
+    Потоковый вызов chat.completions.create. Каждый фрагмент текста передаётся в on_text,
+    а по окончании возвращается собранное сообщение (вместе с вызовами инструментов, если они были).
+    """
+    client = _client or await init_llm_client()
+    if client is None:
+        raise LLMNotConfiguredError("API-ключ OpenAI не задан")
+    timeout = await _apply_route(task, timeout, kwargs)
+    estimated = estimate_request_tokens(kwargs)
+    await llm_scheduler.acquire(priority, estimated)
+    stream = await client.chat.completions.create(
+        stream=True, stream_options={"include_usage": True}, timeout=timeout or LLM_TIMEOUT, **kwargs
+    )
+
+    content_parts = []
+    tool_calls = {}
+    usage = None
+    async for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage  # приходит последним фрагментом без choices
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content_parts.append(delta.content)
+            await on_text(delta.content)
+        for tool_call in delta.tool_calls or []:
+            # Аргументы инструментов приходят кусками, собираем их по индексу вызова
+            entry = tool_calls.setdefault(tool_call.index, {"id": None, "name": "", "arguments": ""})
+            if tool_call.id:
+                entry["id"] = tool_call.id
+            if tool_call.function:
+                entry["name"] += tool_call.function.name or ""
+                entry["arguments"] += tool_call.function.arguments or ""
+
+    llm_scheduler.record_usage(estimated, _total_tokens(usage))
+    _log_usage(kwargs.get("model"), usage)
+
+    return ChatCompletionMessage(
+        role="assistant",
+        content="".join(content_parts) or None,
+        tool_calls=[
+            ChatCompletionMessageToolCall(
+                id=entry["id"],
+                type="function",
+                function=Function(name=entry["name"], arguments=entry["arguments"])
+            )
+            for _, entry in sorted(tool_calls.items())
+        ] or None
+    )
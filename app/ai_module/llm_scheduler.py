@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Бюджет аккаунта OpenAI: запросов и токенов в минуту
+LLM_RPM = float(os.getenv("AI_LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("AI_LLM_TPM", "200000"))
+# Сколько запросов может ждать в очереди и сколько секунд каждый готов ждать
+LLM_QUEUE_LIMIT = int(os.getenv("AI_LLM_QUEUE_LIMIT", "200"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("AI_LLM_QUEUE_TIMEOUT", "30"))
+# Сколько токенов ответа закладывать, если max_tokens не указан
+LLM_DEFAULT_COMPLETION_TOKENS = int(os.getenv("AI_LLM_DEFAULT_COMPLETION_TOKENS", "400"))
+# Ожидание дольше этого порога попадает в лог как признак перегрузки
+LLM_SLOW_WAIT_LOG = float(os.getenv("AI_LLM_SLOW_WAIT_LOG", "2"))
+
+_CHARS_PER_TOKEN = 3
+_WAIT_SAMPLES = 500
+
+# Событие, которое acquire выставляет, когда запрос пропущен к модели (см. resilience.LLMGuard)
+admission_signal: ContextVar[Optional[asyncio.Event]] = ContextVar("llm_admission_signal", default=None)
+
+
+class LLMPriority(IntEnum):
+    """Чем меньше значение, тем раньше запрос получает доступ к модели"""
+    CHECKOUT = 0  # оформление и подтверждение заказа
+    BROWSING = 1  # подбор товаров и ответы на вопросы
+    FILLER = 2    # статусные и необязательные фразы
+
+
+class LLMOverloadedError(RuntimeError):
+    """Очередь запросов к модели переполнена или ожидание превысило допустимое"""
+
+
+class _TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Запрос больше ёмкости ведра ждёт, пока ведро заполнится целиком
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else 0.0
+
+
+def estimate_request_tokens(kwargs: Dict) -> int:
+    """Грубая оценка токенов запроса: промпт с описанием инструментов плюс предел ответа"""
+    size = len(json.dumps(kwargs.get("messages", []), ensure_ascii=False, default=str))
+    if kwargs.get("tools"):
+        size += len(json.dumps(kwargs["tools"], ensure_ascii=False))
+    return size // _CHARS_PER_TOKEN + (kwargs.get("max_tokens") or LLM_DEFAULT_COMPLETION_TOKENS)
+
+
+class LLMScheduler:
+    """
+    Единая точка допуска запросов к модели: ограничивает запросы и токены в минуту
+    (два «ведра с токенами»), пропускает ожидающих в порядке приоритета, а внутри
+    приоритета - в порядке поступления. Очередь ограничена по длине и по времени ожидания.
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM,
+                 queue_limit: int = LLM_QUEUE_LIMIT, queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self._requests = _TokenBucket(rpm)
+        self._tokens = _TokenBucket(tpm)
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self._queue: List[tuple] = []  # (приоритет, порядковый номер, токены, future)
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._waits: deque = deque(maxlen=_WAIT_SAMPLES)
+        self._admitted = {priority: 0 for priority in LLMPriority}
+        self._rejected = 0
+
+    def _try_take(self, tokens: int) -> bool:
+        now = time.monotonic()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        if self._requests.tokens >= 1 and self._tokens.tokens >= min(tokens, self._tokens.capacity):
+            self._requests.tokens -= 1
+            self._tokens.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, priority: LLMPriority, tokens: int) -> None:
+        """Ждёт разрешения на запрос; при перегрузке выбрасывает LLMOverloadedError"""
+        started = time.monotonic()
+        if not self._queue and self._try_take(tokens):
+            self._record(priority, started)
+            return
+
+        if len(self._queue) >= self.queue_limit:
+            self._rejected += 1
+            raise LLMOverloadedError("Очередь запросов к модели переполнена")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (int(priority), next(self._sequence), tokens, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._rejected += 1
+                raise LLMOverloadedError("Превышено время ожидания очереди к модели")
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            raise
+        self._record(priority, started)
+
+    async def _dispatch(self) -> None:
+        while self._queue:
+            priority, _, tokens, future = self._queue[0]
+            if future.done():  # ожидающий ушёл по таймауту или отмене
+                heapq.heappop(self._queue)
+                continue
+            if self._try_take(tokens):
+                heapq.heappop(self._queue)
+                future.set_result(None)
+                continue
+            delay = max(self._requests.wait_time(1), self._tokens.wait_time(tokens), 0.01)
+            await asyncio.sleep(delay)
+
+    def record_usage(self, estimated: int, actual: Optional[int]) -> None:
+        """Поправляет бюджет токенов на разницу между оценкой и фактическим расходом"""
+        if actual is not None:
+            self._tokens.tokens -= actual - estimated
+
+    def _record(self, priority: LLMPriority, started: float) -> None:
+        admitted = admission_signal.get()
+        if admitted is not None:
+            admitted.set()
+        waited = time.monotonic() - started
+        self._waits.append(waited)
+        self._admitted[priority] += 1
+        if waited >= LLM_SLOW_WAIT_LOG:
+            logger.warning(
+                f"Запрос к модели ({priority.name}) ждал в очереди {waited:.1f} с, в очереди {self.queue_depth()}"
+            )
+
+    def queue_depth(self) -> int:
+        return sum(1 for *_, future in self._queue if not future.done())
+
+    def stats(self) -> Dict:
+        """Показатели загрузки: глубина очереди по приоритетам, время ожидания, отказы"""
+        waits = sorted(self._waits)
+        depth = {priority.name: 0 for priority in LLMPriority}
+        for priority, _, _, future in self._queue:
+            if not future.done():
+                depth[LLMPriority(priority).name] += 1
+        return {
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": depth,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95) - 1] if len(waits) >= 20 else (waits[-1] if waits else 0.0),
+            "wait_max": waits[-1] if waits else 0.0,
+            "admitted": {priority.name: count for priority, count in self._admitted.items()},
+            "rejected": self._rejected,
+            "requests_available": round(self._requests.tokens, 1),
+            "tokens_available": round(self._tokens.tokens),
+        }
+
+
+llm_scheduler = LLMScheduler()
+
+
+async def run_llm_stats_logger(interval: float = float(os.getenv("AI_LLM_STATS_INTERVAL", "60"))) -> None:
+    """Фоновая задача: раз в interval секунд пишет в лог загрузку планировщика, если были запросы"""
+    previous = None
+    while True:
+        await asyncio.sleep(interval)
+        stats = llm_scheduler.stats()
+        if stats["admitted"] != previous or stats["queue_depth"]:
+            logger.info(f"Планировщик LLM: {json.dumps(stats, ensure_ascii=False)}")
+        previous = stats["admitted"]
@@ -0,0 +1,115 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Сколько секунд ждать продолжения, если за сообщением в очереди уже стоит следующее
+# (одиночное сообщение обрабатывается сразу, без ожидания)
+MAILBOX_COALESCE_WINDOW = float(os.getenv("AI_MAILBOX_COALESCE_WINDOW", "0.7"))
+# Сколько необработанных событий одного пользователя держать в очереди
+MAILBOX_MAX_PENDING = int(os.getenv("AI_MAILBOX_MAX_PENDING", "20"))
+
+
+@dataclass
+class _Job:
+    handler: Callable[[Any], Awaitable[Any]]
+    payload: Any
+    merge: Optional[Callable[[List[Any]], Any]] = None
+
+
+class UserMailbox:
+    """
+    Очередь событий для каждого пользователя: сообщения и нажатия кнопок одного клиента
+    обрабатываются строго по порядку, разные клиенты друг друга не ждут.
+    Подряд идущие задания с одним обработчиком и функцией merge объединяются в одно,
+    если can_coalesce(user_id) разрешает это в момент обработки.
+    prepare(user_id) выполняется перед каждым заданием (например, подгрузка сессии с диска).
+    """
+
+    def __init__(self, can_coalesce: Optional[Callable[[Hashable], bool]] = None,
+                 coalesce_window: float = MAILBOX_COALESCE_WINDOW, max_pending: int = MAILBOX_MAX_PENDING,
+                 prepare: Optional[Callable[[Hashable], Awaitable[None]]] = None):
+        self._can_coalesce = can_coalesce or (lambda user_id: True)
+        self._prepare = prepare
+        self.coalesce_window = coalesce_window
+        self.max_pending = max_pending
+        self._pending: Dict[Hashable, Deque[_Job]] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+
+    def submit(self, user_id: Hashable, handler: Callable[[Any], Awaitable[Any]], payload: Any,
+               merge: Optional[Callable[[List[Any]], Any]] = None) -> bool:
+        """
+        Ставит задание в очередь пользователя. При переполненной очереди сообщение дописывается
+        в последнее задание, если их можно объединить; иначе возвращает False - событие не принято.
+        """
+        pending = self._pending.setdefault(user_id, deque())
+        if len(pending) >= self.max_pending:
+            tail = pending[-1] if pending else None
+            if (merge is not None and tail is not None and tail.handler is handler and tail.merge is merge
+                    and self._can_coalesce(user_id)):
+                tail.payload = merge([tail.payload, payload])
+                return True
+            logger.warning(f"Очередь пользователя {user_id} переполнена, событие не принято")
+            return False
+        pending.append(_Job(handler, payload, merge))
+        if user_id not in self._workers:
+            self._workers[user_id] = asyncio.create_task(self._drain(user_id))
+        return True
+
+    @staticmethod
+    def _is_continuation(pending: Deque[_Job], job: _Job) -> bool:
+        return bool(pending) and pending[0].handler is job.handler and pending[0].merge is job.merge
+
+    def pending_count(self, user_id: Hashable) -> int:
+        return len(self._pending.get(user_id, ()))
+
+    async def _drain(self, user_id: Hashable) -> None:
+        pending = self._pending[user_id]
+        try:
+            while pending:
+                if self._prepare is not None:
+                    try:
+                        await self._prepare(user_id)
+                    except Exception as e:
+                        logger.exception(f"Ошибка при подготовке события пользователя {user_id}: {e}")
+                job = pending.popleft()
+                payload = job.payload
+                if job.merge is not None and self._can_coalesce(user_id):
+                    # Ждём продолжения, только если клиент уже прислал следующее сообщение
+                    if self.coalesce_window > 0 and self._is_continuation(pending, job):
+                        await asyncio.sleep(self.coalesce_window)
+                    payloads = [payload]
+                    while self._is_continuation(pending, job):
+                        payloads.append(pending.popleft().payload)
+                    if len(payloads) > 1:
+                        logger.info(f"Объединено {len(payloads)} сообщений пользователя {user_id} в один ход")
+                        payload = job.merge(payloads)
+                try:
+                    await job.handler(payload)
+                except Exception as e:
+                    logger.exception(f"Ошибка при обработке события пользователя {user_id}: {e}")
+        finally:
+            self._workers.pop(user_id, None)
+            if not pending:
+                self._pending.pop(user_id, None)
+
+    async def wait_idle(self, user_id: Hashable) -> None:
+        """Ждёт, пока очередь пользователя опустеет (замеры в benchmarks/replay.py)"""
+        while user_id in self._workers:
+            await asyncio.wait([self._workers[user_id]])
+
+    async def join(self, timeout: Optional[float] = None) -> None:
+        """Ждёт, пока все очереди опустеют (используется при остановке бота)"""
+        while self._workers:
+            done, still_running = await asyncio.wait(list(self._workers.values()), timeout=timeout)
+            if still_running:
+                logger.warning(f"Не дождались завершения {len(still_running)} очередей пользователей")
+                return
@@ -0,0 +1,79 @@
+import os
+import copy
+import json
+import time
+import functools
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.database.catalog import catalog_version
+
+load_dotenv()
+
+# Сколько секунд результат инструмента живёт в общем кэше и сколько записей в нём хранится
+TOOL_MEMO_TTL = float(os.getenv("AI_TOOL_MEMO_TTL", "120"))
+TOOL_MEMO_MAX_ENTRIES = int(os.getenv("AI_TOOL_MEMO_MAX_ENTRIES", "2048"))
+
+# Кэш текущего хода (сообщения или нажатия кнопки); None вне обработчика
+_turn_cache: ContextVar[Optional[Dict]] = ContextVar("tool_turn_cache", default=None)
+# Общий кэш: ключ -> (момент истечения, результат)
+_shared_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def turn_scoped(handler):
+    """Обработчик получает свой кэш результатов инструментов на время одного хода"""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        token = _turn_cache.set({})
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            _turn_cache.reset(token)
+    return wrapper
+
+
+def _make_key(name: str, args: tuple, kwargs: dict) -> tuple:
+    arguments = json.dumps([args, kwargs], ensure_ascii=False, sort_keys=True, default=str)
+    return name, arguments, catalog_version()
+
+
+def memoized_tool(ttl: float = TOOL_MEMO_TTL):
+    """
+    Запоминает результат инструмента по имени функции, аргументам и версии каталога:
+    в пределах хода - всегда, между ходами - на ttl секунд. Изменение каталога меняет ключ.
+    Возвращается копия, чтобы вызывающий код мог менять результат.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = _make_key(func.__name__, args, kwargs)
+            turn_cache = _turn_cache.get()
+            if turn_cache is not None and key in turn_cache:
+                return copy.deepcopy(turn_cache[key])
+
+            now = time.monotonic()
+            cached = _shared_cache.get(key)
+            if cached is not None and cached[0] > now:
+                _shared_cache.move_to_end(key)
+                value = cached[1]
+            else:
+                value = await func(*args, **kwargs)
+                # Ошибки (например, сбой запроса к модели) между ходами не запоминаем
+                if not (isinstance(value, dict) and value.get("error")):
+                    _shared_cache[key] = (now + ttl, value)
+                    _shared_cache.move_to_end(key)
+                    while len(_shared_cache) > TOOL_MEMO_MAX_ENTRIES:
+                        _shared_cache.popitem(last=False)
+
+            if turn_cache is not None:
+                turn_cache[key] = value
+            return copy.deepcopy(value)
+        return wrapper
+    return decorator
+
+
+def clear_tool_memo() -> None:
+    _shared_cache.clear()
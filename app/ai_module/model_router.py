@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import logging
+from dataclasses import dataclass, replace
+from enum import Enum
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.database import requests as rq
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+
+class LLMTask(str, Enum):
+    """Классы вызовов модели; у каждого своя модель, лимит ответа и таймаут"""
+    DIALOGUE = "dialogue"              # основной диалог с вызовом инструментов
+    RANKING = "ranking"                # выбор товаров из кандидатов в filter_products (JSON)
+    RECOMMENDATION = "recommendation"  # предложение продолжить покупки
+    CONFIRMATION = "confirmation"      # текст подтверждения заказа
+    CHITCHAT = "chitchat"              # короткие статусные фразы
+    SUMMARY = "summary"                # краткое содержание старой части диалога
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    model: str
+    max_tokens: Optional[int]
+    timeout: float
+
+
+# Большая модель - только для диалога, где важны вызовы инструментов; остальное - быстрая и дешёвая
+DEFAULT_ROUTES: Dict[LLMTask, ModelRoute] = {
+    LLMTask.DIALOGUE: ModelRoute("gpt-4o", None, 60.0),
+    LLMTask.RANKING: ModelRoute("gpt-4o-mini", 600, 20.0),
+    LLMTask.RECOMMENDATION: ModelRoute("gpt-4o-mini", 200, 15.0),
+    LLMTask.CONFIRMATION: ModelRoute("gpt-4o-mini", 300, 20.0),
+    LLMTask.CHITCHAT: ModelRoute("gpt-4o-mini", 60, 10.0),
+    LLMTask.SUMMARY: ModelRoute(os.getenv("AI_HISTORY_SUMMARY_MODEL", "gpt-4o-mini"),
+                                int(os.getenv("AI_HISTORY_SUMMARY_MAX_TOKENS", "300")), 30.0),
+}
+
+# Настройки хранятся в таблице settings рядом с OPENAI_API: AI_ROUTE_RANKING и т.п.
+ROUTE_SETTING_PREFIX = "AI_ROUTE_"
+ROUTE_CACHE_TTL = float(os.getenv("AI_ROUTE_CACHE_TTL", "60"))
+
+_route_cache: Dict[LLMTask, tuple] = {}
+
+
+def route_setting_key(task: LLMTask) -> str:
+    return ROUTE_SETTING_PREFIX + task.name
+
+
+def parse_route(value: Optional[str], default: ModelRoute) -> ModelRoute:
+    """
+    Значение настройки: JSON {"model": "gpt-4o", "max_tokens": 300, "timeout": 20}
+    (любые поля можно опустить) или просто название модели.
+    """
+    value = (value or "").strip()
+    if not value:
+        return default
+    if not value.startswith("{"):
+        return replace(default, model=value)
+    data = json.loads(value)
+    route = default
+    if data.get("model"):
+        route = replace(route, model=str(data["model"]))
+    if "max_tokens" in data:
+        route = replace(route, max_tokens=int(data["max_tokens"]) if data["max_tokens"] else None)
+    if data.get("timeout"):
+        route = replace(route, timeout=float(data["timeout"]))
+    return route
+
+
+async def get_route(task: LLMTask) -> ModelRoute:
+    """Маршрут для класса вызова; настройки из БД перечитываются не чаще раза в ROUTE_CACHE_TTL секунд"""
+    now = time.monotonic()
+    cached = _route_cache.get(task)
+    if cached and now < cached[1]:
+        return cached[0]
+
+    default = DEFAULT_ROUTES[task]
+    route = cached[0] if cached else default
+    key = route_setting_key(task)
+    try:
+        route = parse_route(await rq.get_setting_value(key), default)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Некорректное значение настройки {key}: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка при чтении настройки {key}: {e}")
+    _route_cache[task] = (route, now + ROUTE_CACHE_TTL)
+    return route
+
+
+def invalidate_routes() -> None:
+    """Сбрасывает кэш маршрутов, например после изменения настроек"""
+    _route_cache.clear()
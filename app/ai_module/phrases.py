@@ -0,0 +1,178 @@
+import re
+import time
+import random
+import logging
+from typing import Dict, List, Optional
+
+from app.database import requests as rq
+from app.ai_module.llm_client import chat_completion
+from app.ai_module.llm_scheduler import LLMPriority
+from app.ai_module.model_router import LLMTask
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = "ru"
+
+# Пулы шаблонов по типу сообщения и языку. Переменные подставляются через str.format.
+PHRASES: Dict[str, Dict[str, List[str]]] = {
+    "checking_availability": {
+        "ru": [
+            "Секунду, проверяю, что есть в наличии 🔍",
+            "Сейчас посмотрю, что у нас есть по вашему запросу 👀",
+            "Минутку, подбираю подходящие варианты…",
+            "Уже ищу для вас подходящие товары 🔎",
+        ],
+        "en": [
+            "One moment, checking what we have in stock 🔍",
+            "Let me look through our catalog for you 👀",
+            "Give me a second, picking the best options…",
+        ],
+        "ky": [
+            "Бир секунд, кампада эмне бар экенин карап жатам 🔍",
+            "Азыр сизге ылайыктуу товарларды издеп жатам 👀",
+        ],
+    },
+    "checking_product": {
+        "ru": [
+            "Сейчас расскажу подробнее про «{product_name}» 👌",
+            "Секунду, уточняю детали по «{product_name}»…",
+            "Проверяю наличие «{product_name}» 🔍",
+        ],
+        "en": [
+            "Let me get the details on “{product_name}” 👌",
+            "One moment, checking “{product_name}”…",
+        ],
+        "ky": [
+            "«{product_name}» тууралуу маалыматты текшерип жатам 🔍",
+        ],
+    },
+    "order_delivery": {
+        "ru": [
+            "{full_name}, спасибо за заказ! 🎉 Сумма: {total} {currency}. Доставим по адресу: {address}. "
+            "Менеджер скоро свяжется с вами, чтобы уточнить детали доставки.",
+            "Заказ оформлен ✅ {full_name}, на сумму {total} {currency} с доставкой по адресу {address}. "
+            "Наш менеджер свяжется с вами в ближайшее время. Спасибо, что выбрали Bigser!",
+        ],
+        "en": [
+            "Thank you for your order, {full_name}! 🎉 Total: {total} {currency}. Delivery to: {address}. "
+            "Our manager will contact you shortly to arrange delivery.",
+        ],
+        "ky": [
+            "{full_name}, буйрутмаңыз үчүн рахмат! 🎉 Суммасы: {total} {currency}. Дарек: {address}. "
+            "Менеджерибиз жакында сиз менен байланышат.",
+        ],
+    },
+    "order_pickup": {
+        "ru": [
+            "{full_name}, спасибо за заказ! 🎉 Сумма: {total} {currency}, самовывоз. "
+            "Менеджер скоро свяжется с вами, чтобы договориться о времени получения.",
+            "Заказ на {total} {currency} оформлен ✅ {full_name}, менеджер свяжется с вами и подскажет, "
+            "когда можно забрать покупку. Спасибо, что выбрали Bigser!",
+        ],
+        "en": [
+            "Thank you for your order, {full_name}! 🎉 Total: {total} {currency}, pickup. "
+            "Our manager will contact you shortly to arrange the pickup time.",
+        ],
+        "ky": [
+            "{full_name}, буйрутмаңыз үчүн рахмат! 🎉 Суммасы: {total} {currency}, өзүңүз алып кетесиз. "
+            "Менеджерибиз жакында сиз менен байланышат.",
+        ],
+    },
+    "continue_shopping": {
+        "ru": [
+            "Отлично, продолжаем! Что ещё подобрать? {preferences}",
+            "С удовольствием помогу выбрать что-то ещё 🙂 {preferences}Напишите, что ищете.",
+        ],
+        "en": [
+            "Great, let's keep going! What else can I find for you? {preferences}",
+        ],
+        "ky": [
+            "Жакшы, улантабыз! Дагы эмне издейсиз? {preferences}",
+        ],
+    },
+}
+
+_KYRGYZ_LETTERS = re.compile("[ңөүҢӨҮ]")
+_CYRILLIC = re.compile("[а-яА-ЯёЁ]")
+_LATIN = re.compile("[a-zA-Z]")
+
+
+def detect_language(text: Optional[str], default: str = DEFAULT_LANGUAGE) -> str:
+    """Определяет язык клиента по алфавиту сообщения"""
+    if not text:
+        return default
+    if _KYRGYZ_LETTERS.search(text):
+        return "ky"
+    cyrillic = len(_CYRILLIC.findall(text))
+    latin = len(_LATIN.findall(text))
+    if cyrillic == 0 and latin == 0:
+        return default
+    return "ru" if cyrillic >= latin else "en"
+
+
+class _BlankMissing(dict):
+    def __missing__(self, key):
+        return ""
+
+
+def render(kind: str, language: str = DEFAULT_LANGUAGE, **variables) -> str:
+    """Случайная фраза нужного типа на языке клиента с подставленными переменными"""
+    pool = PHRASES[kind]
+    templates = pool.get(language) or pool[DEFAULT_LANGUAGE]
+    return random.choice(templates).format_map(_BlankMissing(variables)).strip()
+
+
+# Подтверждения заказа важнее статусных фраз, остальное модель формулирует в последнюю очередь
+_PRIORITIES = {
+    "order_delivery": LLMPriority.CHECKOUT,
+    "order_pickup": LLMPriority.CHECKOUT,
+}
+
+# Класс вызова модели для маршрутизации; статусные фразы идут как chitchat
+_TASKS = {
+    "continue_shopping": LLMTask.RECOMMENDATION,
+    "order_delivery": LLMTask.CONFIRMATION,
+    "order_pickup": LLMTask.CONFIRMATION,
+}
+
+_LLM_PHRASES_SETTING = "AI_LLM_PHRASES"
+_SETTING_TTL = 60.0
+_setting_cache = {"value": None, "expires": 0.0}
+
+
+async def llm_phrasing_enabled() -> bool:
+    """Настройка AI_LLM_PHRASES=1 возвращает формулировки от модели вместо шаблонов"""
+    now = time.monotonic()
+    if now >= _setting_cache["expires"]:
+        try:
+            _setting_cache["value"] = await rq.get_setting_value(_LLM_PHRASES_SETTING)
+        except Exception as e:
+            logger.error(f"Ошибка при чтении настройки {_LLM_PHRASES_SETTING}: {e}")
+        _setting_cache["expires"] = now + _SETTING_TTL
+    return (_setting_cache["value"] or "").strip() in ("1", "true", "yes")
+
+
+async def compose(kind: str, language: str, llm_prompt: str, max_tokens: Optional[int] = None,
+                  system_prompt: str = "Ты дружелюбный консультант магазина спортивной одежды.",
+                  **variables) -> str:
+    """
+    Статусное или подтверждающее сообщение. По умолчанию берётся мгновенно из шаблонов;
+    если включена настройка AI_LLM_PHRASES, формулирует модель, а при её ошибке - снова шаблон.
+    Модель и max_tokens по умолчанию берутся из маршрута класса вызова (model_router).
+    """
+    if await llm_phrasing_enabled():
+        try:
+            extra = {"max_tokens": max_tokens} if max_tokens else {}
+            response = await chat_completion(
+                task=_TASKS.get(kind, LLMTask.CHITCHAT),
+                priority=_PRIORITIES.get(kind, LLMPriority.FILLER),
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": llm_prompt}
+                ],
+                **extra
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"Ошибка при генерации фразы '{kind}': {e}")
+    return render(kind, language, **variables)
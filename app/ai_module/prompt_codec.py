@@ -0,0 +1,150 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+
+from app.database.catalog import CatalogProduct, CatalogSnapshot
+
+load_dotenv()
+
+# Описание товара в промпте обрезается до этого числа символов
+PROMPT_DESCRIPTION_CHARS = int(os.getenv("AI_PROMPT_DESCRIPTION_CHARS", "160"))
+PROMPT_FIELD_CHARS = int(os.getenv("AI_PROMPT_FIELD_CHARS", "80"))
+
+# Короткие коды необязательных полей товара
+FIELD_CODES = (
+    ("t", "product_type"),
+    ("m", "material"),
+    ("f", "features"),
+    ("u", "usage"),
+    ("r", "temperature_range"),
+    ("d", "description"),
+)
+
+CATALOG_LEGEND = (
+    "Формат каталога: строки «## категория / подкатегория» - заголовки групп; далее товары строками "
+    "«id|название|цена|поля». Поля: c - цвета, s - размеры (коды из словарей Цвета и Размеры), "
+    "t - тип, m - материал, f - особенности, u - назначение, r - температурный режим, d - описание. "
+    "Ссылайся на товары только по id (например, p1)."
+)
+
+_SPACES_RE = re.compile(r"\s+")
+_SHORT_ID_RE = re.compile(r"^p\d+$")
+
+_digest_cache: Dict[int, str] = {}
+
+
+def _clip(text: Optional[str], limit: int) -> str:
+    text = _SPACES_RE.sub(" ", text or "").strip().replace("|", "/")
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+class CatalogPromptCodec:
+    """
+    Компактное представление набора товаров для промпта: категории и подкатегории один раз
+    заголовками групп, товары под короткими id (p1, p2, …) в порядке ранжирования,
+    цвета и размеры - кодами c<id>/s<id> из словарей каталога, без photo_ids и с обрезанными описаниями.
+    Ответ модели переводится обратно в товары через таблицу id.
+    """
+
+    def __init__(self, products: Sequence[CatalogProduct]):
+        self.products = list(products)
+        self._by_short_id: Dict[str, CatalogProduct] = {
+            f"p{index}": product for index, product in enumerate(self.products, start=1)
+        }
+        self._short_ids = {product.id: short_id for short_id, product in self._by_short_id.items()}
+        self._by_name = {}
+        for product in self.products:
+            self._by_name.setdefault(product.name.strip().lower(), product)
+
+    def short_id(self, product: CatalogProduct) -> str:
+        return self._short_ids[product.id]
+
+    def encode(self, with_legend: bool = True) -> str:
+        """
+        Строки товаров. with_legend=False - без легенды и словарей, когда они уже
+        переданы в неизменном префиксе промпта (см. catalog_digest)
+        """
+        lines = []
+        if with_legend:
+            colors = dict(pair for product in self.products for pair in product.colors)
+            sizes = dict(pair for product in self.products for pair in product.sizes)
+            lines.append(CATALOG_LEGEND)
+            lines.extend(_vocabulary_lines(colors, sizes))
+
+        # Группы в порядке первого появления, товары внутри группы - в порядке ранжирования
+        groups: Dict[tuple, List[CatalogProduct]] = {}
+        for product in self.products:
+            groups.setdefault((product.category or "—", product.subcategory or "—"), []).append(product)
+
+        for (category, subcategory), products in groups.items():
+            lines.append(f"## {category} / {subcategory}")
+            for product in products:
+                fields = [self.short_id(product), _clip(product.name, PROMPT_FIELD_CHARS), f"{product.price:g}"]
+                if product.colors:
+                    fields.append("c:" + ",".join(f"c{color_id}" for color_id, _ in product.colors))
+                if product.sizes:
+                    fields.append("s:" + ",".join(f"s{size_id}" for size_id, _ in product.sizes))
+                for code, attribute in FIELD_CODES:
+                    limit = PROMPT_DESCRIPTION_CHARS if attribute == "description" else PROMPT_FIELD_CHARS
+                    value = _clip(getattr(product, attribute), limit)
+                    if value:
+                        fields.append(f"{code}:{value}")
+                lines.append("|".join(fields))
+        return "\n".join(lines)
+
+    def decode(self, reference: Any) -> Optional[CatalogProduct]:
+        """Товар по короткому id из ответа модели; точное название принимается как запасной вариант"""
+        if reference is None:
+            return None
+        key = str(reference).strip().lower()
+        if _SHORT_ID_RE.match(key):
+            return self._by_short_id.get(key)
+        return self._by_name.get(key)
+
+
+def _vocabulary_lines(colors: Dict[int, str], sizes: Dict[int, str]) -> List[str]:
+    lines = []
+    if colors:
+        lines.append("Цвета: " + "; ".join(f"c{color_id}={name}" for color_id, name in sorted(colors.items())))
+    if sizes:
+        lines.append("Размеры: " + "; ".join(f"s{size_id}={size}" for size_id, size in sorted(sizes.items())))
+    return lines
+
+
+def catalog_digest(snapshot: CatalogSnapshot) -> str:
+    """
+    Сводка каталога для неизменного префикса промпта: легенда формата, словари цветов
+    и размеров, дерево категорий с числом товаров и диапазоном цен.
+    Строится один раз на версию каталога, поэтому байт в байт совпадает между запросами.
+    """
+    digest = _digest_cache.get(snapshot.version)
+    if digest is not None:
+        return digest
+
+    lines = [CATALOG_LEGEND]
+    lines.extend(_vocabulary_lines(dict(snapshot.colors), dict(snapshot.sizes)))
+    lines.append("Разделы каталога:")
+    for _, category, subcategories in snapshot.categories:
+        parts = []
+        for subcategory_id, subcategory in subcategories:
+            prices = [product.price for product in snapshot.products_in_subcategory(subcategory_id)]
+            if prices:
+                parts.append(f"{subcategory} ({len(prices)}, {min(prices):g}-{max(prices):g} сом)")
+        if parts:
+            lines.append(f"## {category}: " + "; ".join(parts))
+    digest = "\n".join(lines)
+
+    _digest_cache.clear()
+    _digest_cache[snapshot.version] = digest
+    return digest
+
+
+def strip_for_prompt(value: Any) -> Any:
+    """Убирает из ответа инструмента поля, бесполезные для модели (photo_ids)"""
+    if isinstance(value, dict):
+        return {key: strip_for_prompt(item) for key, item in value.items() if key != "photo_ids"}
+    if isinstance(value, list):
+        return [strip_for_prompt(item) for item in value]
+    return value
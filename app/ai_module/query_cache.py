@@ -0,0 +1,101 @@
+import os
+import copy
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.database.catalog import catalog_version
+from app.ai_module.search_index import stem
+from app.ai_module.slots import Slots
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Сколько секунд живёт результат подбора и сколько разных запросов хранится
+QUERY_CACHE_TTL = float(os.getenv("AI_QUERY_CACHE_TTL", "900"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("AI_QUERY_CACHE_MAX_ENTRIES", "1000"))
+
+# Слова, не меняющие смысла запроса к каталогу
+_QUERY_STOP_WORDS = {
+    "размер", "размера", "размеры", "цвет", "цвета", "цвете", "хочу", "нужна", "нужен", "нужно", "нужны",
+    "ищу", "покажи", "покажите", "подбери", "есть", "какие", "какой", "какая", "для", "мне", "в", "на", "и",
+    "size", "color", "colour", "want", "need", "show", "for", "in", "a", "the",
+}
+
+
+def normalize_query(slots: Slots) -> Optional[Tuple]:
+    """
+    Ключ запроса без учёта порядка и формы слов: основы оставшихся слов по алфавиту
+    плюс распознанные цвета и размеры. «черная куртка L» и «куртка черная размер L» дают один ключ.
+    None - если в запросе не осталось ничего значимого.
+    """
+    terms = tuple(sorted({stem(token) for token in slots.leftover if token not in _QUERY_STOP_WORDS}))
+    if not terms and not slots.colors and not slots.sizes:
+        return None
+    return terms, tuple(sorted(slots.colors)), tuple(sorted(slots.sizes))
+
+
+class RankingCache:
+    """
+    Результаты подбора товаров моделью по нормализованному запросу и версии каталога.
+    Ограничен по времени жизни и числу записей (LRU); изменение каталога сбрасывает весь кэш.
+    """
+
+    def __init__(self, ttl: float = QUERY_CACHE_TTL, max_entries: int = QUERY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, tuple]" = OrderedDict()
+        self._version = catalog_version()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self) -> int:
+        version = catalog_version()
+        if version != self._version:
+            # Админ изменил каталог: прежние подборки могли устареть
+            self._entries.clear()
+            self._version = version
+        return version
+
+    def get(self, key: Optional[Tuple]) -> Optional[Tuple[Dict, List[int]]]:
+        """(результат filter_products, id кандидатов) или None"""
+        if key is None:
+            return None
+        version = self._check_version()
+        cached = self._entries.get((version, key))
+        if cached is None or cached[0] <= time.monotonic():
+            if cached is not None:
+                del self._entries[(version, key)]
+            self.misses += 1
+            return None
+        self._entries.move_to_end((version, key))
+        self.hits += 1
+        return copy.deepcopy(cached[1]), list(cached[2])
+
+    def put(self, key: Optional[Tuple], result: Dict, candidate_ids: List[int]) -> None:
+        if key is None:
+            return
+        version = self._check_version()
+        self._entries[(version, key)] = (time.monotonic() + self.ttl, copy.deepcopy(result), list(candidate_ids))
+        self._entries.move_to_end((version, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+ranking_cache = RankingCache()
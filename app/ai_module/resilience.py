@@ -0,0 +1,209 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import openai
+from dotenv import load_dotenv
+
+from app.ai_module.llm_client import LLMNotConfiguredError
+from app.ai_module.llm_scheduler import LLMOverloadedError, admission_signal
+from app.ai_module.model_router import LLMTask, get_route
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Второй (страхующий) запрос отправляется, если первый идёт дольше этого перцентиля задержек
+LLM_HEDGE_PERCENTILE = float(os.getenv("AI_LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("AI_LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("AI_LLM_HEDGE_MIN_DELAY", "1.0"))
+# Классы вызовов, для которых страховка разрешена (она удваивает расход токенов на медленных запросах)
+LLM_HEDGE_TASKS = {task.strip() for task in os.getenv("AI_LLM_HEDGE_TASKS", "ranking").split(",") if task.strip()}
+# Размыкатель: после стольких сбоев подряд вызовы не отправляются BREAKER_RESET секунд
+LLM_BREAKER_FAILURES = int(os.getenv("AI_LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("AI_LLM_BREAKER_RESET", "30"))
+LLM_LATENCY_WINDOW = 200
+
+T = TypeVar("T")
+
+
+class LLMUnavailableError(RuntimeError):
+    """Модель не ответила в срок, недоступна или размыкатель открыт; вызывающий код переходит на локальный ответ"""
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Сбой на стороне модели, который учитывает размыкатель: таймаут, сеть, лимит частоты, 5xx.
+    Ошибки запроса (400, 401, 404 и т.п.) говорят о нашем промпте или ключе, а не о доступности модели.
+    """
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных вызовов"""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    Закрыт - вызовы идут как обычно; после failure_threshold сбоев подряд открывается
+    на reset_timeout секунд; затем пропускает один пробный вызов (полуоткрыт).
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("Размыкатель LLM закрыт: модель снова отвечает")
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"Размыкатель LLM открыт после {self.failures} сбоев подряд")
+            self.opened_at = time.monotonic()
+
+
+class LLMGuard:
+    """Срок ответа, страхующий повторный запрос и размыкатель для вызовов модели по классам"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self._latency: Dict[LLMTask, LatencyTracker] = {}
+
+    def _hedge_delay(self, task: LLMTask) -> Optional[float]:
+        if task.value not in LLM_HEDGE_TASKS:
+            return None
+        tracker = self._latency.get(task)
+        percentile = tracker.percentile(LLM_HEDGE_PERCENTILE) if tracker else None
+        return max(percentile, LLM_HEDGE_MIN_DELAY) if percentile is not None else None
+
+    @staticmethod
+    async def _attempt(factory: Callable[[], Awaitable[T]], admitted: asyncio.Event) -> T:
+        # Своя копия контекста у каждой задачи: планировщик отмечает допуск именно этой попытки
+        admission_signal.set(admitted)
+        return await factory()
+
+    async def call(self, task: LLMTask, factory: Callable[[], Awaitable[T]], *,
+                   deadline: Optional[float] = None, hedge: bool = False) -> T:
+        """
+        Выполняет factory() не дольше deadline секунд (по умолчанию - таймаут маршрута).
+        Срок отсчитывается с момента, когда планировщик пропустил запрос к модели: ожидание в нашей
+        очереди ограничено её собственным таймаутом и сбоем модели не считается.
+        hedge=True разрешает второй такой же запрос, если первый дольше обычного; берётся первый ответ.
+        LLMUnavailableError означает только срок, открытый размыкатель или сбой модели (см. is_upstream_failure);
+        ошибки запроса (400, неверная схема), перегрузка планировщика и отсутствие ключа пробрасываются
+        как есть, отмена вызывающим - без учёта в размыкателе.
+        """
+        if not self.breaker.allow():
+            raise LLMUnavailableError("размыкатель открыт")
+        deadline = deadline or (await get_route(task)).timeout
+        hedge_delay = self._hedge_delay(task) if hedge else None
+
+        admitted = asyncio.Event()
+        attempts = [asyncio.ensure_future(self._attempt(factory, admitted))]
+        error = None
+        timed_out = False
+        try:
+            admission = asyncio.ensure_future(admitted.wait())
+            try:
+                await asyncio.wait([attempts[0], admission], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                admission.cancel()
+            started = time.monotonic()
+
+            while True:
+                remaining = deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                wait_for = remaining
+                if hedge_delay is not None and len(attempts) == 1:
+                    wait_for = min(remaining, max(0.0, hedge_delay - (time.monotonic() - started)))
+                done, _ = await asyncio.wait(attempts, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+                for attempt in done:
+                    attempts.remove(attempt)
+                    if attempt.cancelled():
+                        continue
+                    if attempt.exception() is None:
+                        self.breaker.record_success()
+                        self._latency.setdefault(task, LatencyTracker()).record(time.monotonic() - started)
+                        return attempt.result()
+                    error = attempt.exception()
+                    if isinstance(error, (LLMOverloadedError, LLMNotConfiguredError)):
+                        raise error
+
+                if not attempts:
+                    # Все запущенные попытки завершились ошибкой
+                    break
+                if not done and hedge_delay is not None and len(attempts) == 1:
+                    logger.info(f"Страхующий запрос к модели ({task.value}) после {hedge_delay:.1f} с")
+                    attempts.append(asyncio.ensure_future(self._attempt(factory, asyncio.Event())))
+                    hedge_delay = None
+        except asyncio.CancelledError:
+            # Отмена вызывающим (новое сообщение клиента, остановка) - не сбой модели
+            raise
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            self.breaker.release_probe()
+
+        if timed_out:
+            self.breaker.record_failure()
+            raise LLMUnavailableError(f"модель ({task.value}) не ответила за {deadline:g} с")
+        if error is None:
+            raise LLMUnavailableError(f"модель ({task.value}) не ответила")
+        if not is_upstream_failure(error):
+            # Ошибка нашего запроса: локальный ответ её бы скрыл
+            raise error
+        self.breaker.record_failure()
+        raise LLMUnavailableError(f"ошибка модели ({task.value}): {error}") from error
+
+
+llm_guard = LLMGuard()
@@ -0,0 +1,169 @@
+import asyncio
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from app.database.catalog import CatalogProduct, CatalogSnapshot, get_catalog
+
+load_dotenv()
+
+# Сколько кандидатов передавать в модель после локального ранжирования
+SEARCH_TOP_K = int(os.getenv("AI_SEARCH_TOP_K", "15"))
+
+# Веса полей товара при подсчёте BM25
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "product_type": 2.0,
+    "subcategory": 2.0,
+    "category": 1.5,
+    "material": 1.0,
+    "features": 1.0,
+    "usage": 1.0,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Окончания русских слов, отбрасываемые при грубом стемминге (от длинных к коротким)
+_RU_ENDINGS = (
+    "ыми", "ими", "ого", "его", "ому", "ему", "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой",
+    "ом", "ем", "ую", "юю", "ам", "ям", "ах", "ях", "ов", "ев", "ей",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+)
+
+
+def stem(token: str) -> str:
+    """Грубый стемминг: отбрасывает типичное окончание, если остаётся основа от 3 символов"""
+    if token.isdigit():
+        return token
+    if re.search("[а-яё]", token):
+        token = token.replace("ё", "е")
+        for ending in _RU_ENDINGS:
+            if token.endswith(ending) and len(token) - len(ending) >= 3:
+                return token[:-len(ending)]
+        return token
+    for ending in ("es", "s"):
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[:-len(ending)]
+    return token
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Нижний регистр, разбиение на слова и стемминг"""
+    if not text:
+        return []
+    return [stem(token) for token in _TOKEN_RE.findall(text.lower())]
+
+
+class SearchHit:
+    __slots__ = ("product", "score")
+
+    def __init__(self, product: CatalogProduct, score: float):
+        self.product = product
+        self.score = score
+
+
+class SearchIndex:
+    """Инвертированный индекс BM25 по товарам снимка каталога с фасетами цвета и размера"""
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.version = snapshot.version
+        self.products = snapshot.categorized_products()
+
+        # term -> {индекс товара: взвешенная частота}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_lengths: List[float] = []
+        for doc_index, product in enumerate(self.products):
+            weighted = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(getattr(product, field)):
+                    weighted[token] += weight
+            self._doc_lengths.append(sum(weighted.values()))
+            for token, tf in weighted.items():
+                self._postings.setdefault(token, {})[doc_index] = tf
+
+        doc_count = len(self.products)
+        self._avg_length = (sum(self._doc_lengths) / doc_count) if doc_count else 0.0
+        if not self._avg_length:
+            self._avg_length = 1.0
+        self._idf = {
+            token: math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for token, docs in self._postings.items()
+        }
+
+        # Словари фасетов: название цвета -> основы его слов, размер в нижнем регистре -> размер
+        self._color_vocabulary = {
+            name: tuple(tokenize(name)) for name in set(snapshot.colors.values()) if tokenize(name)
+        }
+        self._size_vocabulary = {size.lower(): size for size in snapshot.sizes.values() if size}
+
+    def extract_facets(self, query: str) -> Tuple[Set[str], Set[str]]:
+        """Находит в запросе цвета и размеры из словарей каталога"""
+        raw_tokens = _TOKEN_RE.findall(query.lower())
+        stems = {stem(token) for token in raw_tokens}
+        colors = {name for name, parts in self._color_vocabulary.items() if all(part in stems for part in parts)}
+        sizes = {self._size_vocabulary[token] for token in raw_tokens if token in self._size_vocabulary}
+        return colors, sizes
+
+    def _matches_facets(self, product: CatalogProduct, colors: Set[str], sizes: Set[str]) -> bool:
+        if colors and not colors.intersection(product.color_names):
+            return False
+        if sizes and not sizes.intersection(product.size_names):
+            return False
+        return True
+
+    def search(self, query: str, limit: int = SEARCH_TOP_K, colors: Optional[Set[str]] = None,
+               sizes: Optional[Set[str]] = None) -> List[SearchHit]:
+        """
+        Возвращает до limit товаров, упорядоченных по BM25.
+        Цвета и размеры (явно переданные или найденные в запросе) фильтруют кандидатов;
+        если фильтр не оставляет ни одного товара, ранжирование идёт без него,
+        чтобы модель могла предложить альтернативы.
+        """
+        query_colors, query_sizes = self.extract_facets(query)
+        colors = set(colors or ()) | query_colors
+        sizes = set(sizes or ()) | query_sizes
+
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            docs = self._postings.get(token)
+            if not docs:
+                continue
+            idf = self._idf[token]
+            for doc_index, tf in docs.items():
+                norm = 1 - BM25_B + BM25_B * (self._doc_lengths[doc_index] / self._avg_length)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+        candidates = list(range(len(self.products)))
+        if colors or sizes:
+            filtered = [i for i in candidates if self._matches_facets(self.products[i], colors, sizes)]
+            if filtered:
+                candidates = filtered
+
+        # Без лексических совпадений сохраняем порядок каталога
+        candidates.sort(key=lambda i: (-scores.get(i, 0.0), i))
+        return [SearchHit(self.products[i], scores.get(i, 0.0)) for i in candidates[:limit]]
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = asyncio.Lock()
+
+
+async def get_search_index() -> SearchIndex:
+    """Возвращает индекс для текущей версии каталога, перестраивая его после изменений"""
+    global _index
+    catalog = await get_catalog()
+    if _index is not None and _index.version == catalog.version:
+        return _index
+
+    async with _index_lock:
+        if _index is None or _index.version != catalog.version:
+            # Построение индекса - чистые вычисления, выносим их из цикла событий
+            _index = await asyncio.to_thread(SearchIndex, catalog)
+        return _index
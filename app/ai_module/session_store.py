@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import asyncio
+import logging
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Set
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Сколько сессий держать в памяти, через сколько секунд простоя выгружать и предел памяти
+SESSION_MAX_IN_MEMORY = int(os.getenv("AI_SESSION_MAX_IN_MEMORY", "5000"))
+SESSION_IDLE_TTL = float(os.getenv("AI_SESSION_IDLE_TTL", "1800"))
+SESSION_MEMORY_LIMIT_MB = float(os.getenv("AI_SESSION_MEMORY_LIMIT_MB", "256"))
+# Недавно использованные сессии не выгружаются даже при нехватке места: их может менять обработчик,
+# который ждёт ответа модели (таймаут запроса с повторами укладывается в этот интервал)
+SESSION_MIN_IDLE = float(os.getenv("AI_SESSION_MIN_IDLE", "300"))
+SESSION_DB_PATH = os.getenv("AI_SESSION_DB_PATH", "ai_sessions.sqlite3")
+SESSION_MAINTENANCE_INTERVAL = float(os.getenv("AI_SESSION_MAINTENANCE_INTERVAL", "60"))
+
+_connections: Dict[str, sqlite3.Connection] = {}
+# Все обращения к файлу сессий идут через один поток: цикл событий не блокируется,
+# а чтения и записи выполняются строго в порядке постановки
+_disk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    connection = _connections.get(path)
+    if connection is None:
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, data BLOB NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        connection.commit()
+        _connections[path] = connection
+    return connection
+
+
+# --- кодек: JSON с метками для типов, которых нет в JSON ---
+
+_TYPE_TAG = "__session_type__"
+
+
+def _tag(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return {_TYPE_TAG: "decimal", "value": str(value)}
+    if isinstance(value, datetime):
+        return {_TYPE_TAG: "datetime", "value": value.isoformat()}
+    if isinstance(value, date):
+        return {_TYPE_TAG: "date", "value": value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return {_TYPE_TAG: "set", "value": list(value)}
+    raise TypeError(f"Значение типа {type(value).__name__} нельзя сохранить в сессии")
+
+
+def _untag(value: Dict) -> Any:
+    kind = value.get(_TYPE_TAG)
+    if kind is None:
+        return value
+    if kind == "decimal":
+        return Decimal(value["value"])
+    if kind == "datetime":
+        return datetime.fromisoformat(value["value"])
+    if kind == "date":
+        return date.fromisoformat(value["value"])
+    if kind == "set":
+        return set(value["value"])
+    raise ValueError(f"Неизвестный тип в сессии: {kind}")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_tag)
+
+
+def _encode(value: Any) -> bytes:
+    return zlib.compress(_dumps(value).encode("utf-8"))
+
+
+def _decode(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data).decode("utf-8"), object_hook=_untag)
+
+
+class SessionStore(MutableMapping):
+    """
+    Словарь сессий консультанта с вытеснением: горячие сессии живут в памяти,
+    сессии, простаивающие дольше idle_ttl, и самые старые при превышении лимитов
+    сохраняются в SQLite сжатым JSON и загружаются обратно при следующем обращении.
+    Итерация и len() охватывают только сессии в памяти.
+
+    Проверка наличия ключа не обращается к диску (ключи выгруженных сессий известны заранее).
+    Выгруженную сессию обработчик заранее подгружает через preload(); синхронное чтение
+    без preload() остаётся запасным путём и ждёт поток диска.
+    Лимиты памяти соблюдаются по возможности: сессии, использованные за последние
+    SESSION_MIN_IDLE секунд, не выгружаются, и при всплеске нагрузки лимит может быть превышен.
+    Значения должны состоять из JSON-типов, Decimal, datetime, date и set; другие типы - ошибка.
+    """
+
+    def __init__(self, namespace: str, max_in_memory: int = SESSION_MAX_IN_MEMORY,
+                 idle_ttl: float = SESSION_IDLE_TTL, memory_limit_mb: float = SESSION_MEMORY_LIMIT_MB,
+                 db_path: str = SESSION_DB_PATH):
+        self.namespace = namespace
+        self.max_in_memory = max_in_memory
+        self.idle_ttl = idle_ttl
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.db_path = db_path
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._last_access: Dict[Hashable, float] = {}
+        # Размеры сессий в памяти; сессии, к которым обращались после замера, перемеряются при вытеснении
+        self._sizes: Dict[Hashable, int] = {}
+        self._dirty: Set[Hashable] = set()
+        self._total_size = 0
+        # Сессии, которые сейчас записываются на диск: до окончания записи читаются отсюда
+        self._spilling: Dict[Hashable, Any] = {}
+        self._disk_keys: Optional[Set[str]] = None
+        self._over_limit_logged = False
+        _stores.append(self)
+
+    # --- хранилище на диске (выполняется в потоке _disk_executor) ---
+
+    def _read_keys(self) -> Set[str]:
+        rows = _connect(self.db_path).execute(
+            "SELECT key FROM sessions WHERE namespace = ?", (self.namespace,)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def _load(self, key: Hashable) -> Optional[Any]:
+        row = _connect(self.db_path).execute(
+            "SELECT data FROM sessions WHERE namespace = ? AND key = ?", (self.namespace, str(key))
+        ).fetchone()
+        return _decode(row[0]) if row else None
+
+    def _spill(self, items: List[tuple]) -> List[Hashable]:
+        """Записывает сессии на диск; возвращает ключи сессий, которые не удалось закодировать"""
+        rows, failed = [], []
+        now = time.time()
+        for key, value in items:
+            try:
+                rows.append((self.namespace, str(key), _encode(value), now))
+            except TypeError as e:
+                logger.error(f"Сессия '{self.namespace}' {key} не сохранена на диск: {e}")
+                failed.append(key)
+        if rows:
+            connection = _connect(self.db_path)
+            connection.executemany(
+                "INSERT OR REPLACE INTO sessions (namespace, key, data, updated_at) VALUES (?, ?, ?, ?)", rows
+            )
+            connection.commit()
+        return failed
+
+    def _forget(self, key: Hashable) -> None:
+        connection = _connect(self.db_path)
+        connection.execute("DELETE FROM sessions WHERE namespace = ? AND key = ?", (self.namespace, str(key)))
+        connection.commit()
+
+    # --- доступ к потоку диска ---
+
+    @staticmethod
+    def _run_sync(fn: Callable, *args) -> Any:
+        """Запасной синхронный путь: ждёт поток диска, сохраняя порядок операций"""
+        return _disk_executor.submit(fn, *args).result()
+
+    @staticmethod
+    def _run_later(fn: Callable, *args) -> None:
+        _disk_executor.submit(fn, *args)
+
+    def _known_keys(self) -> Set[str]:
+        if self._disk_keys is None:
+            self._disk_keys = self._run_sync(self._read_keys)
+        return self._disk_keys
+
+    async def preload(self, key: Hashable) -> None:
+        """Подгружает выгруженную сессию в память в потоке диска, не блокируя цикл событий"""
+        if key in self._entries or key in self._spilling:
+            return
+        loop = asyncio.get_running_loop()
+        if self._disk_keys is None:
+            keys = await loop.run_in_executor(_disk_executor, self._read_keys)
+            if self._disk_keys is None:
+                self._disk_keys = keys
+        if str(key) not in self._disk_keys:
+            return
+        value = await loop.run_in_executor(_disk_executor, self._load, key)
+        if value is not None and key not in self._entries and key not in self._spilling:
+            self._remember(key, value)
+
+    # --- учёт памяти ---
+
+    def _remember(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = value
+        self._dirty.add(key)
+        self._touch(key)
+
+    def _drop(self, key: Hashable) -> Any:
+        value = self._entries.pop(key)
+        self._last_access.pop(key, None)
+        self._dirty.discard(key)
+        self._total_size -= self._sizes.pop(key, 0)
+        return value
+
+    def _measure_dirty(self) -> None:
+        for key in self._dirty:
+            if key in self._entries:
+                try:
+                    size = len(_dumps(self._entries[key]))
+                except TypeError:
+                    # Такую сессию не выгрузить; ошибка попадёт в лог при попытке записи
+                    size = self._sizes.get(key, 0)
+                self._total_size += size - self._sizes.get(key, 0)
+                self._sizes[key] = size
+        self._dirty.clear()
+
+    # --- интерфейс словаря ---
+
+    def _touch(self, key: Hashable) -> None:
+        self._entries.move_to_end(key)
+        self._last_access[key] = time.monotonic()
+
+    def __getitem__(self, key: Hashable) -> Any:
+        if key not in self._entries:
+            if key in self._spilling:
+                value = self._spilling[key]
+            elif str(key) in self._known_keys():
+                value = self._run_sync(self._load, key)
+            else:
+                value = None
+            if value is None:
+                raise KeyError(key)
+            self._entries[key] = value
+        # Сессию могут изменить на месте, её размер перемеряется при следующем вытеснении
+        self._dirty.add(key)
+        self._touch(key)
+        return self._entries[key]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self._remember(key, value)
+        if len(self._entries) > self.max_in_memory or self._total_size > self.memory_limit:
+            self.evict()
+
+    def __delitem__(self, key: Hashable) -> None:
+        found = key in self._entries
+        if found:
+            self._drop(key)
+        found = self._spilling.pop(key, None) is not None or found
+        if str(key) in self._known_keys():
+            self._disk_keys.discard(str(key))
+            self._run_later(self._forget, key)
+            found = True
+        if not found:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries or key in self._spilling or str(key) in self._known_keys()
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # --- вытеснение ---
+
+    def evict(self) -> int:
+        """
+        Выгружает простаивающие сессии, затем самые старые, пока не уложимся в лимиты.
+        Запись на диск идёт в фоне; до её окончания сессия читается из памяти.
+        """
+        now = time.monotonic()
+        self._measure_dirty()
+        evicted = [key for key in self._entries if now - self._last_access.get(key, now) >= self.idle_ttl]
+
+        count = len(self._entries) - len(evicted)
+        total = self._total_size - sum(self._sizes.get(key, 0) for key in evicted)
+        skipped = set(evicted)
+        for key in self._entries:  # от давно использованных к недавним
+            if count <= self.max_in_memory and total <= self.memory_limit:
+                break
+            if key in skipped:
+                continue
+            if now - self._last_access.get(key, now) < SESSION_MIN_IDLE:
+                if not self._over_limit_logged:
+                    logger.warning(
+                        f"Сессии '{self.namespace}': лимит памяти превышен ({count} сессий, "
+                        f"{total / 1024 / 1024:.1f} МБ), остальные сессии активны и не выгружаются"
+                    )
+                    self._over_limit_logged = True
+                break
+            evicted.append(key)
+            total -= self._sizes.get(key, 0)
+            count -= 1
+        else:
+            self._over_limit_logged = False
+
+        if not evicted:
+            return 0
+        items = [(key, self._drop(key)) for key in evicted]
+        self._spilling.update(items)
+        self._known_keys().update(str(key) for key in evicted)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            try:
+                self._apply_spill(items, self._run_sync(self._spill, items))
+            except Exception as e:
+                self._apply_spill(items, [key for key, _ in items], e)
+        else:
+            future = loop.run_in_executor(_disk_executor, self._spill, items)
+            future.add_done_callback(lambda done: self._apply_spill(
+                items, [key for key, _ in items] if done.exception() else done.result(), done.exception()
+            ))
+        logger.info(f"Сессии '{self.namespace}': выгружается на диск {len(evicted)}, в памяти {len(self._entries)}")
+        return len(evicted)
+
+    def _apply_spill(self, items: List[tuple], failed: List[Hashable], error: Optional[BaseException] = None) -> None:
+        failed = set(failed)
+        for key, value in items:
+            if self._spilling.get(key) is value:
+                del self._spilling[key]
+                if key in failed and key not in self._entries:
+                    # Запись не удалась: сессия остаётся в памяти
+                    self._known_keys().discard(str(key))
+                    self._remember(key, value)
+        if error is not None:
+            logger.error(f"Ошибка при выгрузке сессий '{self.namespace}': {error}")
+
+    def flush(self) -> None:
+        """Сохраняет все сессии из памяти на диск, не выгружая их (синхронно, при остановке)"""
+        failed = set(self._run_sync(self._spill, list(self._entries.items())))
+        self._known_keys().update(str(key) for key in self._entries if key not in failed)
+
+
+_stores: List[SessionStore] = []
+
+
+async def run_session_maintenance(interval: float = SESSION_MAINTENANCE_INTERVAL) -> None:
+    """Фоновая задача: периодически вытесняет простаивающие сессии всех хранилищ"""
+    while True:
+        await asyncio.sleep(interval)
+        for store in _stores:
+            try:
+                store.evict()
+            except Exception as e:
+                logger.error(f"Ошибка при вытеснении сессий '{store.namespace}': {e}")
+
+
+def flush_all_sessions() -> None:
+    """Сохраняет все сессии на диск при остановке бота, чтобы корзины пережили перезапуск"""
+    for store in _stores:
+        try:
+            store.flush()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении сессий '{store.namespace}': {e}")
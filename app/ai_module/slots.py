@@ -0,0 +1,148 @@
+import re
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.database.catalog import CatalogProduct, CatalogSnapshot, get_catalog
+from app.ai_module.search_index import stem
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Слова, которые не делают ответ «свободным текстом»: «размер XL, пожалуйста», «давайте чёрный»
+_FILLER_WORDS = {
+    "размер", "размеры", "размера", "цвет", "цвета", "цвете", "мне", "нужен", "нужна", "нужно", "нужны",
+    "хочу", "давайте", "давай", "можно", "пожалуйста", "пжл", "плиз", "в", "и", "или", "на", "с", "лучше",
+    "тогда", "ну", "да", "вот", "такой", "такая", "такие", "шт", "штук", "штуки", "штука", "пару", "size",
+    "color", "colour", "in", "and", "or", "please", "the", "a", "i", "want", "need", "pcs", "pieces", "x",
+    "а", "есть", "ли", "у", "вас", "покажи", "покажите", "show", "have", "do", "you", "it",
+    "өлчөм", "түс", "керек", "бер", "берчи", "даана",
+}
+
+# Количество словами (ru/en/ky)
+_NUMBER_WORDS = {
+    "один": 1, "одна": 1, "одну": 1, "одно": 1, "два": 2, "две": 2, "пару": 2, "три": 3, "четыре": 4,
+    "пять": 5, "шесть": 6, "семь": 7, "восемь": 8, "девять": 9, "десять": 10,
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "бир": 1, "эки": 2, "үч": 3, "төрт": 4, "беш": 5,
+}
+_QUANTITY_UNITS = {"шт", "штук", "штуки", "штука", "pcs", "pieces", "x", "даана"}
+MAX_QUANTITY = 999
+
+
+@dataclass
+class Slots:
+    colors: Set[str] = field(default_factory=set)
+    sizes: Set[str] = field(default_factory=set)
+    quantity: Optional[int] = None
+    leftover: List[str] = field(default_factory=list)  # слова, не распознанные как значения слотов
+
+    @property
+    def slot_only(self) -> bool:
+        """Ответ состоит только из значений слотов, и модель для его понимания не нужна"""
+        return not self.leftover and bool(self.colors or self.sizes or self.quantity)
+
+    @property
+    def refines_search(self) -> bool:
+        """Ответ только уточняет размер или цвет уже показанной подборки"""
+        return self.slot_only and bool(self.colors or self.sizes)
+
+
+class SlotParser:
+    """Распознаёт размеры, цвета и количество по словарям Size/Color снимка каталога"""
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.version = snapshot.version
+        # Размеры могут содержать пробелы и знаки («S/M», «46 48»), поэтому ищем их как фразы
+        self._sizes: List[Tuple[re.Pattern, str]] = sorted(
+            (
+                (re.compile(r"(?<!\w)" + re.escape(size.lower()) + r"(?!\w)"), size)
+                for size in set(snapshot.sizes.values()) if size
+            ),
+            key=lambda item: -len(item[1])
+        )
+        self._colors: Dict[str, Tuple[str, ...]] = {}
+        for name in set(snapshot.colors.values()):
+            stems = tuple(stem(token) for token in _TOKEN_RE.findall((name or "").lower()))
+            if stems:
+                self._colors[name] = stems
+
+    def parse(self, text: Optional[str], expect: Optional[str] = None) -> Slots:
+        """
+        expect="quantity" означает, что бот спросил количество: тогда числа считаются количеством,
+        иначе число, совпадающее с размером из каталога, считается размером.
+        """
+        slots = Slots()
+        if not text:
+            return slots
+        rest = text.lower().replace("ё", "е")
+
+        if expect == "quantity":
+            rest = self._take_quantity(rest, slots, bare_numbers=True)
+        for pattern, size in self._sizes:
+            if pattern.search(rest):
+                slots.sizes.add(size)
+                rest = pattern.sub(" ", rest)
+        if slots.quantity is None:
+            rest = self._take_quantity(rest, slots, bare_numbers=False)
+
+        tokens = _TOKEN_RE.findall(rest)
+        stems = [stem(token) for token in tokens]
+        consumed = set()
+        for name, parts in self._colors.items():
+            if all(part in stems for part in parts):
+                slots.colors.add(name)
+                consumed.update(parts)
+
+        slots.leftover = [
+            token for token, token_stem in zip(tokens, stems)
+            if token_stem not in consumed and token not in _FILLER_WORDS
+        ]
+        return slots
+
+    @staticmethod
+    def _take_quantity(text: str, slots: Slots, bare_numbers: bool) -> str:
+        """Количество: «2 шт», «x3», «две»; голое число - только когда бот спрашивал количество"""
+        tokens = _TOKEN_RE.findall(text)
+        for index, token in enumerate(tokens):
+            value = None
+            if token.isdigit():
+                has_unit = (index + 1 < len(tokens) and tokens[index + 1] in _QUANTITY_UNITS) or \
+                           (index > 0 and tokens[index - 1] == "x")
+                if bare_numbers or has_unit:
+                    value = int(token)
+            elif token in _NUMBER_WORDS:
+                value = _NUMBER_WORDS[token]
+            if value is not None and 0 < value <= MAX_QUANTITY:
+                slots.quantity = value
+                return re.sub(r"(?<!\w)" + re.escape(token) + r"(?!\w)", " ", text, count=1)
+        return text
+
+
+def refine_candidates(products: List[CatalogProduct], colors: Set[str],
+                      sizes: Set[str]) -> List[CatalogProduct]:
+    """Оставляет товары, у которых есть хотя бы один из выбранных цветов и размеров"""
+    return [
+        product for product in products
+        if (not colors or colors.intersection(product.color_names))
+        and (not sizes or sizes.intersection(product.size_names))
+    ]
+
+
+_parser: Optional[SlotParser] = None
+_parser_lock = asyncio.Lock()
+
+
+async def get_slot_parser() -> SlotParser:
+    """Возвращает распознаватель для текущей версии каталога"""
+    global _parser
+    catalog = await get_catalog()
+    if _parser is not None and _parser.version == catalog.version:
+        return _parser
+    async with _parser_lock:
+        if _parser is None or _parser.version != catalog.version:
+            _parser = SlotParser(catalog)
+        return _parser
+
+
+async def parse_slots(text: Optional[str], expect: Optional[str] = None) -> Slots:
+    return (await get_slot_parser()).parse(text, expect)
@@ -0,0 +1,108 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from dotenv import load_dotenv
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Потоковая выдача ответов консультанта (AI_STREAMING=0 отключает)
+STREAMING_ENABLED = os.getenv("AI_STREAMING", "1") != "0"
+# Не чаще одного редактирования в STREAM_EDIT_INTERVAL секунд и только при приросте текста
+STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.0"))
+STREAM_MIN_DELTA = int(os.getenv("AI_STREAM_MIN_DELTA", "20"))
+
+STREAM_PLACEHOLDER = "✍️ …"
+TELEGRAM_TEXT_LIMIT = 4096
+
+
+class TelegramStreamWriter:
+    """
+    Показывает ответ модели по мере генерации: отправляет сообщение-заглушку
+    и редактирует его, объединяя фрагменты, чтобы не упираться в лимиты Telegram на edit.
+    """
+
+    def __init__(self, message: Message):
+        self._message = message
+        self._sent: Optional[Message] = None
+        self._text = ""
+        self._shown = ""
+        self._next_edit_at = 0.0
+        self._finished = False
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def started(self) -> bool:
+        return self._sent is not None
+
+    async def start(self) -> None:
+        """Сразу отправляет заглушку, не дожидаясь первого фрагмента"""
+        if self._sent is None:
+            self._sent = await self._message.answer(STREAM_PLACEHOLDER)
+            self._next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+
+    async def push(self, delta: str) -> None:
+        self._text += delta
+        if self._sent is None:
+            await self.start()
+            return
+        if time.monotonic() < self._next_edit_at or len(self._text) - len(self._shown) < STREAM_MIN_DELTA:
+            return
+        await self._edit(self._text[:TELEGRAM_TEXT_LIMIT] + " …")
+
+    async def finish(self, final_text: Optional[str] = None,
+                     reply_markup: Optional[InlineKeyboardMarkup] = None) -> Optional[Message]:
+        """Выводит окончательный текст; то, что не влезает в одно сообщение, досылает отдельно"""
+        self._finished = True
+        text = final_text if final_text is not None else self._text
+        if not text:
+            if self._sent is not None:
+                await self._safe_delete()
+            return None
+
+        chunks = [text[i:i + TELEGRAM_TEXT_LIMIT] for i in range(0, len(text), TELEGRAM_TEXT_LIMIT)]
+        if self._sent is None:
+            self._sent = await self._message.answer(chunks[0], reply_markup=reply_markup if len(chunks) == 1 else None)
+        else:
+            await self._edit(chunks[0], reply_markup=reply_markup if len(chunks) == 1 else None, final=True)
+        last = self._sent
+        for index, chunk in enumerate(chunks[1:], start=2):
+            last = await self._message.answer(chunk, reply_markup=reply_markup if index == len(chunks) else None)
+        return last
+
+    async def abort(self) -> None:
+        """Ответ модели прерван: убирает недописанное сообщение, чтобы под ним не оказался запасной ответ"""
+        if self._sent is not None and not self._finished:
+            await self._safe_delete()
+        self._finished = True
+
+    async def _edit(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None, final: bool = False) -> None:
+        try:
+            await self._sent.edit_text(text, reply_markup=reply_markup)
+            self._shown = text
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать: откладываем промежуточные правки, финальную повторяем
+            self._next_edit_at = time.monotonic() + e.retry_after
+            if final:
+                await asyncio.sleep(e.retry_after)
+                await self._edit(text, reply_markup=reply_markup, final=True)
+            return
+        except TelegramBadRequest as e:
+            # "message is not modified" и подобные ошибки не критичны
+            logger.debug(f"Не удалось обновить потоковое сообщение: {e}")
+        self._next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+
+    async def _safe_delete(self) -> None:
+        try:
+            await self._sent.delete()
+        except TelegramBadRequest:
+            pass
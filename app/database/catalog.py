@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from app.database.models import async_session, Category, Subcategory, Product, ProductPhoto, Color, Size
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CatalogProduct:
+    """Товар в снимке каталога со всеми связанными данными"""
+    id: int
+    name: str
+    price: float
+    description: Optional[str]
+    product_type: Optional[str]
+    material: Optional[str]
+    features: Optional[str]
+    usage: Optional[str]
+    temperature_range: Optional[str]
+    # Пары (id, название) в порядке id, как их раньше возвращал запрос Color.id.in_(...)
+    colors: Tuple[Tuple[int, str], ...]
+    sizes: Tuple[Tuple[int, str], ...]
+    photo_ids: Tuple[str, ...]
+    subcategory_id: Optional[int]
+    subcategory: Optional[str]
+    category_id: Optional[int]
+    category: Optional[str]
+
+    @property
+    def color_names(self) -> List[str]:
+        return [name for _, name in self.colors]
+
+    @property
+    def size_names(self) -> List[str]:
+        return [size for _, size in self.sizes]
+
+    def to_context(self) -> Dict:
+        """Словарь товара в формате, который используют filter_products и карусель"""
+        return {
+            "name": self.name,
+            "category": self.category,
+            "subcategory": self.subcategory,
+            "id": self.id,
+            "colors": self.color_names,
+            "sizes": self.size_names,
+            "price": self.price,
+            "description": self.description,
+            "photo_ids": list(self.photo_ids),
+            "product_type": self.product_type,
+            "material": self.material,
+            "features": self.features,
+            "usage": self.usage
+        }
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок каталога, привязанный к версии.
+    Снимок никогда не меняется после построения: при изменении каталога строится новый.
+    """
+
+    def __init__(self, version: int, products: Tuple[CatalogProduct, ...],
+                 categories: Tuple[Tuple[int, str, Tuple[Tuple[int, str], ...]], ...],
+                 colors: Dict[int, str], sizes: Dict[int, str]):
+        self.version = version
+        self.products = products
+        # (id категории, название, ((id подкатегории, название), ...))
+        self.categories = categories
+        self.colors = MappingProxyType(dict(colors))
+        self.sizes = MappingProxyType(dict(sizes))
+
+        by_id = {}
+        by_name = {}
+        by_subcategory = {}
+        for product in products:
+            by_id[product.id] = product
+            # При совпадающих названиях берём первый товар
+            by_name.setdefault(product.name, product)
+            by_subcategory.setdefault(product.subcategory_id, []).append(product)
+        self._by_id = MappingProxyType(by_id)
+        self._by_name = MappingProxyType(by_name)
+        self._by_subcategory = MappingProxyType({k: tuple(v) for k, v in by_subcategory.items()})
+
+    def get(self, product_id: int) -> Optional[CatalogProduct]:
+        return self._by_id.get(product_id)
+
+    def by_name(self, name: str) -> Optional[CatalogProduct]:
+        return self._by_name.get(name)
+
+    def products_in_subcategory(self, subcategory_id: int) -> Tuple[CatalogProduct, ...]:
+        return self._by_subcategory.get(subcategory_id, ())
+
+    def categorized_products(self) -> List[CatalogProduct]:
+        """Товары, привязанные к подкатегории, в порядке категория -> подкатегория -> товар"""
+        result = []
+        for _, _, subcategories in self.categories:
+            for subcategory_id, _ in subcategories:
+                result.extend(self.products_in_subcategory(subcategory_id))
+        return result
+
+
+_catalog_version = 0
+_snapshot: Optional[CatalogSnapshot] = None
+_snapshot_lock = asyncio.Lock()
+
+
+def invalidate_catalog() -> None:
+    """Помечает каталог изменённым. Новый снимок будет построен при следующем чтении."""
+    global _catalog_version
+    _catalog_version += 1
+
+
+def catalog_version() -> int:
+    return _catalog_version
+
+
+async def get_catalog() -> CatalogSnapshot:
+    """Возвращает актуальный снимок каталога, перестраивая его только после изменений"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == _catalog_version:
+        return snapshot
+
+    async with _snapshot_lock:
+        if _snapshot is not None and _snapshot.version == _catalog_version:
+            return _snapshot
+        version = _catalog_version
+        _snapshot = await _load_snapshot(version)
+        logger.info(f"Снимок каталога v{version} построен: {len(_snapshot.products)} товаров")
+        return _snapshot
+
+
+async def _load_snapshot(version: int) -> CatalogSnapshot:
+    async with async_session() as session:
+        # Категории с подкатегориями
+        tree_result = await session.execute(
+            select(Category.id, Category.name, Subcategory.id, Subcategory.name)
+            .outerjoin(Subcategory, Subcategory.category_id == Category.id)
+            .order_by(Category.id, Subcategory.id)
+        )
+        categories = {}
+        for category_id, category_name, subcategory_id, subcategory_name in tree_result.all():
+            _, subcategories = categories.setdefault(category_id, (category_name, []))
+            if subcategory_id is not None:
+                subcategories.append((subcategory_id, subcategory_name))
+
+        # Товары вместе с названиями подкатегории и категории
+        products_result = await session.execute(
+            select(Product, Subcategory.name, Category.id, Category.name)
+            .outerjoin(Subcategory, Product.subcategory_id == Subcategory.id)
+            .outerjoin(Category, Subcategory.category_id == Category.id)
+            .order_by(Product.id)
+        )
+        product_rows = products_result.all()
+
+        colors_result = await session.execute(select(Color.id, Color.name))
+        colors = {color_id: name for color_id, name in colors_result.all()}
+
+        sizes_result = await session.execute(select(Size.id, Size.size))
+        sizes = {size_id: size for size_id, size in sizes_result.all()}
+
+        photos_result = await session.execute(
+            select(ProductPhoto.product_id, ProductPhoto.file_id).order_by(ProductPhoto.id)
+        )
+        photos = {}
+        for product_id, file_id in photos_result.all():
+            photos.setdefault(product_id, []).append(file_id)
+
+    products = []
+    for product, subcategory_name, category_id, category_name in product_rows:
+        color_ids = sorted(set(product.color_ids or []))
+        size_ids = sorted(set(product.size_ids or []))
+        products.append(CatalogProduct(
+            id=product.id,
+            name=product.name,
+            price=float(product.price),
+            description=product.description,
+            product_type=product.product_type,
+            material=product.material,
+            features=product.features,
+            usage=product.usage,
+            temperature_range=product.temperature_range,
+            colors=tuple((cid, colors[cid]) for cid in color_ids if cid in colors),
+            sizes=tuple((sid, sizes[sid]) for sid in size_ids if sid in sizes),
+            photo_ids=tuple(photos.get(product.id, [])),
+            subcategory_id=product.subcategory_id,
+            subcategory=subcategory_name,
+            category_id=category_id,
+            category=category_name
+        ))
+
+    return CatalogSnapshot(
+        version=version,
+        products=tuple(products),
+        categories=tuple(
+            (category_id, name, tuple(subcategories))
+            for category_id, (name, subcategories) in categories.items()
+        ),
+        colors=colors,
+        sizes=sizes
+    )
@@ -0,0 +1,130 @@
+import json
+import logging
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from sqlalchemy import select, insert, exists, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.database.models import Base, OrderGroup, OrderGroupOrder, SchemaVersion
+from app.database.order_groups import refresh_group_summaries
+
+logger = logging.getLogger(__name__)
+
+# Колонки сводки order_groups для БД, созданных до их появления (ALTER TABLE ... ADD COLUMN)
+ORDER_GROUP_SUMMARY_COLUMNS: Dict[str, str] = {
+    "status": "VARCHAR(50) NOT NULL DEFAULT 'Ожидание'",
+    "item_count": "INTEGER NOT NULL DEFAULT 0",
+    "total_amount": "NUMERIC(12, 2) NOT NULL DEFAULT 0",
+    "customer_name": "VARCHAR(255)",
+    "created_at": "DATETIME",
+}
+
+
+async def add_missing_columns(conn: AsyncConnection, table: str, columns: Dict[str, str]) -> list:
+    """Добавляет отсутствующие колонки в существующую таблицу, возвращает имена добавленных"""
+    existing = {row[1] for row in await conn.execute(text(f"PRAGMA table_info({table})"))}
+    added = []
+    for name, ddl in columns.items():
+        if name not in existing:
+            await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+            added.append(name)
+    return added
+
+
+async def create_missing_indexes(conn: AsyncConnection, *tables) -> None:
+    # create_all создаёт индексы только вместе с новой таблицей
+    def create(sync_conn):
+        for table in tables:
+            for index in table.indexes:
+                index.create(sync_conn, checkfirst=True)
+
+    await conn.run_sync(create)
+
+
+async def backfill_order_group_members(conn: AsyncConnection) -> None:
+    """
+    Переносит состав групп из JSON-колонки order_groups.order_ids в order_group_orders.
+    Трогает только группы без строк состава, поэтому повторный запуск ничего не меняет.
+    """
+    result = await conn.execute(
+        select(OrderGroup.id, OrderGroup.order_ids_json)
+        .where(~exists().where(OrderGroupOrder.order_group_id == OrderGroup.id))
+    )
+    rows = []
+    for group_id, order_ids in result:
+        # update_order_status раньше сохранял список строкой JSON
+        if isinstance(order_ids, str):
+            order_ids = json.loads(order_ids)
+        for position, order_id in enumerate(dict.fromkeys(order_ids or [])):
+            rows.append({"order_group_id": group_id, "order_id": order_id, "position": position})
+    if rows:
+        await conn.execute(insert(OrderGroupOrder), rows)
+        logger.info(f"Состав групп заказов перенесён в order_group_orders: {len(rows)} строк")
+
+
+# Сколько групп пересчитывать за один запрос (лимит параметров SQLite)
+SUMMARY_BATCH_SIZE = 500
+
+
+async def refresh_summaries_in_batches(conn: AsyncConnection, group_ids: List[int]) -> None:
+    async with AsyncSession(bind=conn) as session:
+        for start in range(0, len(group_ids), SUMMARY_BATCH_SIZE):
+            await refresh_group_summaries(session, group_ids[start:start + SUMMARY_BATCH_SIZE])
+        await session.flush()
+
+
+async def backfill_order_group_summaries(conn: AsyncConnection) -> None:
+    """
+    Заполняет сводку групп, созданных до появления колонок; дата группы берётся из её первого заказа
+    (refresh_group_summaries заполняет пустой created_at).
+    """
+    group_ids = (await conn.scalars(select(OrderGroup.id).where(OrderGroup.created_at.is_(None)))).all()
+    if not group_ids:
+        return
+    await refresh_summaries_in_batches(conn, list(group_ids))
+    logger.info(f"Сводка пересчитана для {len(group_ids)} групп заказов")
+
+
+async def refresh_order_group_customers(conn: AsyncConnection) -> None:
+    """
+    Повторный пересчёт сводки всех групп: версия 2 брала ФИО клиента по users.id вместо telegram_id,
+    из-за чего customer_name оставался пустым или чужим
+    """
+    group_ids = (await conn.scalars(select(OrderGroup.id))).all()
+    if group_ids:
+        await refresh_summaries_in_batches(conn, list(group_ids))
+        logger.info(f"ФИО клиентов пересчитаны для {len(group_ids)} групп заказов")
+
+
+async def migrate_order_group_summaries(conn: AsyncConnection) -> None:
+    await add_missing_columns(conn, OrderGroup.__tablename__, ORDER_GROUP_SUMMARY_COLUMNS)
+    await create_missing_indexes(conn, OrderGroup.__table__)
+    await backfill_order_group_summaries(conn)
+
+
+async def migrate_model_indexes(conn: AsyncConnection) -> None:
+    """Индексы, объявленные в моделях, для таблиц, созданных до их появления"""
+    await create_missing_indexes(conn, *Base.metadata.sorted_tables)
+
+
+# Версии схемы по порядку; каждая миграция идемпотентна и только добавляет колонки, индексы и данные
+MIGRATIONS: List[Tuple[int, str, Callable[[AsyncConnection], Awaitable[None]]]] = [
+    (1, "Состав групп заказов в order_group_orders", backfill_order_group_members),
+    (2, "Сводка групп заказов (статус, количество, сумма, клиент, дата)", migrate_order_group_summaries),
+    (3, "Индексы горячих запросов (users, orders, products, photos, subcategories, settings)", migrate_model_indexes),
+    (4, "Пересчёт ФИО клиентов в сводке групп заказов", refresh_order_group_customers),
+]
+
+
+async def run_migrations(conn: AsyncConnection) -> None:
+    """
+    Применяет миграции, которых ещё нет в schema_version. Выполняется при старте после create_all
+    в той же транзакции, поэтому при ошибке живой файл БД остаётся в прежнем состоянии.
+    """
+    applied = set((await conn.scalars(select(SchemaVersion.version))).all())
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        await migrate(conn)
+        await conn.execute(insert(SchemaVersion).values(version=version, description=description))
+        logger.info(f"Миграция схемы {version} применена: {description}")
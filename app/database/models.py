@@ -1,5 +1,6 @@
 from typing import Optional, List
-from sqlalchemy import Integer, String, ForeignKey, JSON, DECIMAL, TIMESTAMP, func, DateTime
+from sqlalchemy import Integer, String, ForeignKey, JSON, DECIMAL, TIMESTAMP, func, DateTime, Float, Index, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 from dotenv import load_dotenv
@@ -7,8 +8,56 @@ from datetime import datetime
 import os
 
 load_dotenv()
-engine = create_async_engine(url=os.getenv('SQLITE_URL'))
-async_session = async_sessionmaker(engine)
+
+SQLITE_URL = os.getenv('SQLITE_URL')
+# Профиль SQLite: в WAL читатели не ждут единственного писателя, а писатели ждут друг друга
+# busy_timeout миллисекунд вместо мгновенной ошибки "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+# Кэш страниц на соединение в КиБ (передаётся в PRAGMA cache_size отрицательным числом)
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_TEMP_STORE = os.getenv('SQLITE_TEMP_STORE', 'MEMORY')
+# Пул соединений aiosqlite: каждое соединение - отдельный поток, держать их много нет смысла
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '5'))
+SQLITE_MAX_OVERFLOW = int(os.getenv('SQLITE_MAX_OVERFLOW', '10'))
+SQLITE_POOL_TIMEOUT = float(os.getenv('SQLITE_POOL_TIMEOUT', '30'))
+
+
+def _engine_options(url: str) -> dict:
+    parsed = make_url(url)
+    # Для базы в памяти SQLAlchemy использует StaticPool без параметров размера
+    if parsed.get_backend_name() != 'sqlite' or parsed.database in (None, '', ':memory:'):
+        return {}
+    return {
+        'pool_size': SQLITE_POOL_SIZE,
+        'max_overflow': SQLITE_MAX_OVERFLOW,
+        'pool_timeout': SQLITE_POOL_TIMEOUT,
+    }
+
+
+engine = create_async_engine(url=SQLITE_URL, **_engine_options(SQLITE_URL))
+
+
+@event.listens_for(engine.sync_engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if engine.dialect.name != 'sqlite':
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA cache_size = {-SQLITE_CACHE_SIZE_KB}')
+        cursor.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        cursor.execute(f'PRAGMA temp_store = {SQLITE_TEMP_STORE}')
+    finally:
+        cursor.close()
+
+
+# expire_on_commit=False: объекты остаются читаемыми после commit без повторного SELECT
+async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 class Base(AsyncAttrs, DeclarativeBase):
     pass
@@ -23,7 +72,7 @@ class Subcategory(Base):
     __tablename__ = 'subcategories'
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
-    category_id: Mapped[int] = mapped_column(ForeignKey('categories.id', ondelete='CASCADE'))
+    category_id: Mapped[int] = mapped_column(ForeignKey('categories.id', ondelete='CASCADE'), index=True)
     category: Mapped["Category"] = relationship("Category", back_populates="subcategories")
     products: Mapped[List["Product"]] = relationship("Product", back_populates="subcategory", cascade="all, delete")
 
@@ -40,7 +89,7 @@ class Size(Base):
 class Product(Base):
     __tablename__ = 'products'
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    name: Mapped[str] = mapped_column(String(255), nullable=False)
+    name: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
     price: Mapped[float] = mapped_column(DECIMAL(10, 2), nullable=False)
     # Списки id цветов и размеров хранятся в JSON
     color_ids: Mapped[Optional[List[int]]] = mapped_column(JSON, nullable=True)
@@ -51,14 +100,14 @@ class Product(Base):
     features: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     usage: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     temperature_range: Mapped[Optional[str]] = mapped_column(String, nullable=True)
-    subcategory_id: Mapped[Optional[int]] = mapped_column(ForeignKey('subcategories.id', ondelete='SET NULL'), nullable=True)
+    subcategory_id: Mapped[Optional[int]] = mapped_column(ForeignKey('subcategories.id', ondelete='SET NULL'), nullable=True, index=True)
     subcategory: Mapped[Optional["Subcategory"]] = relationship("Subcategory", back_populates="products")
     photos: Mapped[List["ProductPhoto"]] = relationship("ProductPhoto", back_populates="product", cascade="all, delete")
 
 class User(Base):
     __tablename__ = 'users'
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    telegram_id: Mapped[str] = mapped_column(String(200), nullable=False)
+    telegram_id: Mapped[str] = mapped_column(String(200), nullable=False, index=True)
     full_name: Mapped[str] = mapped_column(String(255), nullable=True)
     address: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     phone_number: Mapped[str] = mapped_column(String(20), nullable=True)
@@ -67,10 +116,14 @@ class User(Base):
 
 class Order(Base):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Корзина и заказы клиента: WHERE user_id = ? AND status = ?
+        Index('ix_orders_user_status', 'user_id', 'status'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'))
     processed_by_id: Mapped[Optional[int]] = mapped_column(ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
-    order_datetime: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now())
+    order_datetime: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now(), index=True)
     status: Mapped[str] = mapped_column(String(50), nullable=False)
     delivery_method: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     user: Mapped["User"] = relationship("User", foreign_keys=[user_id], back_populates="orders")
@@ -104,22 +157,95 @@ class ProductPhoto(Base):
     __tablename__ = 'product_photos'
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     file_id: Mapped[str] = mapped_column(String, nullable=False)
-    product_id: Mapped[int] = mapped_column(ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    product_id: Mapped[int] = mapped_column(ForeignKey('products.id', ondelete='CASCADE'), nullable=False, index=True)
     product: Mapped["Product"] = relationship("Product", back_populates="photos")
 
 class OrderGroup(Base):
     __tablename__ = 'order_groups'
+    __table_args__ = (
+        Index('ix_order_groups_status', 'status', 'id'),
+        Index('ix_order_groups_manager_status', 'processed_by_id', 'status', 'created_at'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[str] = mapped_column(String(200), nullable=False)
     processed_by_id: Mapped[Optional[str]] = mapped_column(String(200), nullable=True)
-    order_ids: Mapped[List[int]] = mapped_column(JSON, nullable=False)
+    # Прежний JSON-список заказов группы: поддерживается в актуальном виде для совместимости схемы,
+    # но состав группы читается и ищется через order_group_orders
+    order_ids_json: Mapped[List[int]] = mapped_column("order_ids", JSON, nullable=False, default=list)
+    # Сводка группы, поддерживается при записи (см. order_groups.refresh_group_summaries)
+    status: Mapped[str] = mapped_column(String(50), nullable=False, default="Ожидание", server_default="Ожидание")
+    item_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    total_amount: Mapped[float] = mapped_column(DECIMAL(12, 2), nullable=False, default=0, server_default="0")
+    customer_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # Дата первого заказа группы (те же локальные часы, что и у orders.order_datetime)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    members: Mapped[List["OrderGroupOrder"]] = relationship(
+        "OrderGroupOrder", back_populates="group", cascade="all, delete-orphan",
+        order_by="OrderGroupOrder.position", lazy="selectin"
+    )
+
+    @property
+    def order_ids(self) -> List[int]:
+        return [member.order_id for member in self.members]
+
+    @order_ids.setter
+    def order_ids(self, order_ids: List[int]) -> None:
+        current = {member.order_id: member for member in self.members}
+        members = []
+        for position, order_id in enumerate(dict.fromkeys(order_ids)):
+            member = current.get(order_id) or OrderGroupOrder(order_id=order_id)
+            member.position = position
+            members.append(member)
+        self.members = members
+        self.order_ids_json = [member.order_id for member in members]
+
+class OrderGroupOrder(Base):
+    # Состав группы заказов; position 0 - первый заказ, по которому определяется статус группы
+    __tablename__ = 'order_group_orders'
+    __table_args__ = (
+        Index('ix_order_group_orders_group_position', 'order_group_id', 'position'),
+    )
+    order_group_id: Mapped[int] = mapped_column(ForeignKey('order_groups.id', ondelete='CASCADE'), primary_key=True)
+    order_id: Mapped[int] = mapped_column(ForeignKey('orders.id', ondelete='CASCADE'), primary_key=True, index=True)
+    position: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    group: Mapped["OrderGroup"] = relationship("OrderGroup", back_populates="members")
+
+class ProductCooccurrence(Base):
+    # Сколько выполненных групп заказов содержали оба товара (хранится в обе стороны)
+    __tablename__ = 'product_cooccurrence'
+    product_id: Mapped[int] = mapped_column(ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    other_product_id: Mapped[int] = mapped_column(ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+class RelatedProduct(Base):
+    # Предрасчитанные соседи товара для рекомендаций, rank 1 - самый подходящий
+    __tablename__ = 'related_products'
+    product_id: Mapped[int] = mapped_column(ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    rank: Mapped[int] = mapped_column(Integer, primary_key=True)
+    related_product_id: Mapped[int] = mapped_column(ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    score: Mapped[float] = mapped_column(Float, nullable=False)
+
+class RecommenderProcessedGroup(Base):
+    # Группы заказов, уже учтённые в product_cooccurrence
+    __tablename__ = 'recommender_processed_groups'
+    order_group_id: Mapped[int] = mapped_column(ForeignKey('order_groups.id', ondelete='CASCADE'), primary_key=True)
 
 class Setting(Base):
     __tablename__ = 'settings'
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    key: Mapped[str] = mapped_column(String(400), nullable=False)
+    key: Mapped[str] = mapped_column(String(400), nullable=False, index=True)
     value: Mapped[str] = mapped_column(String(400), nullable=False)
 
+class SchemaVersion(Base):
+    # Применённые миграции схемы (см. app/database/migrations.py)
+    __tablename__ = 'schema_version'
+    version: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    description: Mapped[str] = mapped_column(String(255), nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
 async def async_main():
+    from app.database.migrations import run_migrations
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
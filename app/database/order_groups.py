@@ -0,0 +1,56 @@
+from typing import Iterable
+
+from sqlalchemy import select, func, cast, String
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.models import Order, OrderItem, OrderGroup, OrderGroupOrder, Product, User
+
+# Статус группы, из которой удалены все заказы
+EMPTY_GROUP_STATUS = "Удален"
+
+
+async def refresh_group_summaries(session: AsyncSession, group_ids: Iterable[int]) -> None:
+    """
+    Пересчитывает денормализованные поля групп (статус, количество товаров, сумма, ФИО клиента,
+    дата первого заказа для новых групп) в текущей транзакции сессии. Вызывается после каждого изменения состава или статуса заказов.
+    """
+    group_ids = set(group_ids)
+    if not group_ids:
+        return
+    await session.flush()
+
+    totals = {
+        group_id: (item_count, total_amount)
+        for group_id, item_count, total_amount in await session.execute(
+            select(
+                OrderGroupOrder.order_group_id,
+                func.coalesce(func.sum(OrderItem.quantity), 0),
+                func.coalesce(func.sum(OrderItem.quantity * Product.price), 0),
+            )
+            .join(OrderItem, OrderItem.order_id == OrderGroupOrder.order_id)
+            .join(Product, Product.id == OrderItem.product_id)
+            .where(OrderGroupOrder.order_group_id.in_(group_ids))
+            .group_by(OrderGroupOrder.order_group_id)
+        )
+    }
+    # Статус, клиент и дата группы - по её первому заказу; orders.user_id хранит telegram_id клиента
+    first_orders = {
+        group_id: (status, full_name, order_datetime)
+        for group_id, status, full_name, order_datetime in await session.execute(
+            select(OrderGroupOrder.order_group_id, Order.status, User.full_name, Order.order_datetime)
+            .join(Order, Order.id == OrderGroupOrder.order_id)
+            .outerjoin(User, User.telegram_id == cast(Order.user_id, String))
+            .where(OrderGroupOrder.order_group_id.in_(group_ids), OrderGroupOrder.position == 0)
+        )
+    }
+
+    groups = await session.scalars(select(OrderGroup).where(OrderGroup.id.in_(group_ids)))
+    for group in groups:
+        group.item_count, group.total_amount = totals.get(group.id, (0, 0))
+        first = first_orders.get(group.id)
+        if first is None:
+            group.status = EMPTY_GROUP_STATUS
+            continue
+        group.status, group.customer_name, order_datetime = first
+        if group.created_at is None:
+            group.created_at = order_datetime
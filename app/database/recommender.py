@@ -0,0 +1,212 @@
+import os
+import math
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from itertools import permutations
+from typing import Dict, Iterable, List, Set
+
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, update
+
+from app.database.models import async_session, Order, OrderItem, OrderGroupOrder, ProductCooccurrence, \
+    RelatedProduct, RecommenderProcessedGroup
+from app.database.catalog import CatalogProduct, CatalogSnapshot, get_catalog
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Сколько соседей хранить на товар и как смешивать совместные покупки с близостью по каталогу
+RELATED_TOP_N = int(os.getenv("AI_RELATED_TOP_N", "5"))
+RELATED_COOCCURRENCE_WEIGHT = float(os.getenv("AI_RELATED_COOCCURRENCE_WEIGHT", "0.7"))
+RELATED_AFFINITY_WEIGHT = float(os.getenv("AI_RELATED_AFFINITY_WEIGHT", "0.3"))
+# Полный пересчёт (подхватывает новые товары и правки каталога), секунды
+RELATED_REFRESH_INTERVAL = float(os.getenv("AI_RELATED_REFRESH_INTERVAL", "21600"))
+
+COMPLETED_STATUS = "Выполнено"
+
+_refresh_lock = asyncio.Lock()
+
+
+async def _completed_baskets(session, group_ids=None) -> Dict[int, Set[int]]:
+    """
+    Наборы товаров групп, все заказы которых выполнены: {id группы: {id товаров}}.
+    group_ids - подзапрос с id групп; без него берутся все группы. Состав читается join'ом
+    через order_group_orders, а не списком id заказов.
+    """
+    query = (
+        select(OrderGroupOrder.order_group_id, Order.status, OrderItem.product_id)
+        .join(Order, Order.id == OrderGroupOrder.order_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+    )
+    if group_ids is not None:
+        query = query.where(OrderGroupOrder.order_group_id.in_(group_ids))
+
+    baskets: Dict[int, Set[int]] = defaultdict(set)
+    incomplete = set()
+    for group_id, status, product_id in await session.execute(query):
+        if status != COMPLETED_STATUS:
+            incomplete.add(group_id)
+        elif product_id is not None:
+            baskets[group_id].add(product_id)
+    return {group_id: products for group_id, products in baskets.items() if group_id not in incomplete}
+
+
+def _pair_counts(baskets: Iterable[Set[int]]) -> Counter:
+    counts = Counter()
+    for products in baskets:
+        for pair in permutations(products, 2):
+            counts[pair] += 1
+    return counts
+
+
+def _affinity(product: CatalogProduct, other: CatalogProduct) -> float:
+    """Близость по каталогу: дополняющие товары той же категории ценнее однотипных"""
+    if product.category_id is None or product.category_id != other.category_id:
+        return 0.0
+    if product.subcategory_id != other.subcategory_id:
+        return 1.0
+    if product.product_type and product.product_type == other.product_type:
+        return 0.25
+    return 0.5
+
+
+def rank_neighbours(product: CatalogProduct, catalog: CatalogSnapshot, counts: Dict[int, int],
+                    limit: int = RELATED_TOP_N) -> List[tuple]:
+    """Соседи товара: [(id соседа, оценка)] по убыванию оценки"""
+    max_count = max(counts.values(), default=0)
+    scored = []
+    for other in catalog.products:
+        if other.id == product.id:
+            continue
+        cooccurrence = math.log1p(counts.get(other.id, 0)) / math.log1p(max_count) if max_count else 0.0
+        score = RELATED_COOCCURRENCE_WEIGHT * cooccurrence + RELATED_AFFINITY_WEIGHT * _affinity(product, other)
+        if score > 0:
+            scored.append((other.id, score))
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return scored[:limit]
+
+
+def _neighbours_by_product(catalog: CatalogSnapshot, product_ids: Iterable[int],
+                           counts: Dict[int, Dict[int, int]]) -> Dict[int, List[tuple]]:
+    return {pid: rank_neighbours(catalog.get(pid), catalog, counts.get(pid, {})) for pid in product_ids}
+
+
+def _related_rows(neighbours: Dict[int, List[tuple]]) -> List[RelatedProduct]:
+    return [
+        RelatedProduct(product_id=product_id, rank=rank, related_product_id=other_id, score=score)
+        for product_id, ranked in neighbours.items()
+        for rank, (other_id, score) in enumerate(ranked, start=1)
+    ]
+
+
+async def rebuild_related_products() -> None:
+    """Полный пересчёт: совместные покупки по всем выполненным группам и соседи всех товаров"""
+    async with _refresh_lock:
+        catalog = await get_catalog()
+        async with async_session() as session:
+            baskets = await _completed_baskets(session)
+
+        # Подсчёт - чистые вычисления по всему каталогу: выносим их из цикла событий
+        # и выполняем до записи, чтобы не держать транзакцию на время расчёта
+        counts = await asyncio.to_thread(_pair_counts, baskets.values())
+        counts_by_product: Dict[int, Dict[int, int]] = defaultdict(dict)
+        for (product_id, other_id), count in counts.items():
+            counts_by_product[product_id][other_id] = count
+        neighbours = await asyncio.to_thread(
+            _neighbours_by_product, catalog, [product.id for product in catalog.products], counts_by_product
+        )
+
+        async with async_session() as session:
+            await session.execute(delete(ProductCooccurrence))
+            await session.execute(delete(RecommenderProcessedGroup))
+            await session.execute(delete(RelatedProduct))
+            session.add_all([
+                ProductCooccurrence(product_id=product_id, other_product_id=other_id, count=count)
+                for (product_id, other_id), count in counts.items()
+            ])
+            session.add_all([RecommenderProcessedGroup(order_group_id=group_id) for group_id in baskets])
+            session.add_all(_related_rows(neighbours))
+            await session.commit()
+        logger.info(f"Рекомендации пересчитаны: {len(baskets)} групп заказов, {len(counts) // 2} пар товаров")
+
+
+async def record_completed_orders(order_ids: List[int]) -> None:
+    """
+    Инкрементальное обновление после выполнения заказов: учитывает новые завершённые группы,
+    содержащие эти заказы, и пересчитывает соседей только у затронутых товаров.
+    """
+    order_ids = set(order_ids)
+    async with _refresh_lock:
+        catalog = await get_catalog()
+        async with async_session() as session:
+            baskets = await _completed_baskets(
+                session,
+                select(OrderGroupOrder.order_group_id)
+                .where(OrderGroupOrder.order_id.in_(order_ids))
+                .where(OrderGroupOrder.order_group_id.not_in(select(RecommenderProcessedGroup.order_group_id)))
+            )
+            if not baskets:
+                return
+            counts = _pair_counts(baskets.values())
+            affected = {product_id for product_id, _ in counts}
+            stored = (await session.execute(
+                select(ProductCooccurrence.product_id, ProductCooccurrence.other_product_id, ProductCooccurrence.count)
+                .where(ProductCooccurrence.product_id.in_(affected))
+            )).all()
+
+        # Прежние счётчики плюс новые группы; запись ниже не пересекается с другим пересчётом
+        # благодаря _refresh_lock
+        stored_pairs = {(product_id, other_id) for product_id, other_id, _ in stored}
+        counts_by_product: Dict[int, Dict[int, int]] = defaultdict(dict)
+        for product_id, other_id, count in stored:
+            counts_by_product[product_id][other_id] = count
+        for (product_id, other_id), count in counts.items():
+            counts_by_product[product_id][other_id] = counts_by_product[product_id].get(other_id, 0) + count
+        affected = [pid for pid in affected if catalog.get(pid)]
+        neighbours = await asyncio.to_thread(_neighbours_by_product, catalog, affected, counts_by_product)
+
+        async with async_session() as session:
+            for (product_id, other_id), count in counts.items():
+                if (product_id, other_id) in stored_pairs:
+                    await session.execute(
+                        update(ProductCooccurrence)
+                        .where(ProductCooccurrence.product_id == product_id,
+                               ProductCooccurrence.other_product_id == other_id)
+                        .values(count=ProductCooccurrence.count + count)
+                    )
+                else:
+                    session.add(ProductCooccurrence(product_id=product_id, other_product_id=other_id, count=count))
+            session.add_all([RecommenderProcessedGroup(order_group_id=group_id) for group_id in baskets])
+            if affected:
+                await session.execute(delete(RelatedProduct).where(RelatedProduct.product_id.in_(affected)))
+                session.add_all(_related_rows(neighbours))
+            await session.commit()
+
+
+async def get_related(product_id: int, limit: int = 3) -> List[CatalogProduct]:
+    """Соседи товара из таблицы related_products; для новых товаров - по близости в каталоге"""
+    catalog = await get_catalog()
+    async with async_session() as session:
+        related_ids = (await session.scalars(
+            select(RelatedProduct.related_product_id)
+            .where(RelatedProduct.product_id == product_id)
+            .order_by(RelatedProduct.rank)
+            .limit(limit)
+        )).all()
+
+    related = [catalog.get(related_id) for related_id in related_ids if catalog.get(related_id)]
+    if not related and catalog.get(product_id):
+        related = [catalog.get(other_id) for other_id, _ in rank_neighbours(catalog.get(product_id), catalog, {}, limit)]
+    return related[:limit]
+
+
+async def run_recommender_job(interval: float = RELATED_REFRESH_INTERVAL) -> None:
+    """Фоновая задача: полный пересчёт рекомендаций при старте и затем раз в interval секунд"""
+    while True:
+        try:
+            await rebuild_related_products()
+        except Exception as e:
+            logger.error(f"Ошибка при пересчёте рекомендаций: {e}")
+        await asyncio.sleep(interval)
@@ -2,8 +2,11 @@ from typing import Optional, List, Dict, Tuple
 from sqlalchemy.orm import selectinload
 from sqlalchemy import or_, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database.models import async_session, BroadcastHistory, ProductPhoto, OrderGroup, Setting
+from app.database.models import async_session, BroadcastHistory, ProductPhoto, OrderGroup, OrderGroupOrder, Setting
 from app.database.models import Color, Category, User, Product, Subcategory, Size, Order, OrderItem
+from app.database.catalog import invalidate_catalog
+from app.database.recommender import record_completed_orders
+from app.database.order_groups import refresh_group_summaries
 from app.users.user import userKeyboards as kb
 from sqlalchemy.exc import SQLAlchemyError
 from bot_instance import bot
@@ -267,6 +270,7 @@ async def update_category_name(category_id: int, new_name: str) -> bool:
                 update(Category).where(Category.id == category_id).values(name=new_name)
             )
             await session.commit()
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при обновлении названия категории: {e}")
@@ -280,6 +284,7 @@ async def add_category(name: str) -> bool:
             new_category = Category(name=name)
             session.add(new_category)
             await session.commit()
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при добавлении категории: {e}")
@@ -292,6 +297,7 @@ async def delete_category(category_id: int) -> bool:
         try:
             await session.execute(delete(Category).where(Category.id == category_id))
             await session.commit()
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при удалении категории: {e}")
@@ -347,6 +353,7 @@ async def update_subcategory(subcategory_id: int, new_name: str, parent_category
                 update(Subcategory).where(Subcategory.id == subcategory_id).values(**values)
             )
             await session.commit()
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при обновлении подкатегории: {e}")
@@ -360,6 +367,7 @@ async def add_subcategory(name: str, parent_category_id: int) -> bool:
             new_subcat = Subcategory(name=name, category_id=parent_category_id)
             session.add(new_subcat)
             await session.commit()
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при добавлении подкатегории: {e}")
@@ -372,6 +380,7 @@ async def delete_subcategory(subcategory_id: int) -> bool:
         try:
             await session.execute(delete(Subcategory).where(Subcategory.id == subcategory_id))
             await session.commit()
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при удалении подкатегории: {e}")
@@ -466,6 +475,7 @@ async def update_product(product_id: int, product_data: dict) -> bool:
                 sync_session.commit()
 
             await session.run_sync(_update)
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при обновлении продукта {product_id}: {e}")
@@ -484,6 +494,7 @@ async def add_product(product_data: dict) -> Optional[int]:
                 return new_product.id
 
             new_product_id = await session.run_sync(_add_product)
+            invalidate_catalog()
             return new_product_id
         except Exception as e:
             print(f"Ошибка при добавлении продукта: {e}")
@@ -517,6 +528,7 @@ async def delete_product(product_id: int) -> bool:
                 sync_session.commit()
 
             await session.run_sync(_delete)
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при удалении продукта {product_id}: {e}")
@@ -535,6 +547,7 @@ async def update_product_photos(product_id: int, file_ids: List[str]) -> bool:
                 new_photo = ProductPhoto(file_id=file_id, product_id=product_id)
                 session.add(new_photo)
             await session.commit()
+            invalidate_catalog()
             return True
         except Exception as e:
             print(f"Ошибка при обновлении фотографий для продукта {product_id}: {e}")
@@ -1104,6 +1117,8 @@ async def submit_all_orders(user_id: str) -> bool:
                 order_ids=order_ids
             )
             session.add(new_group)
+            await session.flush()
+            await refresh_group_summaries(session, [new_group.id])
 
             await session.commit()
             return True
@@ -1251,31 +1266,37 @@ async def update_support_details_field(user_id: int, field: str, value: str) ->
 
 
 
+def _groups_containing(order_ids: List[int]):
+    # Поиск групп по заказам идёт по индексу order_group_orders.order_id
+    return OrderGroup.id.in_(
+        select(OrderGroupOrder.order_group_id).where(OrderGroupOrder.order_id.in_(order_ids))
+    )
+
+# Фильтры истории заказов менеджера
+MANAGER_STATUS_FILTERS = {"accepted": "Выполнено", "cancelled": "Отменен"}
+
+
+async def _count_order_groups(*conditions) -> int:
+    async with async_session() as session:
+        total = await session.scalar(
+            select(func.count(OrderGroup.id)).where(*conditions)
+        )
+        return total or 0
+
+
 async def get_new_order_groups(page: int, per_page: int) -> List[OrderGroup]:
     async with async_session() as session:
-        result = await session.scalars(select(OrderGroup).order_by(OrderGroup.id.asc()))
-        groups = result.all()
-        new_groups = []
-        for group in groups:
-            if group.order_ids:
-                order = await get_order_by_id(group.order_ids[0])
-                if order and order.status == "Ожидание":
-                    new_groups.append(group)
-        start = (page - 1) * per_page
-        end = start + per_page
-        return new_groups[start:end]
+        result = await session.scalars(
+            select(OrderGroup)
+            .where(OrderGroup.status == "Ожидание")
+            .order_by(OrderGroup.id.asc())
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+        )
+        return result.all()
 
 async def get_total_new_order_groups() -> int:
-    async with async_session() as session:
-        result = await session.scalars(select(OrderGroup))
-        groups = result.all()
-        count = 0
-        for group in groups:
-            if group.order_ids:
-                order = await get_order_by_id(group.order_ids[0])
-                if order and order.status == "Ожидание":
-                    count += 1
-        return count
+    return await _count_order_groups(OrderGroup.status == "Ожидание")
 
 
 async def get_user_by_telegram_id(telegram_id: str) -> Optional[User]:
@@ -1291,32 +1312,30 @@ async def update_order_status(order_ids: List[int], new_status: str, manager_id:
             stmt = update(Order).where(Order.id.in_(order_ids)).values(status=new_status, processed_by_id=manager_id)
             await session.execute(stmt)
 
-            # Загружаем все группы заказов
-            result = await session.execute(select(OrderGroup))
+            # Загружаем только группы, содержащие эти заказы
+            result = await session.execute(select(OrderGroup).where(_groups_containing(order_ids)))
             groups = result.scalars().all()
 
             for group in groups:
-                # Преобразуем order_ids из JSON (если хранится как TEXT/JSON)
-                group_order_ids = json.loads(group.order_ids) if isinstance(group.order_ids, str) else group.order_ids
-
-                # Проверяем, есть ли пересечение с order_ids
-                if any(order_id in group_order_ids for order_id in order_ids):
-                    group.processed_by_id = manager_id  # Записываем id менеджера
-
-            if new_status == "Удален":
-                for group in groups:
-                    group_order_ids = json.loads(group.order_ids) if isinstance(group.order_ids, str) else group.order_ids
-                    updated_ids = [oid for oid in group_order_ids if oid not in order_ids]
-                    if updated_ids != group_order_ids:
-                        group.order_ids = json.dumps(updated_ids)  # Сохраняем обратно как JSON-строку
+                group.processed_by_id = manager_id  # Записываем id менеджера
+                if new_status == "Удален":
+                    group.order_ids = [oid for oid in group.order_ids if oid not in order_ids]
+            await refresh_group_summaries(session, [group.id for group in groups])
 
             await session.commit()
-            return True
         except SQLAlchemyError as e:
             print(f"Error updating order status: {e}")
             await session.rollback()
             return False
 
+    if new_status == "Выполнено":
+        # Выполненная группа заказов пополняет статистику совместных покупок
+        try:
+            await record_completed_orders(order_ids)
+        except Exception as e:
+            print(f"Error updating related products: {e}")
+    return True
+
 
 
 async def delete_product_from_order_group(order_item_id: int) -> bool:
@@ -1336,22 +1355,22 @@ async def delete_product_from_order_group(order_item_id: int) -> bool:
             await session.delete(order_item)
             await session.flush()
 
+            # Находим OrderGroup, в котором содержится этот заказ
+            result = await session.execute(select(OrderGroup).where(_groups_containing([order.id])))
+            order_group = result.scalars().first()
+
             # Проверяем, остались ли товары в заказе
             remaining = await session.scalar(
                 select(func.count(OrderItem.id)).where(OrderItem.order_id == order.id)
             )
-            if remaining == 0:
-                # Находим OrderGroup, в котором содержится этот заказ (предполагаем, что order_ids – список id заказов)
-                result = await session.execute(
-                    select(OrderGroup).where(OrderGroup.order_ids.contains([order.id]))
-                )
-                order_group = result.scalar_one_or_none()
-                if order_group:
-                    new_order_ids = [oid for oid in order_group.order_ids if oid != order.id]
-                    order_group.order_ids = new_order_ids
-                    # Обновляем статус заказа на "Удален"
-                    stmt = update(Order).where(Order.id == order.id).values(status="Удален")
-                    await session.execute(stmt)
+            if remaining == 0 and order_group:
+                new_order_ids = [oid for oid in order_group.order_ids if oid != order.id]
+                order_group.order_ids = new_order_ids
+                # Обновляем статус заказа на "Удален"
+                stmt = update(Order).where(Order.id == order.id).values(status="Удален")
+                await session.execute(stmt)
+            if order_group:
+                await refresh_group_summaries(session, [order_group.id])
             await session.commit()
             return True
         except SQLAlchemyError as e:
@@ -1368,29 +1387,11 @@ async def get_manager_info(telegram_id: str) -> Optional[User]:
 
 # Функция для получения количества принятых заказов (статус "Выполнено")
 async def get_accepted_order_groups() -> int:
-    count = 0
-    async with async_session() as session:
-        result = await session.scalars(select(OrderGroup))
-        groups = result.all()
-        for group in groups:
-            if group.order_ids:
-                order = await get_order_by_id(group.order_ids[0])
-                if order and order.status == "Выполнено":
-                    count += 1
-        return count
+    return await _count_order_groups(OrderGroup.status == "Выполнено")
 
 # Функция для получения количества отмененных заказов (статус "Отменен")
 async def get_cancelled_order_groups() -> int:
-    count = 0
-    async with async_session() as session:
-        result = await session.scalars(select(OrderGroup))
-        groups = result.all()
-        for group in groups:
-            if group.order_ids:
-                order = await get_order_by_id(group.order_ids[0])
-                if order and order.status == "Отменен":
-                    count += 1
-        return count
+    return await _count_order_groups(OrderGroup.status == "Отменен")
 
 
 # Получение внутреннего id менеджера по его telegram_id
@@ -1403,50 +1404,26 @@ async def get_manager_internal_id(telegram_id: str) -> Optional[int]:
 
 async def get_manager_order_groups(manager_id: str, status_filter: str, sort_order: str, page: int, per_page: int) -> \
 List[Tuple[OrderGroup, str, any]]:
+    status = MANAGER_STATUS_FILTERS.get(status_filter)
+    if status is None:
+        return []
+    created_at = OrderGroup.created_at.desc() if sort_order == "desc" else OrderGroup.created_at.asc()
     async with async_session() as session:
-        result = await session.scalars(select(OrderGroup).where(OrderGroup.processed_by_id == manager_id))
-        groups = result.all()
-        filtered = []
-        for group in groups:
-            if group.order_ids:
-                first_order = await get_order_by_id(group.order_ids[0])
-                if first_order:
-                    # Для принятых заказов ожидаем статус "Выполнено"
-                    if status_filter == "accepted" and first_order.status == "Выполнено":
-                        user_info = await get_user_info_by_id(str(first_order.user_id))
-                        fullname = user_info.get("full_name", "N/A")
-                        filtered.append((group, fullname, first_order.order_datetime))
-                    # Для отменённых заказов ожидаем статус "Отменен"
-                    elif status_filter == "cancelled" and first_order.status == "Отменен":
-                        user_info = await get_user_info_by_id(str(first_order.user_id))
-                        fullname = user_info.get("full_name", "N/A")
-                        filtered.append((group, fullname, first_order.order_datetime))
-        reverse = (sort_order == "desc")
-        filtered.sort(key=lambda x: x[2], reverse=reverse)
-        start = (page - 1) * per_page
-        end = start + per_page
-        return filtered[start:end]
+        result = await session.scalars(
+            select(OrderGroup)
+            .where(OrderGroup.processed_by_id == manager_id, OrderGroup.status == status)
+            .order_by(created_at, OrderGroup.id)
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+        )
+        return [(group, group.customer_name or "N/A", group.created_at) for group in result.all()]
 
 
 async def get_total_manager_order_groups(manager_id: str, status_filter: str) -> int:
-    internal_id = await get_manager_internal_id(manager_id)
-    if internal_id is None:
+    status = MANAGER_STATUS_FILTERS.get(status_filter)
+    if status is None:
         return 0
-    manager_id_str = str(internal_id)
-
-    async with async_session() as session:
-        result = await session.scalars(select(OrderGroup).where(OrderGroup.processed_by_id == manager_id_str))
-        groups = result.all()
-        count = 0
-        for group in groups:
-            if group.order_ids:
-                first_order = await get_order_by_id(group.order_ids[0])
-                if first_order:
-                    if status_filter == "accepted" and first_order.status == "Выполнено":
-                        count += 1
-                    elif status_filter == "cancelled" and first_order.status == "Отменен":
-                        count += 1
-        return count
+    return await _count_order_groups(OrderGroup.processed_by_id == manager_id, OrderGroup.status == status)
 
 async def get_user_by_telegram_id_manager(telegram_id: str) -> Optional[User]:
     async with async_session() as session:
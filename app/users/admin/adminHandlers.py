@@ -14,6 +14,7 @@ from app.users.admin import adminKeyboards as kb
 from app.users.admin import adminStates as st
 from app import utils
 from app.database import requests as rq
+from app.ai_module.llm_client import init_llm_client
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InputFile
 from app.utils import sent_message_add_screen_ids, router
@@ -694,6 +695,7 @@ async def change_openai_api(message: Message, state: FSMContext):
     result = await rq.save_setting(key="OPENAI_API", value=message.text)
 
     if result:
+        await init_llm_client(message.text)  # Пересоздаём клиент OpenAI с новым ключом
         sent_message = await message.answer_photo(
             photo=utils.adminka_png,
             caption="OPENAI API успешно обновлен/добавлен!",
@@ -1126,14 +1126,11 @@ async def user_my_orders(callback_query: CallbackQuery, state: FSMContext):
         text = "У вас еще нет оформленных заказов."
     else:
         lines = []
-        # Для каждой группы берём первый заказ для отображения даты и статуса
+        # Дата и статус хранятся в самой группе
         for idx, group in enumerate(order_groups, start=1):
-            if group.order_ids:
-                order = await rq.get_order_by_id(group.order_ids[0])
-                if order:
-                    order_date = order.order_datetime.strftime("%Y.%m.%d")
-                    status = order.status
-                    lines.append(f"Заказ {idx} : {order_date} : {status}")
+            if group.order_ids and group.created_at:
+                order_date = group.created_at.strftime("%Y.%m.%d")
+                lines.append(f"Заказ {idx} : {order_date} : {group.status}")
         orders_info = "\n".join(lines)
         text = f"{orders_info}\n\nМожете посмотреть детально, выберете номер заказа."
     keyboard = kb.get_my_orders_keyboard(order_groups)
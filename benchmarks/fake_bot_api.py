@@ -0,0 +1,55 @@
+import time
+from collections import Counter
+from typing import Dict
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    """
+    Локальная замена Telegram Bot API: принимает любые методы /bot<token>/<method>,
+    отвечает правдоподобными объектами и считает вызовы по методам.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self._message_ids = 0
+
+    def _message(self, params: Dict) -> Dict:
+        self._message_ids += 1
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": int(params.get("message_id") or self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if params.get("text"):
+            message["text"] = params["text"]
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+
+        lowered = method.lower()
+        if lowered == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Bigser", "username": "bigser_bench_bot"}
+        elif lowered == "sendmediagroup":
+            result = [self._message(params)]
+        elif lowered.startswith("send") and lowered not in ("sendchataction",):
+            result = self._message(params)
+        elif lowered.startswith("edit") and params.get("chat_id"):
+            result = self._message(params)
+        else:
+            # answerCallbackQuery, deleteMessage, sendChatAction, inline edit и т.п.
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
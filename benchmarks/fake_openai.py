@@ -0,0 +1,160 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+# Грубая оценка токенов, как у провайдера для русского текста
+_CHARS_PER_TOKEN = 4
+# Провайдер кэширует префиксы от 1024 токенов блоками по 128
+_CACHE_MIN_TOKENS = 1024
+_CACHE_BLOCK = 128
+
+_SHORT_ID_RE = re.compile(r"^(p\d+)\|", re.MULTILINE)
+
+
+def _tokens(value) -> int:
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    return max(1, len(text) // _CHARS_PER_TOKEN)
+
+
+class FakeOpenAI:
+    """
+    Локальная замена OpenAI Chat Completions (/v1/chat/completions, обычный и потоковый режим).
+    Ответы диалога берутся из сценария по тексту сообщения клиента, подбор товаров возвращает
+    первых кандидатов из промпта, остальные вызовы - короткий текст. Задержка ответа и скорость
+    генерации задаются параметрами, usage считается по размеру запроса с учётом кэша префиксов.
+    """
+
+    def __init__(self, latency: float = 0.4, jitter: float = 0.1, tokens_per_second: float = 80.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.scripts: Dict[str, List[Dict]] = {}
+        self.requests = 0
+        self._seen_prefixes = set()
+        self._random = random.Random(seed)
+        self._call_ids = 0
+
+    def script(self, user_text: str, responses: List[Dict]) -> None:
+        """Ответы модели на ход с этим текстом клиента: [{"tool": ..., "arguments": {...}} | {"text": ...}]"""
+        self.scripts[user_text.strip().lower()] = responses
+
+    # --- выбор ответа ---------------------------------------------------------------------
+
+    def _reply(self, body: Dict) -> Dict:
+        messages = body.get("messages", [])
+        last = messages[-1] if messages else {}
+
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            ids = _SHORT_ID_RE.findall(last.get("content") or "")[:3]
+            return {"content": json.dumps(
+                {"items": [{"id": short_id, "reason": "Подходит по запросу"} for short_id in ids]}
+                if ids else {"НЕТ_ПОДХОДЯЩИХ": True, "alternative_suggestions": []},
+                ensure_ascii=False
+            )}
+
+        user_text = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        scripted = self.scripts.get(user_text.strip().lower()) or []
+
+        if last.get("role") == "user" and body.get("tools"):
+            if scripted and "tool" in scripted[0]:
+                self._call_ids += 1
+                return {"tool_calls": [{
+                    "id": f"call_{self._call_ids}",
+                    "type": "function",
+                    "function": {"name": scripted[0]["tool"],
+                                 "arguments": json.dumps(scripted[0].get("arguments", {}), ensure_ascii=False)}
+                }]}
+            if scripted:
+                return {"content": scripted[0]["text"]}
+            return {"content": "Здравствуйте! Подскажите, что вы ищете? Помогу подобрать спортивную одежду."}
+
+        if last.get("role") == "tool":
+            # Второй ответ хода - текст после вызова инструмента, если он есть в сценарии
+            follow_up = next((r["text"] for r in scripted[1:] if "text" in r), None)
+            return {"content": follow_up or "Вот подробности по товару. Какой размер и цвет вам подходят?"}
+        return {"content": "Секунду, уточняю для вас детали."}
+
+    def _usage(self, body: Dict, completion_tokens: int) -> Dict:
+        # Кэшируется самый длинный уже встречавшийся префикс запроса: инструменты, затем сообщения
+        # по порядку. Префиксы запоминаются на границах сообщений.
+        parts = ([body["tools"]] if body.get("tools") else []) + list(body.get("messages") or [])
+        digest = hashlib.sha1()
+        prompt_tokens = cached = 0
+        for part in parts:
+            digest.update(json.dumps(part, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+            prompt_tokens += _tokens(part)
+            prefix = digest.copy().hexdigest()
+            if prefix in self._seen_prefixes and prompt_tokens >= _CACHE_MIN_TOKENS:
+                cached = prompt_tokens // _CACHE_BLOCK * _CACHE_BLOCK
+            self._seen_prefixes.add(prefix)
+        prompt_tokens = max(1, prompt_tokens)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    # --- HTTP -----------------------------------------------------------------------------
+
+    async def _delay(self) -> None:
+        await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        reply = self._reply(body)
+        completion_tokens = _tokens(reply.get("content") or reply.get("tool_calls") or "")
+        usage = self._usage(body, completion_tokens)
+        base = {"id": f"chatcmpl-{self.requests}", "created": int(time.time()), "model": body.get("model", "")}
+
+        await self._delay()
+        if not body.get("stream"):
+            if self.tokens_per_second:
+                await asyncio.sleep(completion_tokens / self.tokens_per_second)
+            return web.json_response({
+                **base,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply.get("content"),
+                                "tool_calls": reply.get("tool_calls")},
+                    "finish_reason": "tool_calls" if reply.get("tool_calls") else "stop",
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(choices: List[Dict], chunk_usage: Optional[Dict] = None) -> None:
+            chunk = {**base, "object": "chat.completion.chunk", "choices": choices, "usage": chunk_usage}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        if reply.get("tool_calls"):
+            deltas = [{"role": "assistant", "tool_calls": [dict(call, index=index)]}
+                      for index, call in enumerate(reply["tool_calls"])]
+        else:
+            words = re.findall(r"\S+\s*", reply["content"])
+            deltas = [{"role": "assistant", "content": word} for word in words]
+        pause = completion_tokens / self.tokens_per_second / max(1, len(deltas)) if self.tokens_per_second else 0
+        for delta in deltas:
+            await send([{"index": 0, "delta": delta, "finish_reason": None}])
+            await asyncio.sleep(pause)
+        await send([{"index": 0, "delta": {}, "finish_reason": "tool_calls" if reply.get("tool_calls") else "stop"}])
+        await send([], usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        return app
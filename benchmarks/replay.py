@@ -0,0 +1,334 @@
+"""
+Прогон записанных диалогов через консультанта без Telegram и OpenAI.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.replay --products 500 --users 20 --concurrency 10 --llm-latency 0.4
+    python -m benchmarks.replay --json bench.json                 # сохранить результат
+    python -m benchmarks.replay --baseline bench.json             # сравнить с прошлым прогоном
+
+Поднимаются локальные заглушки OpenAI (benchmarks/fake_openai.py) и Bot API
+(benchmarks/fake_bot_api.py), во временной папке создаётся SQLite с каталогом заданного размера.
+Каждый диалог из --conversations проигрывается --users раз от разных покупателей через
+process_message / process_callback; ход считается завершённым, когда очередь покупателя опустела.
+Для каждого хода считаются задержка, SQL-запросы, вызовы модели, токены и вызовы Bot API.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from benchmarks.fake_openai import FakeOpenAI
+from benchmarks.fake_bot_api import FakeBotAPI
+
+DEFAULT_CONVERSATIONS = os.path.join(os.path.dirname(__file__), "conversations.json")
+BENCH_TOKEN = "123456:BENCHbenchBENCHbenchBENCHbenchBEN"
+FIRST_USER_ID = 700000
+MIN_LATENCY_DELTA_MS = 50.0
+
+_PLACEHOLDER_RE = re.compile(r"\{(shown|color|size|product:\d+)\}")
+
+
+@dataclass
+class TurnMetrics:
+    conversation: str
+    label: str
+    latency: float = 0.0
+    db_queries: int = 0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    bot_calls: int = 0
+
+
+# Метрики текущего хода; задачи очереди покупателя наследуют контекст в момент submit
+_current_turn: ContextVar[Optional[TurnMetrics]] = ContextVar("bench_turn", default=None)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _start_site(app: web.Application) -> tuple:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def _instrument() -> None:
+    """Подписки на SQL-запросы, вызовы модели и вызовы Bot API текущего хода"""
+    from sqlalchemy import event
+    from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+    from app.database.models import engine
+    from app.ai_module.llm_client import add_usage_listener
+    from bot_instance import bot
+
+    def on_query(*_):
+        metrics = _current_turn.get()
+        if metrics:
+            metrics.db_queries += 1
+
+    def on_usage(_model, usage):
+        metrics = _current_turn.get()
+        if metrics:
+            metrics.llm_calls += 1
+            metrics.prompt_tokens += usage.prompt_tokens or 0
+            metrics.completion_tokens += usage.completion_tokens or 0
+            details = getattr(usage, "prompt_tokens_details", None)
+            metrics.cached_tokens += (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+    class CountBotCalls(BaseRequestMiddleware):
+        async def __call__(self, make_request, bot, method):
+            metrics = _current_turn.get()
+            if metrics:
+                metrics.bot_calls += 1
+            return await make_request(bot, method)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", on_query)
+    add_usage_listener(on_usage)
+    bot.session.middleware(CountBotCalls())
+
+
+async def _resolve(value, user_id: int):
+    """Подставляет {shown}, {color}, {size} (первый показанный товар) и {product:N} (товар с id N)"""
+    from app.ai_module.ai_consultant import user_states
+    from app.database.catalog import get_catalog
+
+    if isinstance(value, dict):
+        return {key: await _resolve(item, user_id) for key, item in value.items()}
+    if isinstance(value, list):
+        return [await _resolve(item, user_id) for item in value]
+    if not isinstance(value, str) or not _PLACEHOLDER_RE.search(value):
+        return value
+
+    catalog = await get_catalog()
+    shown = (user_states.get(user_id, {}).get("current_products") or [{}])[0] if user_id in user_states else {}
+
+    def substitute(match):
+        name = match.group(1)
+        if name.startswith("product:"):
+            product = catalog.get(int(name.split(":")[1]))
+            return product.name if product else ""
+        if name == "shown":
+            return str(shown.get("id", 0))
+        if name == "color":
+            return (shown.get("colors") or [""])[0]
+        return (shown.get("sizes") or [""])[0]
+
+    return _PLACEHOLDER_RE.sub(substitute, value)
+
+
+def _chat(user_id: int) -> Dict:
+    return {"id": user_id, "type": "private"}
+
+
+def _user(user_id: int) -> Dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Покупатель {user_id}", "language_code": "ru"}
+
+
+async def play_conversation(conversation: Dict, user_id: int, fake_openai: FakeOpenAI,
+                            results: List[TurnMetrics]) -> None:
+    from aiogram.types import Message, CallbackQuery
+    from app.ai_module.ai_consultant import process_message, process_callback, open_consultation, \
+        consultant_mailbox
+    from bot_instance import bot
+
+    message_ids = iter(range(1, 10 ** 6))
+    for turn in conversation["turns"]:
+        metrics = TurnMetrics(conversation["name"], turn.get("label") or ("text" if "text" in turn else "callback"))
+        token = _current_turn.set(metrics)
+        started = time.perf_counter()
+        try:
+            if "text" in turn:
+                text = await _resolve(turn["text"], user_id)
+                if turn.get("llm"):
+                    fake_openai.script(text, await _resolve(turn["llm"], user_id))
+                message = Message.model_validate({
+                    "message_id": next(message_ids), "date": int(time.time()), "chat": _chat(user_id),
+                    "from": _user(user_id), "text": text,
+                }, context={"bot": bot})
+                await process_message(message)
+            else:
+                data = await _resolve(turn["callback"], user_id)
+                callback = CallbackQuery.model_validate({
+                    "id": f"{user_id}-{next(message_ids)}", "from": _user(user_id), "chat_instance": str(user_id),
+                    "data": data,
+                    "message": {"message_id": next(message_ids), "date": int(time.time()), "chat": _chat(user_id),
+                                "from": {"id": 1, "is_bot": True, "first_name": "Bigser"},
+                                "photo": [{"file_id": "bench", "file_unique_id": "bench", "width": 1, "height": 1}],
+                                "caption": "bench"},
+                }, context={"bot": bot})
+                if data == "user_consultation":
+                    await open_consultation(callback)
+                else:
+                    await process_callback(callback)
+            await consultant_mailbox.wait_idle(user_id)
+        finally:
+            metrics.latency = time.perf_counter() - started
+            _current_turn.reset(token)
+        results.append(metrics)
+
+
+def summarize(results: List[TurnMetrics]) -> Dict:
+    groups: Dict[str, List[TurnMetrics]] = defaultdict(list)
+    for metrics in results:
+        groups[metrics.label].append(metrics)
+    groups["ALL"] = list(results)
+
+    summary = {}
+    for label, items in groups.items():
+        latencies = [m.latency for m in items]
+        count = len(items)
+        summary[label] = {
+            "turns": count,
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+            "p90_ms": round(percentile(latencies, 0.9) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "db_queries": round(sum(m.db_queries for m in items) / count, 2),
+            "llm_calls": round(sum(m.llm_calls for m in items) / count, 2),
+            "prompt_tokens": round(sum(m.prompt_tokens for m in items) / count, 1),
+            "cached_tokens": round(sum(m.cached_tokens for m in items) / count, 1),
+            "cache_hit_rate": round(sum(m.cached_tokens for m in items) / max(1, sum(m.prompt_tokens for m in items)), 3),
+            "completion_tokens": round(sum(m.completion_tokens for m in items) / count, 1),
+            "bot_calls": round(sum(m.bot_calls for m in items) / count, 2),
+        }
+    return summary
+
+
+def print_summary(summary: Dict) -> None:
+    columns = ["turns", "p50_ms", "p90_ms", "p99_ms", "db_queries", "llm_calls", "prompt_tokens",
+               "cached_tokens", "cache_hit_rate", "completion_tokens", "bot_calls"]
+    width = max(len(label) for label in summary) + 2
+    print("ход".ljust(width) + "".join(column.rjust(18) for column in columns))
+    for label, row in sorted(summary.items(), key=lambda item: (item[0] == "ALL", item[0])):
+        print(label.ljust(width) + "".join(str(row[column]).rjust(18) for column in columns))
+
+
+def compare(summary: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Ходы, у которых p90 задержки, число SQL-запросов или вызовов модели выросли больше допуска.
+    Для задержки рост меньше MIN_LATENCY_DELTA_MS считается шумом.
+    """
+    regressions = []
+    for label, row in summary.items():
+        base = baseline.get(label)
+        if not base:
+            continue
+        for column in ("p90_ms", "db_queries", "llm_calls"):
+            if column == "p90_ms" and row[column] - base[column] < MIN_LATENCY_DELTA_MS:
+                continue
+            if base[column] and row[column] > base[column] * (1 + tolerance):
+                regressions.append(f"{label}: {column} {base[column]} -> {row[column]}")
+    return regressions
+
+
+async def run(args) -> int:
+    workdir = tempfile.mkdtemp(prefix="bigser-bench-")
+    fake_openai = FakeOpenAI(latency=args.llm_latency, jitter=args.llm_jitter,
+                             tokens_per_second=args.tokens_per_second, seed=args.seed)
+    fake_bot = FakeBotAPI()
+    openai_runner, openai_url = await _start_site(fake_openai.app())
+    bot_runner, bot_url = await _start_site(fake_bot.app())
+
+    # Настройки приложения читаются при импорте модулей, поэтому задаются до импорта app.*
+    os.environ["SQLITE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.sqlite3')}"
+    os.environ["API_TOKEN"] = BENCH_TOKEN
+    os.environ["OPENAI_BASE_URL"] = f"{openai_url}/v1"
+    os.environ["AI_SESSION_DB_PATH"] = os.path.join(workdir, "sessions.sqlite3")
+
+    from aiogram.client.telegram import TelegramAPIServer
+    from bot_instance import bot
+    from app.database.models import engine
+    from app.ai_module.llm_client import close_llm_client
+    from benchmarks.seed_catalog import seed_catalog
+
+    bot.session.api = TelegramAPIServer.from_base(bot_url)
+
+    with open(args.conversations, encoding="utf-8") as f:
+        conversations = json.load(f)
+    user_ids = [FIRST_USER_ID + index for index in range(len(conversations) * args.users)]
+    await seed_catalog(args.products, user_ids, seed=args.seed)
+    _instrument()
+
+    results: List[TurnMetrics] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def play(conversation, user_id):
+        async with semaphore:
+            await play_conversation(conversation, user_id, fake_openai, results)
+
+    started = time.perf_counter()
+    user_iter = iter(user_ids)
+    await asyncio.gather(*(
+        play(conversation, next(user_iter)) for _ in range(args.users) for conversation in conversations
+    ))
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(results)
+    print(f"Каталог: {args.products} товаров, диалогов: {len(conversations) * args.users}, "
+          f"ходов: {len(results)}, время прогона: {elapsed:.1f} с")
+    print_summary(summary)
+    print(f"Вызовы Bot API: {dict(Counter(fake_bot.calls).most_common())}")
+    print(f"Запросов к модели: {fake_openai.requests}")
+
+    exit_code = 0
+    # Системный промпт и инструменты общие для всех диалогов - без попаданий в кэш префиксов
+    # промпт собран нестабильно (или имитация кэша сломана)
+    if summary["ALL"]["llm_calls"] and not summary["ALL"]["cached_tokens"]:
+        print("ОШИБКА: ни одного попадания в кэш префиксов промпта (cached_tokens = 0)")
+        exit_code = 1
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "summary": summary, "turns": [asdict(m) for m in results]},
+                      f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(summary, json.load(f)["summary"], args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        exit_code = 1 if regressions else exit_code
+
+    await close_llm_client()
+    await bot.session.close()
+    await engine.dispose()
+    await openai_runner.cleanup()
+    await bot_runner.cleanup()
+    return exit_code
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Замер конвейера ИИ-консультанта на записанных диалогах")
+    parser.add_argument("--conversations", default=DEFAULT_CONVERSATIONS, help="JSON с диалогами")
+    parser.add_argument("--products", type=int, default=300, help="размер каталога")
+    parser.add_argument("--users", type=int, default=5, help="сколько раз проиграть каждый диалог")
+    parser.add_argument("--concurrency", type=int, default=10, help="одновременных покупателей")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="задержка до первого токена, с")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="разброс задержки, с")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="скорость генерации ответа")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="куда сохранить результат")
+    parser.add_argument("--baseline", help="результат прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост метрик относительно baseline")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import random
+from typing import Iterable
+
+from app.database.models import async_main, async_session, Category, Subcategory, Color, Size, Product, \
+    ProductPhoto, User, Setting
+
+# Словари для генерации правдоподобного каталога спортивной одежды
+CATEGORIES = {
+    "Одежда": {
+        "Куртки": ("куртка", ["ветровка", "зимняя", "утеплённая", "softshell", "лёгкая"]),
+        "Штаны": ("штаны", ["спортивные", "утеплённые", "беговые", "тренировочные"]),
+        "Футболки": ("футболка", ["хлопковая", "дышащая", "компрессионная", "оверсайз"]),
+        "Худи": ("худи", ["флисовое", "на молнии", "базовое"]),
+        "Шорты": ("шорты", ["беговые", "баскетбольные", "для зала"]),
+    },
+    "Обувь": {
+        "Кроссовки": ("кроссовки", ["беговые", "баскетбольные", "для зала", "трейловые"]),
+        "Кеды": ("кеды", ["классические", "высокие"]),
+    },
+    "Аксессуары": {
+        "Рюкзаки": ("рюкзак", ["городской", "спортивный", "туристический"]),
+        "Шапки": ("шапка", ["вязаная", "флисовая"]),
+    },
+}
+BRANDS = ["Bigser", "Nord", "Stride", "Alpha", "Pulse", "Terra"]
+COLORS = ["Черный", "Белый", "Темно синий", "Серый", "Красный", "Зеленый", "Бежевый", "Синий"]
+CLOTHING_SIZES = ["XS", "S", "M", "L", "XL", "XXL"]
+SHOE_SIZES = ["39", "40", "41", "42", "43", "44", "45"]
+MATERIALS = ["полиэстер", "хлопок", "нейлон", "флис", "мембрана", "сетка"]
+USAGES = ["бег", "тренировки в зале", "повседневная носка", "туризм", "зима"]
+
+
+async def seed_catalog(products: int, telegram_ids: Iterable[int], seed: int = 0) -> None:
+    """
+    Создаёт схему и наполняет пустую БД: каталог из products товаров (по 2 фото),
+    покупателей с заполненными данными для оформления и ключ OPENAI_API для клиента.
+    """
+    rnd = random.Random(seed)
+    await async_main()
+    async with async_session() as session:
+        colors = [Color(name=name) for name in COLORS]
+        clothing_sizes = [Size(size=size) for size in CLOTHING_SIZES]
+        shoe_sizes = [Size(size=size) for size in SHOE_SIZES]
+        session.add_all(colors + clothing_sizes + shoe_sizes)
+
+        subcategories = []
+        for category_name, subs in CATEGORIES.items():
+            category = Category(name=category_name)
+            session.add(category)
+            for sub_name, spec in subs.items():
+                subcategory = Subcategory(name=sub_name, category=category)
+                session.add(subcategory)
+                subcategories.append((subcategory, category_name, spec))
+        await session.flush()
+
+        for index in range(products):
+            subcategory, category_name, (product_type, adjectives) = subcategories[index % len(subcategories)]
+            sizes = shoe_sizes if category_name == "Обувь" else clothing_sizes
+            product = Product(
+                name=f"{product_type.capitalize()} {rnd.choice(adjectives)} {rnd.choice(BRANDS)} {index + 1}",
+                price=rnd.randrange(900, 15000, 100),
+                color_ids=sorted(color.id for color in rnd.sample(colors, rnd.randint(1, 4))),
+                size_ids=sorted(size.id for size in rnd.sample(sizes, rnd.randint(2, len(sizes)))),
+                description=f"{product_type.capitalize()} для активного отдыха и спорта. "
+                            f"Удобная посадка, прочные швы, подходит для ежедневной носки.",
+                product_type=product_type,
+                material=rnd.choice(MATERIALS),
+                features=rnd.choice(["водоотталкивающая пропитка", "светоотражающие элементы",
+                                     "быстро сохнет", "карманы на молнии"]),
+                usage=rnd.choice(USAGES),
+                subcategory_id=subcategory.id,
+            )
+            session.add(product)
+            await session.flush()
+            session.add_all([ProductPhoto(file_id=f"bench-photo-{product.id}-{n}", product_id=product.id)
+                             for n in range(2)])
+
+        session.add_all([
+            User(telegram_id=str(telegram_id), full_name=f"Покупатель {telegram_id}", phone_number="+996700000000",
+                 address="Бишкек, ул. Тестовая 1", role="USER")
+            for telegram_id in telegram_ids
+        ])
+        session.add(Setting(key="OPENAI_API", value="sk-bench"))
+        await session.commit()
@@ -2,11 +2,15 @@ import logging
 import asyncio
 from aiogram import Dispatcher
 
-from app.ai_module.ai_consultant import ai_router
+from app.ai_module.ai_consultant import ai_router, consultant_mailbox
 from app.register.registerHandlers import router
 from app.database.models import async_main
 from bot_instance import bot, dp  # Импортируем bot и dp
 from app.database import requests as rq
+from app.ai_module.llm_client import init_llm_client, close_llm_client
+from app.ai_module.session_store import run_session_maintenance, flush_all_sessions
+from app.ai_module.llm_scheduler import run_llm_stats_logger
+from app.database.recommender import run_recommender_job
 
 # Настройка логирования только для консоли
 logging.basicConfig(
@@ -30,12 +34,23 @@ async def main():
     logger.info("Роутеры зарегистрированы. Начинается polling бота.")
 
     openai_api_key = await rq.get_setting_value(key="OPENAI_API")
+    await init_llm_client(openai_api_key)  # Общий клиент OpenAI создаётся один раз при старте
+
+    session_maintenance = asyncio.create_task(run_session_maintenance())  # Выгрузка простаивающих сессий
+    llm_stats = asyncio.create_task(run_llm_stats_logger())  # Загрузка очереди запросов к модели
+    recommender = asyncio.create_task(run_recommender_job())  # Пересчёт связанных товаров
 
     try:
         await dp.start_polling(bot)
     except Exception as e:
         logger.exception("Ошибка при запуске polling")
     finally:
+        session_maintenance.cancel()
+        llm_stats.cancel()
+        recommender.cancel()
+        await consultant_mailbox.join(timeout=10)  # Даём текущим ответам консультанта завершиться
+        flush_all_sessions()  # Корзины и диалоги переживают перезапуск
+        await close_llm_client()
         logger.info("Бот завершил работу.")
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+# Модели создают движок при импорте; тесты работают со своим движком на временном файле
+os.environ.setdefault("SQLITE_URL", "sqlite+aiosqlite://")
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.database.models import Base, OrderGroup
+from app.database.migrations import MIGRATIONS, run_migrations
+
+# Таблицы в том виде, в каком их создавал код до order_group_orders и сводки групп
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL, telegram_id VARCHAR(200) NOT NULL, full_name VARCHAR(255),
+        address VARCHAR, phone_number VARCHAR(20), role VARCHAR(20) NOT NULL, PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE products (
+        id INTEGER NOT NULL, name VARCHAR(255) NOT NULL, price DECIMAL(10, 2) NOT NULL, color_ids JSON,
+        size_ids JSON, description VARCHAR, product_type VARCHAR, material VARCHAR, features VARCHAR,
+        usage VARCHAR, temperature_range VARCHAR, subcategory_id INTEGER, PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE orders (
+        id INTEGER NOT NULL, user_id INTEGER NOT NULL, processed_by_id INTEGER,
+        order_datetime DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL, status VARCHAR(50) NOT NULL,
+        delivery_method VARCHAR(100), PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE order_items (
+        id INTEGER NOT NULL, order_id INTEGER NOT NULL, product_id INTEGER NOT NULL, quantity INTEGER NOT NULL,
+        chosen_color INTEGER, chosen_size INTEGER, PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE order_groups (
+        id INTEGER NOT NULL, user_id VARCHAR(200) NOT NULL, processed_by_id VARCHAR(200),
+        order_ids JSON NOT NULL, PRIMARY KEY (id)
+    )""",
+]
+
+# orders.user_id хранит telegram_id клиента. Первичный ключ "чужого" пользователя совпадает
+# с telegram_id покупательницы, чтобы соединение по users.id дало неверное имя.
+BASELINE_ROWS = [
+    "INSERT INTO users (id, telegram_id, full_name, role) VALUES (1, '2', 'Анна', 'USER'), "
+    "(2, '100', 'Иван', 'USER')",
+    "INSERT INTO products (id, name, price) VALUES (1, 'Куртка', 1500.00), (2, 'Шапка', 999.50)",
+    "INSERT INTO orders (id, user_id, order_datetime, status) VALUES "
+    "(1, 2, '2024-03-01 10:00:00', 'Выполнено'), (2, 2, '2024-03-01 10:05:00', 'Выполнено')",
+    "INSERT INTO order_items (order_id, product_id, quantity) VALUES (1, 1, 2), (2, 2, 1)",
+    "INSERT INTO order_groups (id, user_id, processed_by_id, order_ids) VALUES (1, '2', '7', '[1, 2]')",
+]
+
+SNAPSHOT_TABLES = ["order_groups", "order_group_orders", "schema_version", "orders", "order_items"]
+
+
+class MigrationsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(self.workdir.name, 'db.sqlite3')}")
+        async with self.engine.begin() as conn:
+            for statement in BASELINE_SCHEMA + BASELINE_ROWS:
+                await conn.execute(text(statement))
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+        self.workdir.cleanup()
+
+    async def migrate(self):
+        # Как async_main при старте бота
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await run_migrations(conn)
+
+    async def snapshot(self):
+        async with self.engine.connect() as conn:
+            return {
+                table: (await conn.execute(text(f"SELECT * FROM {table} ORDER BY 1"))).all()
+                for table in SNAPSHOT_TABLES
+            }
+
+    async def get_group(self):
+        async with AsyncSession(self.engine) as session:
+            return await session.scalar(select(OrderGroup).where(OrderGroup.id == 1))
+
+    async def test_baseline_database_gets_group_summary(self):
+        await self.migrate()
+
+        group = await self.get_group()
+        self.assertEqual(group.order_ids, [1, 2])
+        self.assertEqual(group.status, "Выполнено")
+        self.assertEqual(group.item_count, 3)
+        self.assertEqual(Decimal(str(group.total_amount)), Decimal("3999.50"))
+        self.assertEqual(group.customer_name, "Анна")
+        self.assertEqual(group.created_at, datetime(2024, 3, 1, 10, 0))
+
+        async with self.engine.connect() as conn:
+            versions = (await conn.scalars(text("SELECT version FROM schema_version ORDER BY version"))).all()
+        self.assertEqual(versions, [version for version, _, _ in MIGRATIONS])
+
+    async def test_second_run_changes_nothing(self):
+        await self.migrate()
+        before = await self.snapshot()
+        await self.migrate()
+        self.assertEqual(await self.snapshot(), before)
+
+    async def test_customer_names_fixed_after_version_3(self):
+        await self.migrate()
+        # База, сводка которой заполнена версией 2 с соединением по users.id
+        async with self.engine.begin() as conn:
+            await conn.execute(text("UPDATE order_groups SET customer_name = 'Иван'"))
+            await conn.execute(text("DELETE FROM schema_version WHERE version > 3"))
+
+        await self.migrate()
+        self.assertEqual((await self.get_group()).customer_name, "Анна")
+
+
+if __name__ == "__main__":
+    unittest.main()